@@ -1,23 +1,119 @@
 
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash, g, Response, stream_with_context
 from flask_socketio import SocketIO, emit, disconnect
-import sqlite3
 import datetime
 import os
 import json
+import atexit
+import time
+import csv
+import io
+import zlib
 from functools import wraps
 from vpn.server import VPNServer
 from vpn.logger import Logger
+from vpn.db import Database
+from vpn.workers import OrderedTaskRunner
+from vpn.stats import StatsBroadcaster
+from vpn.presence import PresenceRegistry
+from vpn.users import UserStore, UserStoreBusy
+from vpn.metrics import REGISTRY as metrics
+from vpn.profiler import SamplingProfiler
+from vpn.retention import RetentionManager
+from vpn.analytics import Analytics
+from vpn.shared import create_shared_state
+from vpn.pubsub import socketio_queue_options
+from vpn.tail import LogTail
+from vpn.cache import ResponseCache
+from vpn.admission import AdmissionController, RATE_LIMITED_EVENT
+from vpn import wire
 
 # Initialize Flask app
 from datetime import timedelta
+from werkzeug.middleware.proxy_fix import ProxyFix
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = 'vpn_simulation_secret_key'
 # Session lifetime: 1 day
 app.permanent_session_lifetime = timedelta(days=1)
-socketio = SocketIO(app, cors_allowed_origins="*")
+# SQLite database shared by the logger and the node routes
+app.config['DATABASE'] = os.environ.get('VPN_DATABASE', 'database/vpn_logs.db')
+app.config['DB_POOL_SIZE'] = 8
+# Log writes go through a batched background writer; set to False for synchronous commits
+app.config['LOG_WRITE_BEHIND'] = os.environ.get('VPN_LOG_WRITE_BEHIND', '1') == '1'
+app.config['LOG_BATCH_SIZE'] = 500
+app.config['LOG_FLUSH_INTERVAL'] = 0.5
+app.config['LOG_QUEUE_SIZE'] = 10000
+# A full queue makes log calls wait for the writer rather than drop audit rows;
+# VPN_LOG_BLOCK_WHEN_FULL=0 drops (with a warning) to keep handlers from stalling
+app.config['LOG_BLOCK_WHEN_FULL'] = os.environ.get('VPN_LOG_BLOCK_WHEN_FULL', '1') == '1'
+# 'async' answers send_message from a background task so the socket handler
+# returns at once; 'sync' processes inline
+app.config['MESSAGE_PROCESSING'] = os.environ.get('VPN_MESSAGE_PROCESSING', 'async')
+# Simulated processing delay range in seconds, e.g. VPN_MESSAGE_LATENCY=0,0 for load tests
+app.config['MESSAGE_LATENCY'] = tuple(
+    float(v) for v in os.environ.get('VPN_MESSAGE_LATENCY', '0.1,0.5').split(',')
+)
+# Minimum seconds between server_stats_update broadcasts
+app.config['STATS_BROADCAST_INTERVAL'] = 1.0
+# Nodes count as active for NODE_TTL seconds after their last heartbeat
+app.config['NODE_TTL'] = 60
+app.config['NODE_CHECKPOINT_INTERVAL'] = 5.0
+# PBKDF2 work factor for stored passwords and the size of the hashing pool
+app.config['PASSWORD_HASH_ITERATIONS'] = int(os.environ.get('VPN_PASSWORD_HASH_ITERATIONS', '200000'))
+app.config['PASSWORD_HASH_WORKERS'] = 2
+# Recent messages kept per connected client
+app.config['CLIENT_HISTORY_DEPTH'] = 50
+# Most messages accepted by one send_message_batch event
+app.config['MESSAGE_BATCH_MAX'] = 100
+# Let unambiguous abbreviations select a chat command ("st" -> "status")
+app.config['COMMAND_PREFIX_MATCHING'] = os.environ.get('VPN_COMMAND_PREFIX_MATCHING', '0') == '1'
+# Admission control for send_message: messages per second and burst per
+# socket and per client IP (0 disables), and the most messages processed at
+# once before new ones are shed with a rate_limited event
+app.config['CLIENT_MESSAGE_RATE'] = float(os.environ.get('VPN_CLIENT_MESSAGE_RATE', '10'))
+app.config['CLIENT_MESSAGE_BURST'] = 20
+app.config['IP_MESSAGE_RATE'] = float(os.environ.get('VPN_IP_MESSAGE_RATE', '100'))
+app.config['IP_MESSAGE_BURST'] = 200
+app.config['MAX_IN_FLIGHT_MESSAGES'] = int(os.environ.get('VPN_MAX_IN_FLIGHT_MESSAGES', '256'))
+# Page sizes for /api/logs/*
+app.config['LOG_PAGE_DEFAULT'] = 100
+app.config['LOG_PAGE_MAX'] = 1000
+# Rows older than RETENTION_DAYS move to per-day archives in ARCHIVE_DIR
+app.config['RETENTION_ENABLED'] = os.environ.get('VPN_RETENTION', '1') == '1'
+app.config['RETENTION_DAYS'] = int(os.environ.get('VPN_RETENTION_DAYS', '30'))
+app.config['RETENTION_INTERVAL'] = 300
+app.config['ARCHIVE_DIR'] = 'database/archive'
+# Seconds between live log tail pushes to subscribed dashboards
+app.config['LOG_TAIL_INTERVAL'] = 0.25
+# Rows fetched per chunk by the streaming log exports
+app.config['EXPORT_BATCH_SIZE'] = 1000
+# Seconds between analytics counter checkpoints
+app.config['ANALYTICS_CHECKPOINT_INTERVAL'] = 2.0
+# Multi-process deployment (see vpn/cluster.py): 'local' or 'sqlite' client
+# registry and counters, and the Socket.IO message queue ('', 'sqlite' or a
+# redis:// / amqp:// URL) that relays emits between workers
+app.config['SHARED_STATE'] = os.environ.get('VPN_SHARED_STATE', 'local')
+app.config['MESSAGE_QUEUE'] = os.environ.get('VPN_MESSAGE_QUEUE', '')
+# Trust X-Forwarded-For from the sticky proxy in front of the workers
+app.config['TRUSTED_PROXY'] = os.environ.get('VPN_TRUSTED_PROXY', '0') == '1'
+if app.config['TRUSTED_PROXY']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
+# Read API responses are cached until the logger or presence registry writes.
+# Other workers' writes don't bump this process's counters, so under
+# vpn.cluster entries also expire after RESPONSE_CACHE_MAX_AGE seconds
+app.config['RESPONSE_CACHE_SIZE'] = 256
+app.config['RESPONSE_CACHE_MAX_AGE'] = None if app.config['SHARED_STATE'] == 'local' else 1.0
+# Server stats change with every request, so they're only reused this long
+app.config['STATS_CACHE_MAX_AGE'] = 1.0
+# Threads serving the Flask routes when run on asyncio (see vpn/asgi.py)
+app.config['ASGI_WSGI_THREADS'] = 16
+# Let clients that connect with auth {'codec': 'msgpack'} receive MessagePack
+# frames (needs the msgpack package; see vpn/wire.py)
+app.config['WIRE_MSGPACK'] = os.environ.get('VPN_WIRE_MSGPACK', '1') == '1'
+socketio = SocketIO(app, cors_allowed_origins="*", serializer=wire.JSONPacket,
+                    **socketio_queue_options(app.config['MESSAGE_QUEUE']))
  
 # Logout route (must be after app is defined)
 @app.route('/logout')
@@ -37,63 +133,141 @@ if not os.path.exists(USER_DATA_FILE):
     with open(USER_DATA_FILE, 'w') as f:
         json.dump({}, f)
 
+# Accounts are cached in memory and reloaded when the file changes
+user_store = UserStore(
+    USER_DATA_FILE,
+    iterations=app.config['PASSWORD_HASH_ITERATIONS'],
+    hash_workers=app.config['PASSWORD_HASH_WORKERS']
+)
+
+# Connection pool used for every database access; creates tables if they don't exist
+db = Database(app.config['DATABASE'], pool_size=app.config['DB_POOL_SIZE'])
+db.init_schema()
+
+# Connected clients and message counters, shared between worker processes
+shared_state = create_shared_state(app.config['SHARED_STATE'], db)
+shared_state.start(socketio)
+atexit.register(shared_state.close)
+
+# Incremental counters behind /api/analytics, fed by the logger below.
+# Registered before logger.close so the final flush is counted (atexit runs LIFO)
+analytics = Analytics(db, checkpoint_interval=app.config['ANALYTICS_CHECKPOINT_INTERVAL'])
+analytics.start(socketio)
+atexit.register(analytics.checkpoint)
+
 # Initialize VPN server and logger
-logger = Logger()
-vpn_server = VPNServer(logger)
-
-# Create database tables if they don't exist
-conn = sqlite3.connect('database/vpn_logs.db')
-cursor = conn.cursor()
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS connection_logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    client_id TEXT,
-    ip_address TEXT,
-    connection_time TIMESTAMP,
-    disconnection_time TIMESTAMP NULL,
-    status TEXT
+logger = Logger(
+    db_path=app.config['DATABASE'],
+    db=db,
+    async_writes=app.config['LOG_WRITE_BEHIND'],
+    batch_size=app.config['LOG_BATCH_SIZE'],
+    flush_interval=app.config['LOG_FLUSH_INTERVAL'],
+    queue_size=app.config['LOG_QUEUE_SIZE'],
+    block_when_full=app.config['LOG_BLOCK_WHEN_FULL']
 )
-''')
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS message_logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    client_id TEXT,
-    ip_address TEXT,
-    message TEXT,
-    timestamp TIMESTAMP,
-    direction TEXT
+logger.add_listener(analytics.record)
+# Rows left 'connected' by a crash are closed when this is the only process;
+# under vpn.cluster the launcher closes them once and workers just index the open ones.
+# Analytics loads the open sessions first so the closes count as disconnections
+analytics.load()
+logger.recover_sessions(close_stale=app.config['SHARED_STATE'] == 'local')
+# Token buckets and the in-flight cap applied to every client's messages
+admission = AdmissionController(
+    client_rate=app.config['CLIENT_MESSAGE_RATE'],
+    client_burst=app.config['CLIENT_MESSAGE_BURST'],
+    ip_rate=app.config['IP_MESSAGE_RATE'],
+    ip_burst=app.config['IP_MESSAGE_BURST'],
+    max_in_flight=app.config['MAX_IN_FLIGHT_MESSAGES']
 )
-''')
-# --- NEW: nodes table for "everyone is a server+client" presence tracking ---
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS nodes (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    session_id TEXT,
-    username TEXT,
-    ip TEXT,
-    user_agent TEXT,
-    is_server INTEGER DEFAULT 1,
-    is_client INTEGER DEFAULT 1,
-    last_seen TIMESTAMP
+vpn_server = VPNServer(
+    logger,
+    latency=app.config['MESSAGE_LATENCY'],
+    history_depth=app.config['CLIENT_HISTORY_DEPTH'],
+    shared=shared_state,
+    prefix_matching=app.config['COMMAND_PREFIX_MATCHING'],
+    admission=admission
 )
-''')
-cursor.execute('CREATE INDEX IF NOT EXISTS idx_nodes_last_seen ON nodes(last_seen)')
-conn.commit()
-conn.close()
+# Per-client ordered background processing for send_message
+message_runner = OrderedTaskRunner(socketio.start_background_task)
+# Make sure queued log events reach the database on shutdown
+atexit.register(logger.close)
 
-# Server stats
+# Server stats; client and message counts live in shared_state so every worker agrees
 server_stats = {
-    'start_time': datetime.datetime.now(),
-    'active_clients': 0,
-    'total_messages': 0
+    'start_time': datetime.datetime.now()
 }
 
-# Helpers for nodes presence
-def _node_db():
-    return sqlite3.connect('database/vpn_logs.db')
+def _stats_snapshot():
+    return {
+        'active_clients': vpn_server.get_active_clients_count(),
+        'total_messages': shared_state.counter('total_messages')
+    }
+
+# Dashboards opt in with 'subscribe_stats' and get coalesced, changed-only updates
+stats_broadcaster = StatsBroadcaster(socketio, _stats_snapshot, interval=app.config['STATS_BROADCAST_INTERVAL'])
+
+# Live log tail pushed to dashboards; with several workers each one polls the shared tables
+log_tail = LogTail(
+    socketio,
+    logger,
+    interval=app.config['LOG_TAIL_INTERVAL'],
+    source='listener' if app.config['SHARED_STATE'] == 'local' else 'poll'
+)
 
-def _now():
-    return datetime.datetime.utcnow()
+# Presence of nodes is tracked in memory and checkpointed to the nodes table;
+# with several workers the active list is read back from that table
+presence = PresenceRegistry(
+    db,
+    ttl=app.config['NODE_TTL'],
+    checkpoint_interval=app.config['NODE_CHECKPOINT_INTERVAL'],
+    shared=app.config['SHARED_STATE'] != 'local'
+)
+presence.load()
+atexit.register(presence.checkpoint)
+
+# Hourly rollups, archival and incremental vacuum of the log tables
+retention = RetentionManager(
+    db,
+    archive_dir=app.config['ARCHIVE_DIR'],
+    max_age_days=app.config['RETENTION_DAYS'],
+    interval=app.config['RETENTION_INTERVAL']
+)
+if app.config['RETENTION_ENABLED']:
+    retention.start(socketio)
+
+# Serialized responses of the polled read APIs, see _cached_response
+response_cache = ResponseCache(max_entries=app.config['RESPONSE_CACHE_SIZE'])
+
+# Request timing for every Flask route
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe(
+            'vpn_http_request_seconds',
+            time.perf_counter() - started,
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+metrics.describe('vpn_http_request_seconds', 'Flask request handling time by route')
+metrics.describe('vpn_socketio_event_seconds', 'Socket.IO event handler time by event')
+metrics.gauge('vpn_active_clients', 'Connected Socket.IO clients', vpn_server.get_active_clients_count)
+metrics.gauge('vpn_messages_total', 'Messages handled by all workers', lambda: shared_state.counter('total_messages'))
+metrics.gauge('vpn_log_queue_depth', 'Log events waiting for the background writer', lambda: logger.stats()['queued'])
+metrics.gauge('vpn_log_events_dropped', 'Log events dropped because the queue was full', lambda: logger.stats()['dropped'])
+metrics.gauge('vpn_db_connections_open', 'Open pooled SQLite connections', lambda: db.stats()['open_connections'])
+metrics.gauge('vpn_db_checkout_wait_seconds', 'Total time spent waiting for a pooled connection',
+              lambda: db.stats()['wait_time_seconds'])
+
+# Sampling profiler, switched on and off through /api/debug/profiler
+profiler = SamplingProfiler()
 
 # Routes
 
@@ -120,9 +294,12 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username', '')
         password = request.form.get('password', '')
-        with open(USER_DATA_FILE, 'r') as f:
-            users = json.load(f)
-        if username in users and users[username] == password:
+        try:
+            authenticated = user_store.authenticate(username, password)
+        except UserStoreBusy:
+            flash('Server is busy, please try again')
+            return render_template('login.html'), 503
+        if authenticated:
             session.permanent = True
             session['username'] = username
             return redirect(url_for('index'))
@@ -136,14 +313,14 @@ def signup():
     if request.method == 'POST':
         username = request.form.get('username', '')
         password = request.form.get('password', '')
-        with open(USER_DATA_FILE, 'r') as f:
-            users = json.load(f)
-        if username in users:
+        try:
+            created = user_store.create(username, password)
+        except UserStoreBusy:
+            flash('Server is busy, please try again')
+            return render_template('signup.html'), 503
+        if not created:
             flash('Username already exists')
         else:
-            users[username] = password
-            with open(USER_DATA_FILE, 'w') as f2:
-                json.dump(users, f2)
             flash('Account created! Please log in.')
             return redirect(url_for('login'))
     return render_template('signup.html')
@@ -164,8 +341,8 @@ def server():
     uptime_str = f"{hours}h {minutes}m {seconds}s"
     return render_template(
         'server.html',
-        active_clients=server_stats['active_clients'],
-        total_messages=server_stats['total_messages'],
+        active_clients=vpn_server.get_active_clients_count(),
+        total_messages=shared_state.counter('total_messages'),
         uptime=uptime_str
     )
 
@@ -175,182 +352,354 @@ def server():
 def logs():
     return render_template('logs.html')
 
+def _page_args():
+    """Parse limit/before_id/after_id query arguments for the log APIs"""
+    limit = request.args.get('limit', type=int) or app.config['LOG_PAGE_DEFAULT']
+    limit = max(1, min(limit, app.config['LOG_PAGE_MAX']))
+    return {
+        'limit': limit,
+        'before_id': request.args.get('before_id', type=int),
+        'after_id': request.args.get('after_id', type=int)
+    }
+
+def _page_response(logs, limit):
+    """JSON list response with cursors for the next/previous page in headers"""
+    response = jsonify(logs)
+    if logs:
+        response.headers['X-Next-Before-Id'] = str(logs[-1]['id'])
+        response.headers['X-Next-After-Id'] = str(logs[0]['id'])
+    response.headers['X-Has-More'] = '1' if len(logs) == limit else '0'
+    return response
+
+def _log_filters(*extra):
+    """Common log filters from the query string: date, from, to and ip"""
+    filters = {}
+    for arg in ('date', 'from', 'to') + extra:
+        if request.args.get(arg):
+            filters[arg] = request.args[arg]
+    # ip accepts an exact address, a dotted prefix or a CIDR block
+    if request.args.get('ip'):
+        filters['ip_address'] = request.args['ip']
+    return filters
+
+def _cached_response(generation, build, max_age=None):
+    """Serve build()'s response from response_cache while generation is unchanged
+
+    The key is the path plus the sorted non-empty query arguments. A client
+    sending the entry's ETag in If-None-Match gets an empty 304, so a
+    repeated poll costs neither a query nor serialization. Only 200
+    responses are cached.
+    """
+    key = (request.path, tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v)))
+    entry = response_cache.get(key, generation)
+    if entry is None:
+        response = build()
+        if not isinstance(response, Response) or response.status_code != 200:
+            return response
+        headers = [(k, v) for k, v in response.headers.items() if k != 'Content-Length']
+        entry = response_cache.put(key, generation, response.get_data(), headers, max_age=max_age)
+    if entry.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, headers=entry.headers)
+    response.set_etag(entry.etag)
+    # Let browsers keep the body but revalidate on every poll
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _logs_generation():
+    # Archiving deletes old rows, so a retention run invalidates too
+    return (logger.generation, retention.runs)
+
 @app.route('/api/logs/connections')
 def get_connection_logs():
-    date_filter = request.args.get('date', '')
-    ip_filter = request.args.get('ip', '')
-
-    conn = sqlite3.connect('database/vpn_logs.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    query = "SELECT * FROM connection_logs WHERE 1=1"
-    params = []
-
-    if date_filter:
-        query += " AND date(connection_time) = ?"
-        params.append(date_filter)
-
-    if ip_filter:
-        query += " AND ip_address LIKE ?"
-        params.append(f"%{ip_filter}%")
-
-    query += " ORDER BY connection_time DESC"
-
-    cursor.execute(query, params)
-    logs = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-
-    return jsonify(logs)
+    def build():
+        filters = _log_filters('status')
+        page = _page_args()
+        try:
+            logs = logger.get_connection_logs(filters, **page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return _page_response(logs, page['limit'])
+    return _cached_response(_logs_generation(), build, max_age=app.config['RESPONSE_CACHE_MAX_AGE'])
 
 @app.route('/api/logs/messages')
 def get_message_logs():
-    date_filter = request.args.get('date', '')
-    ip_filter = request.args.get('ip', '')
-    content_filter = request.args.get('content', '')
-
-    conn = sqlite3.connect('database/vpn_logs.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-
-    query = "SELECT * FROM message_logs WHERE 1=1"
-    params = []
-
-    if date_filter:
-        query += " AND date(timestamp) = ?"
-        params.append(date_filter)
-
-    if ip_filter:
-        query += " AND ip_address LIKE ?"
-        params.append(f"%{ip_filter}%")
-
-    if content_filter:
-        query += " AND message LIKE ?"
-        params.append(f"%{content_filter}%")
-
-    query += " ORDER BY timestamp DESC"
+    def build():
+        filters = _log_filters('direction')
+        if request.args.get('content'):
+            filters['message'] = request.args['content']
+        page = _page_args()
+        try:
+            logs = logger.get_message_logs(filters, **page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return _page_response(logs, page['limit'])
+    return _cached_response(_logs_generation(), build, max_age=app.config['RESPONSE_CACHE_MAX_AGE'])
+
+@app.route('/api/logs/messages/search')
+def search_message_logs():
+    text = request.args.get('q', '')
+    filters = _log_filters('direction')
+    limit = request.args.get('limit', type=int) or 20
+    limit = max(1, min(limit, app.config['LOG_PAGE_MAX']))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    try:
+        results = logger.search_messages(text, filters, limit=limit, offset=offset)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'results': results,
+        'limit': limit,
+        'offset': offset,
+        'next_offset': offset + limit if len(results) == limit else None
+    })
 
-    cursor.execute(query, params)
-    logs = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
 
-    return jsonify(logs)
+def _export_chunks(chunks, fmt):
+    """Encode (columns, rows) chunks from Logger.iter_* as NDJSON or CSV text"""
+    header_written = False
+    for columns, rows in chunks:
+        buffer = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(buffer)
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(columns, row)), default=str))
+                buffer.write('\n')
+        yield buffer.getvalue().encode()
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _export_response(name, iterate, filters):
+    """Streaming export; memory stays at one page of rows whatever the row count"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+    try:
+        chunks = iterate(filters, after_id=request.args.get('after_id', type=int),
+                         batch_size=app.config['EXPORT_BATCH_SIZE'])
+        # Run the query now so bad filters fail with a 400 before streaming starts
+        first = next(chunks, None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        if first is not None:
+            yield first
+            yield from chunks
+
+    body = _export_chunks(generate(), fmt)
+    filename = f'{name}.{fmt}'
+    mimetype = EXPORT_FORMATS[fmt]
+    if request.args.get('gzip') in ('1', 'true'):
+        body = _gzip_chunks(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.route('/api/logs/connections/export')
+def export_connection_logs():
+    # Resume an interrupted export with after_id=<last id received>
+    return _export_response('connection_logs', logger.iter_connection_logs, _log_filters('status'))
+
+@app.route('/api/logs/messages/export')
+def export_message_logs():
+    filters = _log_filters('direction')
+    if request.args.get('content'):
+        filters['message'] = request.args['content']
+    return _export_response('message_logs', logger.iter_message_logs, filters)
+
+@app.route('/api/logs/summary')
+def log_summary():
+    # Dashboard aggregates come from the hourly rollups, never the raw tables
+    hours = max(1, min(request.args.get('hours', 24, type=int), 24 * 90))
+    return jsonify(retention.summary(hours=hours))
+
+@app.route('/api/analytics')
+def get_analytics():
+    # Served from the incrementally maintained counters, never the raw tables
+    minutes = max(1, min(request.args.get('minutes', 60, type=int), analytics.minute_retention))
+    top = max(1, min(request.args.get('top', 10, type=int), 100))
+    return jsonify(analytics.snapshot(minutes=minutes, top=top))
+
+@app.cli.command('run-retention')
+def run_retention():
+    """Refresh rollups, archive old log rows and vacuum once."""
+    days = retention.run_once()
+    print(f'Archived {len(days)} day(s): {", ".join(days) or "none"}')
+
+@app.cli.command('enable-incremental-vacuum')
+def enable_incremental_vacuum():
+    """Rewrite the database with VACUUM so retention can release free pages."""
+    if db.enable_incremental_vacuum():
+        print('Switched to incremental auto-vacuum')
+    else:
+        print('Already using incremental auto-vacuum')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Backfill the message full-text index from message_logs."""
+    count = logger.rebuild_search_index()
+    print(f'Indexed {count} messages')
 
 @app.route('/api/server/stats')
 def get_server_stats():
+    return _cached_response(0, _server_stats_response, max_age=app.config['STATS_CACHE_MAX_AGE'])
+
+def _codec_counts():
+    # Connections on a non-JSON codec; everyone else is on JSON
+    codecs = getattr(socketio.server.manager, 'codecs', {})
+    counts = {codec: 0 for codec in wire.available_codecs() if codec != wire.JSON}
+    for codec in list(codecs.values()):
+        counts[codec] = counts.get(codec, 0) + 1
+    return counts
+
+def _server_stats_response():
     uptime = datetime.datetime.now() - server_stats['start_time']
     return jsonify({
-        'active_clients': server_stats['active_clients'],
-        'total_messages': server_stats['total_messages'],
-        'uptime_seconds': uptime.total_seconds()
+        'active_clients': vpn_server.get_active_clients_count(),
+        'total_messages': shared_state.counter('total_messages'),
+        'uptime_seconds': uptime.total_seconds(),
+        'log_writer': logger.stats(),
+        'message_tasks': message_runner.stats(),
+        'stats_broadcaster': stats_broadcaster.stats(),
+        'log_tail': log_tail.stats(),
+        'presence': presence.stats(),
+        'retention': retention.stats(),
+        'analytics': analytics.stats(),
+        'shared_state': shared_state.stats(),
+        'db_pool': db.stats(),
+        'commands': vpn_server.commands.stats(),
+        'response_cache': response_cache.stats(),
+        'wire_codecs': _codec_counts(),
+        'admission': admission.stats(),
+        'latency': {
+            'http': metrics.summary('vpn_http_request_seconds'),
+            'socketio': metrics.summary('vpn_socketio_event_seconds'),
+            'sqlite': metrics.summary('vpn_sqlite_statement_seconds')
+        }
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/profiler', methods=['GET', 'POST'])
+@login_required
+def debug_profiler():
+    if request.method == 'POST':
+        action = (request.get_json(silent=True) or request.form).get('action', '')
+        if action == 'start':
+            interval = (request.get_json(silent=True) or {}).get('interval')
+            if interval:
+                try:
+                    profiler.interval = max(0.001, float(interval))
+                except (TypeError, ValueError):
+                    return jsonify({'error': 'interval must be a number of seconds'}), 400
+            profiler.start()
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            return jsonify({'error': "action must be 'start' or 'stop'"}), 400
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    return jsonify(profiler.report(limit=request.args.get('limit', 25, type=int)))
+
 # --- NEW: Everyone who opens the site becomes an active node (server+client) ---
 
-@app.route('/api/nodes/register', methods=['POST'])
-def nodes_register():
+def _touch_node():
     # Use login username if available; else treat as guest
     sid = session.get('username') or request.cookies.get('session') or request.remote_addr
-    conn = _node_db()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO nodes (session_id, username, ip, user_agent, is_server, is_client, last_seen)
-        VALUES (?, ?, ?, ?, 1, 1, ?)
-    ''', (
+    presence.touch(
         sid,
         session.get('username'),
         request.headers.get('X-Forwarded-For', request.remote_addr),
-        request.headers.get('User-Agent', ''),
-        _now()
-    ))
-    conn.commit()
-    conn.close()
+        request.headers.get('User-Agent', '')
+    )
+    presence.start(socketio)
+
+@app.route('/api/nodes/register', methods=['POST'])
+def nodes_register():
+    _touch_node()
     return jsonify({'ok': True})
 
 @app.route('/api/nodes/heartbeat', methods=['POST'])
 def nodes_heartbeat():
-    sid = session.get('username') or request.cookies.get('session') or request.remote_addr
-    conn = _node_db()
-    cur = conn.cursor()
-    cur.execute('UPDATE nodes SET last_seen=? WHERE session_id=?', (_now(), sid))
-    if cur.rowcount == 0:
-        cur.execute('''
-            INSERT INTO nodes (session_id, username, ip, user_agent, is_server, is_client, last_seen)
-            VALUES (?, ?, ?, ?, 1, 1, ?)
-        ''', (
-            sid,
-            session.get('username'),
-            request.headers.get('X-Forwarded-For', request.remote_addr),
-            request.headers.get('User-Agent', ''),
-            _now()
-        ))
-    conn.commit()
-    conn.close()
+    _touch_node()
     return jsonify({'ok': True})
 
 @app.route('/api/nodes/active')
 def nodes_active():
-    cutoff = _now() - datetime.timedelta(seconds=60)
-    conn = _node_db()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute('SELECT username, ip, user_agent, last_seen FROM nodes WHERE last_seen >= ? ORDER BY last_seen DESC', (cutoff,))
-    rows = []
-    for r in cur.fetchall():
-        rows.append({
-            'username': r['username'],
-            'ip': r['ip'],
-            'user_agent': r['user_agent'],
-            'last_seen': r['last_seen']  # stored as timestamp; fine for JSON if string; else cast below
-        })
-    conn.close()
-    # ensure JSON-safe timestamp string
-    for r in rows:
-        if isinstance(r['last_seen'], (datetime.datetime, )):
-            r['last_seen'] = r['last_seen'].isoformat()
-    return jsonify({'active': rows, 'count': len(rows)})
+    def build():
+        rows = presence.active()
+        return jsonify({'active': rows, 'count': len(rows)})
+    # Expire nodes first so a timed-out heartbeat bumps the generation
+    presence.sweep()
+    return _cached_response(presence.generation, build, max_age=app.config['RESPONSE_CACHE_MAX_AGE'])
 
 # Socket events
 @socketio.on('connect')
-def handle_connect():
+@metrics.timed('vpn_socketio_event_seconds', event='connect')
+def handle_connect(auth=None):
     client_id = request.sid
     ip_address = request.remote_addr or '127.0.0.1'
+    requested = (auth or {}).get('codec') if isinstance(auth, dict) else None
+    codec = wire.use_codec(socketio.server, client_id, requested or request.args.get('codec'),
+                           enabled=app.config['WIRE_MSGPACK'])
 
     vpn_server.add_client(client_id, ip_address)
-    server_stats['active_clients'] += 1
 
     # Log connection
     logger.log_connection(client_id, ip_address)
 
     # Notify client of successful connection
-    emit('connection_status', {'status': 'connected', 'client_id': client_id, 'ip': ip_address})
-
-    # Broadcast updated stats to all clients
-    socketio.emit('server_stats_update', {
-        'active_clients': server_stats['active_clients'],
-        'total_messages': server_stats['total_messages']
+    emit('connection_status', {
+        'status': 'connected',
+        'client_id': client_id,
+        'ip': ip_address,
+        'codec': codec,
+        'connected_at': datetime.datetime.now()
     })
 
+    # Let the broadcaster push updated stats to subscribed dashboards
+    stats_broadcaster.mark_dirty()
+
 @socketio.on('disconnect')
+@metrics.timed('vpn_socketio_event_seconds', event='disconnect')
 def handle_disconnect():
     client_id = request.sid
     client = vpn_server.get_client(client_id)
+    log_tail.unsubscribe(client_id)
 
     if client:
         # Log disconnection
-        logger.log_disconnection(client_id, client['ip_address'])
+        logger.log_disconnection(client_id, client.ip_address)
 
         # Remove client
         vpn_server.remove_client(client_id)
-        server_stats['active_clients'] -= 1
 
-        # Broadcast updated stats to all clients
-        socketio.emit('server_stats_update', {
-            'active_clients': server_stats['active_clients'],
-            'total_messages': server_stats['total_messages']
-        })
+        # Let the broadcaster push updated stats to subscribed dashboards
+        stats_broadcaster.mark_dirty()
 
 @socketio.on('send_message')
+@metrics.timed('vpn_socketio_event_seconds', event='send_message')
 def handle_message(data):
     client_id = request.sid
     client = vpn_server.get_client(client_id)
@@ -358,29 +707,146 @@ def handle_message(data):
     if client and 'message' in data:
         message = data['message']
 
-        # Log message
-        logger.log_message(client_id, client['ip_address'], message, 'outgoing')
+        # Shed the message before it costs any writes or processing
+        refusal = admission.admit(client)
+        if refusal is not None:
+            emit(RATE_LIMITED_EVENT, dict(refusal, message=message))
+            return
+
+        # From here on process_and_reply owns the in-flight slot and releases it
+        if app.config['MESSAGE_PROCESSING'] == 'async':
+            # Runs after any earlier messages from this client, off the socket handler
+            try:
+                message_runner.submit(client_id, process_and_reply, client_id, client.ip_address, message)
+            except Exception:
+                admission.release()
+                raise
+        else:
+            process_and_reply(client_id, client.ip_address, message)
 
+@socketio.on('send_message_batch')
+@metrics.timed('vpn_socketio_event_seconds', event='send_message_batch')
+def handle_message_batch(data):
+    # data: {'messages': [{'seq': 1, 'message': 'ping'}, ...]}; seq defaults to the position
+    client_id = request.sid
+    client = vpn_server.get_client(client_id)
+    items = data.get('messages') if isinstance(data, dict) else None
+    if not client or not isinstance(items, list):
+        return {'error': 'Expected {"messages": [{"seq": ..., "message": ...}, ...]}'}
+    if len(items) > app.config['MESSAGE_BATCH_MAX']:
+        return {'error': f"At most {app.config['MESSAGE_BATCH_MAX']} messages per batch"}
+
+    batch = []
+    for position, item in enumerate(items):
+        if isinstance(item, dict) and isinstance(item.get('message'), str):
+            batch.append((item.get('seq', position), item['message']))
+    if not batch:
+        return {'accepted': 0}
+    seqs = [seq for seq, _ in batch]
+    messages = [message for _, message in batch]
+
+    # A batch costs one token per message and is admitted or shed whole; one
+    # larger than the burst waits for a full bucket and leaves it in debt
+    refusal = admission.admit(client, len(messages))
+    if refusal is not None:
+        emit(RATE_LIMITED_EVENT, dict(refusal, seqs=seqs))
+        return {'accepted': 0, 'rate_limited': refusal['reason']}
+
+    # From here on process_batch_and_reply owns the in-flight slot and releases it
+    if app.config['MESSAGE_PROCESSING'] == 'async':
+        # Queued behind this client's earlier single and batch messages
+        try:
+            message_runner.submit(client_id, process_batch_and_reply, client_id, client.ip_address, seqs, messages)
+        except Exception:
+            admission.release()
+            raise
+    else:
+        process_batch_and_reply(client_id, client.ip_address, seqs, messages)
+    return {'accepted': len(batch)}
+
+@socketio.on('get_history')
+def handle_get_history(data=None):
+    # Returned to the client as the event's acknowledgement
+    limit = (data or {}).get('limit')
+    try:
+        return vpn_server.get_history(request.sid, limit)
+    except ValueError as e:
+        return {'error': str(e)}
+
+@socketio.on('subscribe_stats')
+def handle_subscribe_stats():
+    stats_broadcaster.subscribe(request.sid)
+
+@socketio.on('unsubscribe_stats')
+def handle_unsubscribe_stats():
+    stats_broadcaster.unsubscribe(request.sid)
+
+@socketio.on('subscribe_log_tail')
+def handle_subscribe_log_tail(data=None):
+    # data: {'ip_address': ..., 'direction': ..., 'after': {'connection': id, 'message': id}}
+    data = data or {}
+    after = data.get('after')
+    try:
+        room = log_tail.subscribe(
+            request.sid,
+            ip_address=data.get('ip_address'),
+            direction=data.get('direction'),
+            after=after if isinstance(after, dict) else None
+        )
+    except ValueError as e:
+        return {'error': str(e)}
+    return {'room': room}
+
+@socketio.on('unsubscribe_log_tail')
+def handle_unsubscribe_log_tail():
+    log_tail.unsubscribe(request.sid)
+
+def process_and_reply(client_id, ip_address, message):
+    """Log a client message, process it and send the response
+
+    Gives back the message's admission slot even if logging or processing fails.
+    """
+    try:
+        # Log message
+        logger.log_message(client_id, ip_address, message, 'outgoing')
         # Process message (simulate VPN server processing)
         response = vpn_server.process_message(client_id, message)
-
-        # Log server response
-        logger.log_message(client_id, client['ip_address'], response, 'incoming')
-
-        # Send response back to client
-        emit('receive_message', {
-            'message': response,
-            'timestamp': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
-
-        # Update message count
-        server_stats['total_messages'] += 2  # One for client message, one for server response
-
-        # Broadcast updated stats to all clients
-        socketio.emit('server_stats_update', {
-            'active_clients': server_stats['active_clients'],
-            'total_messages': server_stats['total_messages']
-        })
+    finally:
+        admission.release()
+
+    # Log server response
+    logger.log_message(client_id, ip_address, response, 'incoming')
+
+    # Send response back to client; its socket lives in this worker, so skip the message queue
+    socketio.emit('receive_message', {
+        'message': response,
+        'timestamp': datetime.datetime.now()
+    }, to=client_id, ignore_queue=True)
+
+    # Update message count
+    shared_state.incr('total_messages', 2)  # One for client message, one for server response
+
+    # Let the broadcaster push updated stats to subscribed dashboards
+    stats_broadcaster.mark_dirty()
+
+def process_batch_and_reply(client_id, ip_address, seqs, messages):
+    """Log and process a message batch, log the responses together and send one reply"""
+    try:
+        # Log every message in one transaction
+        logger.log_messages(client_id, ip_address, messages, 'outgoing')
+        responses = vpn_server.process_messages(client_id, messages)
+    finally:
+        admission.release()
+    logger.log_messages(client_id, ip_address, responses, 'incoming')
+
+    timestamp = datetime.datetime.now()
+    socketio.emit('receive_message_batch', {
+        'responses': [{'seq': seq, 'message': response} for seq, response in zip(seqs, responses)],
+        'timestamp': timestamp
+    }, to=client_id, ignore_queue=True)
+
+    shared_state.incr('total_messages', 2 * len(messages))
+    stats_broadcaster.mark_dirty()
 
 if __name__ == '__main__':
     socketio.run(app, debug=True, host='127.0.0.1', port=5001)
@@ -0,0 +1,126 @@
+"""Benchmark suite entry point
+
+    python -m benchmarks run --sizes 10000,1000000 --output current.json
+    python -m benchmarks compare baseline.json current.json --threshold 0.15
+
+Generated databases are cached in --workdir and keyed by size and seed, so
+repeated runs compare like with like.
+"""
+import argparse
+import datetime
+import json
+import platform
+import sqlite3
+import subprocess
+import sys
+import os
+import tempfile
+
+from benchmarks import suite
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    selected = set(args.only.split(',')) if args.only else {'log_message', 'queries', 'nodes'}
+    results = {}
+    if 'log_message' in selected:
+        results.update(suite.bench_log_message(args.workdir, count=args.writes))
+    if 'queries' in selected:
+        for rows in args.sizes:
+            print(f'Querying {rows} rows...', file=sys.stderr)
+            results.update(suite.bench_log_queries(args.workdir, rows, seed=args.seed, repeat=args.repeat))
+    if 'nodes' in selected:
+        results.update(suite.bench_nodes(args.workdir))
+
+    report = {
+        'meta': {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'sizes': args.sizes
+        },
+        'results': results
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+
+    rows = []
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name], current[name]
+        if not old['value']:
+            continue
+        change = (new['value'] - old['value']) / old['value']
+        # Positive "worse" means the metric moved in the bad direction
+        worse = -change if old['higher_is_better'] else change
+        status = 'REGRESSION' if worse > args.threshold else ('improved' if worse < -args.threshold else 'ok')
+        # Sub-millisecond queries jitter by large ratios; ignore tiny absolute moves
+        if old['unit'] == 'ms' and abs(new['value'] - old['value']) < args.min_ms:
+            status = 'ok'
+        regressions += status == 'REGRESSION'
+        rows.append({'name': name, 'baseline': old['value'], 'current': new['value'],
+                     'unit': old['unit'], 'change': change, 'status': status})
+
+    print(json.dumps({
+        'threshold': args.threshold,
+        'regressions': regressions,
+        'missing': sorted(set(baseline) - set(current)),
+        'new': sorted(set(current) - set(baseline)),
+        'results': rows
+    }, indent=2))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Logging and query benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the suite and print JSON results')
+    run_parser.add_argument('--sizes', default='10000',
+                            type=lambda value: [int(size) for size in value.split(',')],
+                            help='comma-separated message_logs row counts, e.g. 10000,1000000,10000000')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--repeat', type=int, default=20, help='timed runs per query')
+    run_parser.add_argument('--writes', type=int, default=5000, help='log_message calls per mode')
+    run_parser.add_argument('--only', help='comma-separated subset of log_message,queries,nodes')
+    run_parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'vpn-benchmarks'))
+    run_parser.add_argument('--output', help='also write the JSON results to this file')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='flag regressions against a saved baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.15,
+                                help='relative change treated as a regression (default 0.15)')
+    compare_parser.add_argument('--min-ms', type=float, default=0.25,
+                                help='ignore latency changes smaller than this many milliseconds')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""Seeded synthetic data for the benchmark suite"""
+import datetime
+import os
+import random
+
+from vpn.db import Database
+
+START = datetime.datetime(2025, 1, 1)
+SPAN_DAYS = 30
+
+WORDS = (
+    'ping status help disconnect tunnel route packet encrypted payload exit node '
+    'latency gateway handshake session key rotate dns leak firewall proxy relay'
+).split()
+
+
+def ip_pool(rng, size=5000):
+    """Addresses spread over a few private ranges, so prefix/CIDR filters have work to do"""
+    pool = set()
+    while len(pool) < size:
+        first = rng.choice((10, 172, 192))
+        pool.add(f"{first}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}")
+    return sorted(pool)
+
+
+def _timestamps(rng, count):
+    """count increasing timestamps spread over SPAN_DAYS"""
+    step = SPAN_DAYS * 86400 / max(count, 1)
+    for i in range(count):
+        yield START + datetime.timedelta(seconds=i * step + rng.random() * step)
+
+
+def connection_rows(rng, count, ips):
+    for i, when in enumerate(_timestamps(rng, count)):
+        closed = rng.random() < 0.95
+        yield (
+            f"client_{i}",
+            rng.choice(ips),
+            when,
+            when + datetime.timedelta(seconds=rng.expovariate(1 / 600)) if closed else None,
+            'disconnected' if closed else 'connected'
+        )
+
+
+def message_rows(rng, count, ips, clients):
+    for when in _timestamps(rng, count):
+        words = rng.choices(WORDS, k=rng.randint(1, 8))
+        yield (
+            f"client_{rng.randrange(clients)}",
+            rng.choice(ips),
+            ' '.join(words),
+            when,
+            rng.choice(('outgoing', 'incoming'))
+        )
+
+
+def build_database(path, rows, seed=1, batch=50000):
+    """Create (or reuse) a database holding `rows` messages and rows // 10 connections
+
+    A database cached by an earlier run is migrated to the current schema
+    first, so baseline and current runs query the same indexes.
+    """
+    if os.path.exists(path):
+        db = Database(path, pool_size=1)
+        db.init_schema()
+        db.close()
+        return path
+    rng = random.Random(seed)
+    ips = ip_pool(rng)
+    connections = max(1, rows // 10)
+
+    tmp_path = path + '.tmp'
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(tmp_path + suffix):
+            os.remove(tmp_path + suffix)
+    db = Database(tmp_path, pool_size=1, synchronous='OFF')
+    db.init_schema()
+    with db.connection() as conn:
+        _insert(conn, 'INSERT INTO connection_logs (client_id, ip_address, connection_time, '
+                      'disconnection_time, status) VALUES (?, ?, ?, ?, ?)',
+                connection_rows(rng, connections, ips), batch)
+        _insert(conn, 'INSERT INTO message_logs (client_id, ip_address, message, timestamp, direction) '
+                      'VALUES (?, ?, ?, ?, ?)',
+                message_rows(rng, rows, ips, connections), batch)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('ANALYZE')
+        conn.commit()
+    db.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def _insert(conn, sql, rows, batch):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch:
+            conn.executemany(sql, chunk)
+            conn.commit()
+            chunk = []
+    if chunk:
+        conn.executemany(sql, chunk)
+        conn.commit()
+
+
+def sample_values(path):
+    """Filter values that exist in a generated database"""
+    db = Database(path, pool_size=1)
+    with db.connection() as conn:
+        row = conn.execute('SELECT client_id, ip_address FROM message_logs WHERE id = '
+                           '(SELECT id FROM message_logs ORDER BY id LIMIT 1 OFFSET '
+                           '(SELECT count(*) / 2 FROM message_logs))').fetchone()
+        connection = conn.execute('SELECT client_id, ip_address FROM connection_logs WHERE id = '
+                                  '(SELECT max(id) / 2 + 1 FROM connection_logs)').fetchone()
+    db.close()
+    ip = row['ip_address']
+    return {
+        'message_client_id': row['client_id'],
+        'message_ip': ip,
+        'connection_client_id': connection['client_id'],
+        'connection_ip': connection['ip_address'],
+        'ip_prefix': '.'.join(ip.split('.')[:2]),
+        'cidr': '.'.join(ip.split('.')[:2]) + '.0.0/20',
+        'date': (START + datetime.timedelta(days=SPAN_DAYS // 2)).date().isoformat(),
+        'from': (START + datetime.timedelta(days=10)).isoformat(),
+        'to': (START + datetime.timedelta(days=12)).isoformat(),
+        'word': 'handshake'
+    }
@@ -0,0 +1,82 @@
+"""Memory footprint of VPNServer client sessions: legacy dict layout vs ClientSession
+
+Run from the repository root:
+
+    python -m benchmarks.session_memory --clients 10000 --messages 200
+"""
+import argparse
+import datetime
+import json
+import tracemalloc
+
+from vpn.server import ClientSession, DEFAULT_HISTORY_DEPTH
+
+
+def _legacy_clients(count, messages):
+    """The original layout: a dict per client with an unbounded list of dicts"""
+    clients = {}
+    for i in range(count):
+        clients[f"client_{i}"] = {
+            'ip_address': f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            'connection_time': datetime.datetime.now(),
+            'messages': []
+        }
+    for client in clients.values():
+        for m in range(messages):
+            client['messages'].append({
+                'content': f"message {m}",
+                'timestamp': datetime.datetime.now()
+            })
+    return clients
+
+
+def _session_clients(count, messages, depth):
+    clients = {}
+    for i in range(count):
+        client_id = f"client_{i}"
+        clients[client_id] = ClientSession(
+            client_id, f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}", depth
+        )
+    for client in clients.values():
+        for m in range(messages):
+            client.record(f"message {m}")
+    return clients
+
+
+def measure(build, *args):
+    """Bytes allocated (and still live) while building the client table"""
+    tracemalloc.start()
+    clients = build(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del clients
+    return {'current_bytes': current, 'peak_bytes': peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=200, help='messages sent per client')
+    parser.add_argument('--depth', type=int, default=DEFAULT_HISTORY_DEPTH, help='ClientSession history depth')
+    args = parser.parse_args(argv)
+
+    legacy = measure(_legacy_clients, args.clients, args.messages)
+    sessions = measure(_session_clients, args.clients, args.messages, args.depth)
+    result = {
+        'clients': args.clients,
+        'messages_per_client': args.messages,
+        'history_depth': args.depth,
+        'legacy': legacy,
+        'session': sessions,
+        'bytes_per_client': {
+            'legacy': legacy['current_bytes'] / args.clients,
+            'session': sessions['current_bytes'] / args.clients
+        },
+        'reduction': 1 - sessions['current_bytes'] / legacy['current_bytes']
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    main()
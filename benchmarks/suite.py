@@ -0,0 +1,130 @@
+"""Benchmarks for the logging, log query and node presence hot paths
+
+Each benchmark returns {name: result} where a result is a dict with the
+measured ``value``, its ``unit`` and whether higher is better, so the
+compare mode can tell regressions from improvements.
+"""
+import importlib
+import itertools
+import os
+import statistics
+import sys
+import time
+
+from vpn.db import Database
+from vpn.logger import Logger
+
+from benchmarks import data
+
+
+def _result(value, unit, higher_is_better, **extra):
+    return dict(value=value, unit=unit, higher_is_better=higher_is_better, **extra)
+
+
+def _latency(fn, repeat):
+    """Run fn repeat times; median and p95 wall time in milliseconds"""
+    fn()  # warm caches and the statement cache
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+def bench_log_message(workdir, count=5000):
+    """Logger.log_message throughput in the synchronous and write-behind modes"""
+    results = {}
+    for mode, async_writes in (('sync', False), ('write_behind', True)):
+        path = os.path.join(workdir, f'log_message_{mode}.db')
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        db = Database(path)
+        db.init_schema()
+        logger = Logger(path, db=db, async_writes=async_writes)
+        started = time.perf_counter()
+        for i in range(count):
+            logger.log_message(f'client_{i % 50}', '10.0.0.1', f'benchmark message {i}', 'outgoing')
+        logger.flush()
+        elapsed = time.perf_counter() - started
+        logger.close()
+        db.close()
+        results[f'log_message.{mode}'] = _result(count / elapsed, 'ops/s', True, count=count)
+    return results
+
+
+def _filter_combinations(candidates):
+    names = sorted(candidates)
+    for size in range(len(names) + 1):
+        for combo in itertools.combinations(names, size):
+            filters = {}
+            for name in combo:
+                filters.update(candidates[name])
+            yield '+'.join(combo) or 'none', filters
+
+
+def bench_log_queries(workdir, rows, seed=1, repeat=20, limit=100):
+    """get_message_logs / get_connection_logs latency for every filter combination"""
+    path = data.build_database(os.path.join(workdir, f'logs_{rows}_seed{seed}.db'), rows, seed)
+    values = data.sample_values(path)
+    db = Database(path)
+    logger = Logger(path, db=db)
+
+    message_filters = {
+        'client': {'client_id': values['message_client_id']},
+        'ip': {'ip_address': values['message_ip']},
+        'range': {'from': values['from'], 'to': values['to']},
+        'direction': {'direction': 'incoming'},
+        'text': {'message': values['word']},
+    }
+    connection_filters = {
+        'client': {'client_id': values['connection_client_id']},
+        'prefix': {'ip_address': values['ip_prefix']},
+        'date': {'date': values['date']},
+        'status': {'status': 'disconnected'},
+    }
+    results = {}
+    for name, filters in _filter_combinations(message_filters):
+        p50, p95 = _latency(lambda: logger.get_message_logs(filters, limit=limit), repeat)
+        results[f'get_message_logs.{rows}.{name}'] = _result(p50, 'ms', False, p95=p95)
+    for name, filters in _filter_combinations(connection_filters):
+        p50, p95 = _latency(lambda: logger.get_connection_logs(filters, limit=limit), repeat)
+        results[f'get_connection_logs.{rows}.{name}'] = _result(p50, 'ms', False, p95=p95)
+    p50, p95 = _latency(lambda: logger.get_message_logs({'ip_address': values['cidr']}, limit=limit), repeat)
+    results[f'get_message_logs.{rows}.cidr'] = _result(p50, 'ms', False, p95=p95)
+    p50, p95 = _latency(lambda: logger.search_messages(values['word'], limit=20), repeat)
+    results[f'search_messages.{rows}'] = _result(p50, 'ms', False, p95=p95)
+    db.close()
+    return results
+
+
+def _load_app(workdir):
+    """Import app.py against a scratch database directory"""
+    appdir = os.path.join(workdir, 'app')
+    os.makedirs(appdir, exist_ok=True)
+    os.environ['VPN_DATABASE'] = os.path.join(appdir, 'database', 'vpn_logs.db')
+    cwd = os.getcwd()
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if repo_root not in sys.path:
+        sys.path.insert(0, repo_root)
+    os.chdir(appdir)
+    try:
+        return importlib.import_module('app')
+    finally:
+        os.chdir(cwd)
+
+
+def bench_nodes(workdir, heartbeats=2000, nodes=500, repeat=50):
+    """/api/nodes/heartbeat throughput and /api/nodes/active latency via the Flask test client"""
+    app_module = _load_app(workdir)
+    client = app_module.app.test_client()
+    started = time.perf_counter()
+    for i in range(heartbeats):
+        client.post('/api/nodes/heartbeat', environ_base={'REMOTE_ADDR': f'10.1.{i % nodes // 256}.{i % nodes % 256}'})
+    elapsed = time.perf_counter() - started
+    results = {'nodes.heartbeat': _result(heartbeats / elapsed, 'req/s', True, count=heartbeats)}
+    p50, p95 = _latency(lambda: client.get('/api/nodes/active'), repeat)
+    results['nodes.active'] = _result(p50, 'ms', False, p95=p95, nodes=nodes)
+    return results
@@ -0,0 +1,122 @@
+"""Encode cost and wire size of the Socket.IO events: JSON text packets vs MessagePack
+
+Run from the repository root (needs the msgpack package):
+
+    python -m benchmarks.wire_codecs --iterations 20000 --fanout 100
+
+'legacy' is the stock JSON packet with strftime timestamps, encoded once
+per recipient as before vpn/wire.py; 'json' and 'msgpack' are the packets
+CodecManager sends, encoded once per emit and shared by every recipient
+on that codec. Sizes are WebSocket payload bytes: text packets carry the
+one-byte Engine.IO message prefix, binary frames don't.
+
+bytes_saved is negative when MessagePack is larger than JSON. Its packet
+envelope ({'type', 'data', 'nsp'} map) costs about 16 bytes more than
+JSON's framing, so events with only a couple of small fields, such as
+server_stats_update, come out bigger.
+"""
+import argparse
+import datetime
+import json
+import time
+
+from socketio import packet
+
+from vpn import wire
+
+NOW = datetime.datetime(2024, 5, 1, 12, 30, 45)
+
+
+def _events():
+    """Representative payloads of the events the app emits"""
+    return {
+        'connection_status': {
+            'status': 'connected',
+            'client_id': 'Xq3vB0kq2c9dM1sLAAAB',
+            'ip': '203.0.113.25',
+            'codec': 'json',
+            'connected_at': NOW
+        },
+        'receive_message': {
+            'message': 'Message received and encrypted. Length: 27 characters.',
+            'timestamp': NOW
+        },
+        'receive_message_batch': {
+            'responses': [{'seq': seq, 'message': f'PONG! Server received your ping at 12:30:{seq:02d}'}
+                          for seq in range(1, 11)],
+            'timestamp': NOW
+        },
+        'server_stats_update': {'active_clients': 1532, 'total_messages': 9876543}
+    }
+
+
+def _legacy_packet(event, data):
+    data = {key: value.strftime(wire.TIMESTAMP_FORMAT) if isinstance(value, datetime.datetime) else value
+            for key, value in data.items()}
+    return packet.Packet(packet.EVENT, namespace='/', data=[event, data])
+
+
+def _wire_bytes(encoded):
+    if isinstance(encoded, bytes):
+        return len(encoded)
+    # Engine.IO prefixes text messages with '4'
+    return 1 + len(encoded.encode())
+
+
+def _timed(fn, iterations):
+    fn()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def measure(event, data, iterations, fanout):
+    """Bytes and microseconds per encode, and per emit to `fanout` clients, for each codec"""
+    builders = {
+        'legacy': lambda: _legacy_packet(event, data),
+        'json': lambda: wire.event_packet(wire.JSON, event, data),
+        'msgpack': lambda: wire.event_packet(wire.MSGPACK, event, data)
+    }
+    results = {}
+    for codec, build in builders.items():
+        if codec == 'legacy':
+            # One packet built and encoded per recipient
+            def emit():
+                for _ in range(fanout):
+                    build().encode()
+        else:
+            def emit():
+                pkt = build()
+                for _ in range(fanout):
+                    pkt.encode()
+        results[codec] = {
+            'bytes': _wire_bytes(build().encode()),
+            'encode_us': _timed(lambda: build().encode(), iterations),
+            f'emit_{fanout}_us': _timed(emit, max(1, iterations // fanout))
+        }
+    legacy_bytes = results['legacy']['bytes']
+    for codec in ('json', 'msgpack'):
+        results[codec]['bytes_saved'] = 1 - results[codec]['bytes'] / legacy_bytes
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000, help='encodes timed per event and codec')
+    parser.add_argument('--fanout', type=int, default=100, help='recipients of one broadcast emit')
+    args = parser.parse_args(argv)
+    if wire.MSGPACK not in wire.available_codecs():
+        parser.error('the msgpack package is not installed')
+
+    result = {
+        'iterations': args.iterations,
+        'fanout': args.fanout,
+        'events': {event: measure(event, data, args.iterations, args.fanout) for event, data in _events().items()}
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+// Socket.IO client parser for the per-connection wire codecs in vpn/wire.py.
+// Packets to the server are always JSON text; packets from the server are
+// JSON text or, once the connection negotiated MessagePack, binary frames.
+// Load after @msgpack/msgpack (the MessagePack global); without it the
+// pages ask for JSON and everything works as before.
+(function (global) {
+    const EVENT = 2;
+
+    function encodeText(packet) {
+        let text = String(packet.type);
+        if (packet.nsp && packet.nsp !== '/') {
+            text += packet.nsp + ',';
+        }
+        if (packet.id !== undefined && packet.id !== null) {
+            text += packet.id;
+        }
+        if (packet.data !== undefined) {
+            text += JSON.stringify(packet.data);
+        }
+        return text;
+    }
+
+    function decodeText(text) {
+        // type, [namespace ","], [ack id], [JSON data]; this app sends no binary attachments
+        const packet = { type: Number(text.charAt(0)), nsp: '/' };
+        let i = 1;
+        if (text.charAt(i) === '/') {
+            const end = text.indexOf(',', i);
+            packet.nsp = text.substring(i, end);
+            i = end + 1;
+        }
+        const idStart = i;
+        while (i < text.length && text.charAt(i) >= '0' && text.charAt(i) <= '9') {
+            i++;
+        }
+        if (i > idStart) {
+            packet.id = Number(text.substring(idStart, i));
+        }
+        if (i < text.length) {
+            packet.data = JSON.parse(text.substring(i));
+        }
+        return packet;
+    }
+
+    function Encoder() {}
+    Encoder.prototype.encode = function (packet) {
+        return [encodeText(packet)];
+    };
+
+    function Decoder() {
+        this.listeners = [];
+    }
+    Decoder.prototype.on = function (event, listener) {
+        if (event === 'decoded') {
+            this.listeners.push(listener);
+        }
+        return this;
+    };
+    Decoder.prototype.add = function (data) {
+        const packet = typeof data === 'string' ? decodeText(data) : global.MessagePack.decode(data);
+        if (packet.type === EVENT && !packet.nsp) {
+            packet.nsp = '/';
+        }
+        this.listeners.forEach(function (listener) {
+            listener(packet);
+        });
+    };
+    Decoder.prototype.destroy = function () {
+        this.listeners = [];
+    };
+
+    const codec = global.MessagePack ? 'msgpack' : 'json';
+
+    global.VPNWire = {
+        codec: codec,
+        parser: { Encoder: Encoder, Decoder: Decoder },
+        // io() options asking the server for the best codec this page can read
+        options: function (extra) {
+            return Object.assign({ parser: this.parser, auth: { codec: codec } }, extra || {});
+        },
+        // Timestamps arrive as epoch seconds over MessagePack and as local time text over JSON
+        toDate: function (value) {
+            if (typeof value === 'number') {
+                return new Date(value * 1000);
+            }
+            return value ? new Date(value.replace(' ', 'T')) : new Date();
+        }
+    };
+})(window);
@@ -0,0 +1,66 @@
+"""Token-bucket admission of single messages and batches"""
+import pytest
+
+from vpn import admission as admission_module
+from vpn.admission import CLIENT_RATE, AdmissionController
+from vpn.server import ClientSession
+
+# app.py defaults
+CLIENT_RATE_PER_SECOND = 10.0
+CLIENT_BURST = 20
+MESSAGE_BATCH_MAX = 100
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(admission_module, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def controller():
+    return AdmissionController(client_rate=CLIENT_RATE_PER_SECOND, client_burst=CLIENT_BURST,
+                               ip_rate=100.0, ip_burst=200, max_in_flight=0)
+
+
+def _session(controller):
+    session = ClientSession('client', '10.0.0.1')
+    controller.attach(session)
+    return session
+
+
+def test_full_size_batch_is_admitted(clock, controller):
+    session = _session(controller)
+    assert controller.admit(session, MESSAGE_BATCH_MAX) is None
+    controller.release()
+    assert controller.stats()['admitted'] == MESSAGE_BATCH_MAX
+
+
+def test_batch_above_burst_leaves_the_bucket_in_debt(clock, controller):
+    session = _session(controller)
+    assert controller.admit(session, MESSAGE_BATCH_MAX) is None
+
+    # 80 tokens owed plus the one for the next message, at 10 per second
+    refusal = controller.admit(session)
+    assert refusal == {'reason': CLIENT_RATE, 'retry_after': 8.1}
+    clock.now += 8.1
+    assert controller.admit(session) is None
+
+
+def test_batch_above_burst_waits_for_a_full_bucket(clock, controller):
+    session = _session(controller)
+    assert controller.admit(session, 15) is None
+    refusal = controller.admit(session, MESSAGE_BATCH_MAX)
+    assert refusal['reason'] == CLIENT_RATE
+    assert refusal['retry_after'] == pytest.approx(1.5)
+    clock.now += 1.5
+    assert controller.admit(session, MESSAGE_BATCH_MAX) is None
@@ -0,0 +1,149 @@
+"""Socket.IO emits and presence shared between worker processes"""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+import socketio
+
+from vpn.db import Database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'worker on port {port} exited with {process.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError(f'worker on port {port} did not start')
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def _wait_quiet(updates, quiet, timeout=15.0):
+    """Wait until no update has arrived for `quiet` seconds"""
+    deadline = time.monotonic() + timeout
+    counts = [len(received) for received in updates]
+    changed = time.monotonic()
+    while time.monotonic() < deadline and time.monotonic() - changed < quiet:
+        time.sleep(0.05)
+        current = [len(received) for received in updates]
+        if current != counts:
+            counts = current
+            changed = time.monotonic()
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two app workers sharing state and an SQLite message queue, as vpn.cluster runs them"""
+    database = str(tmp_path / 'vpn_logs.db')
+    # Migrate once before any worker starts, like Cluster.start()
+    db = Database(database)
+    db.init_schema()
+    db.close()
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        VPN_DATABASE=database,
+        VPN_SHARED_STATE='sqlite',
+        VPN_MESSAGE_QUEUE=f"sqlite:///{tmp_path / 'socketio_queue.db'}",
+        VPN_RETENTION='0',
+        VPN_MESSAGE_LATENCY='0,0'
+    )
+    ports = [_free_port(), _free_port()]
+    processes = []
+    try:
+        for index, port in enumerate(ports):
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'vpn.cluster', '--serve-worker', str(port)],
+                cwd=tmp_path,
+                env=dict(env, VPN_WORKER_ID=f'worker-{index}'),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            ))
+        for port, process in zip(ports, processes):
+            _wait_for_port(port, process)
+        yield ports
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def test_broadcast_reaches_clients_on_every_worker(workers):
+    clients = []
+    updates = []
+    try:
+        for port in workers:
+            received = []
+            client = socketio.Client(reconnection=False)
+            client.on('server_stats_update', received.append)
+            client.connect(f'http://127.0.0.1:{port}', wait_timeout=10)
+            client.emit('subscribe_stats')
+            clients.append(client)
+            updates.append(received)
+        # Each subscriber gets a full snapshot, then a broadcast for the connect
+        # that marked its worker dirty; wait until both workers have gone quiet
+        assert _wait_for(lambda: all(received for received in updates))
+        _wait_quiet(updates, quiet=2.5)
+
+        sender, _ = clients
+        sender.emit('send_message', {'message': 'ping'})
+
+        # Only worker 0 handled a message, so only its broadcaster has the new
+        # total; the client on worker 1 can only get it through the queue
+        def broadcast(received):
+            return [update for update in received if update.get('total_messages', 0) >= 2]
+        assert _wait_for(lambda: all(broadcast(received) for received in updates))
+        assert broadcast(updates[1])[0] == broadcast(updates[0])[0]
+    finally:
+        for client in clients:
+            client.disconnect()
+
+
+
+def test_active_nodes_include_every_worker(workers):
+    def request(port, path, cookie, method='GET'):
+        req = urllib.request.Request(f'http://127.0.0.1:{port}{path}', method=method,
+                                     headers={'Cookie': f'session={cookie}'})
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return json.load(response)
+
+    for index, port in enumerate(workers):
+        request(port, '/api/nodes/register', f'node-{index}', method='POST')
+
+    # Each worker only holds its own heartbeat in memory; the other one has
+    # to come from the nodes table its worker checkpoints to
+    def counts():
+        return [request(port, '/api/nodes/active', 'reader')['count'] for port in workers]
+    assert _wait_for(lambda: counts() == [2, 2])
@@ -0,0 +1,27 @@
+"""Load generator latency summaries"""
+import pytest
+
+from vpn.loadgen import percentile
+
+
+@pytest.mark.parametrize('n, pct, expected', [
+    (10, 50, 5),
+    (10, 90, 9),
+    (100, 50, 50),
+    (100, 95, 95),
+    (100, 99, 99),
+    (100, 100, 100),
+    (1, 99, 1),
+    (10, 0, 1),
+])
+def test_percentile_is_nearest_rank(n, pct, expected):
+    assert percentile(list(range(1, n + 1)), pct) == expected
+
+
+def test_percentile_of_nothing():
+    assert percentile([], 50) is None
+
+
+def test_percentile_rank_of_every_whole_percent():
+    values = list(range(1, 101))
+    assert [percentile(values, pct) for pct in range(1, 101)] == values
@@ -0,0 +1,144 @@
+"""Logger keyset pages: filter results and the query plans behind them"""
+import datetime
+
+import pytest
+
+from vpn.db import Database
+from vpn.logger import MAX_ADDRESS_WALKS, Logger, ip_matcher
+
+WORDS = ['handshake', 'keepalive', 'rekey', 'ping']
+
+
+@pytest.fixture
+def logger(tmp_path):
+    # One pooled connection, so every statement the Logger runs can be traced on it
+    db = Database(str(tmp_path / 'vpn_logs.db'), pool_size=1)
+    db.init_schema()
+    start = datetime.datetime(2025, 1, 1)
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO message_logs (client_id, ip_address, message, timestamp, direction) VALUES (?, ?, ?, ?, ?)",
+            [(f'client_{i % 50}', f'10.{i % 3}.{i % 7}.{i % 11}', f'{WORDS[i % 4]} {i}',
+              start + datetime.timedelta(seconds=i), 'outgoing' if i % 2 else 'incoming')
+             for i in range(3000)]
+        )
+        conn.executemany(
+            "INSERT INTO connection_logs (client_id, ip_address, connection_time, status) VALUES (?, ?, ?, ?)",
+            [(f'client_{i}', f'10.{i % 3}.{i % 7}.{i % 11}', start + datetime.timedelta(seconds=i), 'disconnected')
+             for i in range(500)]
+        )
+        conn.execute('ANALYZE')
+        conn.commit()
+    yield Logger(db=db)
+    db.close()
+
+
+def _expected(rows, filters, limit, before_id=None, after_id=None):
+    if 'ip_address' in filters:
+        matches = ip_matcher(filters['ip_address'])
+        rows = [row for row in rows if matches(row['ip_address'])]
+    if 'message' in filters:
+        rows = [row for row in rows if filters['message'] in row['message'].split()]
+    if before_id is not None:
+        rows = [row for row in rows if row['id'] < before_id]
+    if after_id is not None:
+        return [row['id'] for row in rows if row['id'] > after_id][-limit:]
+    return [row['id'] for row in rows][:limit]
+
+
+def _plans(logger, call):
+    """Run call and return the EXPLAIN QUERY PLAN details of every SELECT it issued"""
+    statements = []
+    with logger.db.connection() as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        with logger.db.connection() as conn:
+            conn.set_trace_callback(None)
+    with logger.db.connection() as conn:
+        return [
+            [row['detail'] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+            for statement in statements if statement.lstrip().upper().startswith('SELECT')
+        ]
+
+
+FILTERS = [
+    {'ip_address': '10.1.3.4'},
+    {'ip_address': '10.1'},
+    {'ip_address': '10.0.0.0/14'},
+    {'ip_address': '10'},
+    {'message': 'rekey'},
+    {'message': 'rekey', 'ip_address': '10.2'},
+    {'client_id': 'client_7', 'ip_address': '10.1'},
+]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('cursor', [{}, {'before_id': 2000}, {'after_id': 1000}])
+def test_message_pages_match_filters(logger, filters, cursor):
+    everything = logger.get_message_logs()
+    if 'client_id' in filters:
+        everything = [row for row in everything if row['client_id'] == filters['client_id']]
+    rows = logger.get_message_logs(filters, limit=25, **cursor)
+    assert [row['id'] for row in rows] == _expected(everything, filters, 25, **cursor)
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+def test_message_pages_walk_ids_in_order(logger, filters):
+    plans = _plans(logger, lambda: logger.get_message_logs(filters, limit=25, before_id=2000))
+    assert plans
+    for plan in plans:
+        assert not any('TEMP B-TREE FOR ORDER BY' in detail for detail in plan), plan
+        assert not any('LIST SUBQUERY' in detail for detail in plan), plan
+
+
+def test_wide_ip_range_skips_per_address_walks(logger):
+    # 10.x covers every address in the table, more than are worth walking one by one
+    with logger.db.connection() as conn:
+        assert conn.execute("SELECT count(DISTINCT ip_address) FROM message_logs").fetchone()[0] > MAX_ADDRESS_WALKS
+    plans = _plans(logger, lambda: logger.get_message_logs({'ip_address': '10'}, limit=25))
+    assert len(plans) == 2
+    assert any('SCAN message_logs' in detail for detail in plans[-1])
+
+
+def test_connection_prefix_page(logger):
+    plans = _plans(logger, lambda: logger.get_connection_logs({'ip_address': '10.2.'}, limit=10))
+    for plan in plans:
+        assert not any('TEMP B-TREE FOR ORDER BY' in detail for detail in plan), plan
+    rows = logger.get_connection_logs({'ip_address': '10.2.'}, limit=10)
+    assert [row['id'] for row in rows] == _expected(logger.get_connection_logs(), {'ip_address': '10.2.'}, 10)
+
+
+def test_export_pages_cover_every_match(logger):
+    filters = {'ip_address': '10.0.0.0/14', 'message': 'ping'}
+    ids = [row[0] for _, rows in logger.iter_message_logs(filters, batch_size=37) for row in rows]
+    assert ids == sorted(_expected(logger.get_message_logs(), filters, 3000))
+
+
+def test_recover_sessions_reports_the_sessions_it_closes(tmp_path):
+    db = Database(str(tmp_path / 'recover.db'))
+    db.init_schema()
+    opened = datetime.datetime(2025, 1, 1, 12, 0)
+    with db.connection() as conn:
+        conn.execute(
+            "INSERT INTO connection_logs (client_id, ip_address, connection_time, status) VALUES (?, ?, ?, ?)",
+            ('client_1', '10.0.0.1', opened, 'connected'))
+        conn.execute(
+            "INSERT INTO message_logs (client_id, ip_address, message, timestamp, direction) VALUES (?, ?, ?, ?, ?)",
+            ('client_1', '10.0.0.1', 'ping', opened + datetime.timedelta(seconds=30), 'outgoing'))
+        conn.commit()
+
+    events = []
+    logger = Logger(db=db)
+    logger.add_listener(events.extend)
+    assert logger.recover_sessions(close_stale=True) == 1
+    assert events == [{
+        'type': 'disconnection',
+        'id': 1,
+        'client_id': 'client_1',
+        'status': 'disconnected',
+        'disconnection_time': opened + datetime.timedelta(seconds=30)
+    }]
+    assert logger.get_connection_logs()[0]['status'] == 'disconnected'
+    db.close()
@@ -0,0 +1,31 @@
+"""MetricsRegistry.timed on plain and coroutine handlers"""
+import asyncio
+
+from vpn.metrics import MetricsRegistry
+
+
+def test_timed_coroutine_records_after_completion():
+    metrics = MetricsRegistry()
+
+    @metrics.timed('vpn_socketio_event_seconds', event='send_message')
+    async def send_message(sid):
+        await asyncio.sleep(0.02)
+        return sid
+
+    assert asyncio.iscoroutinefunction(send_message)
+    # Extra handler arguments are dropped as for plain functions
+    assert asyncio.run(send_message('abc', {'message': 'ping'})) == 'abc'
+    summary = metrics.summary('vpn_socketio_event_seconds')['event=send_message']
+    assert summary['count'] == 1
+    assert summary['mean_ms'] >= 20
+
+
+def test_timed_function():
+    metrics = MetricsRegistry()
+
+    @metrics.timed('vpn_socketio_event_seconds', event='disconnect')
+    def disconnect():
+        return 'done'
+
+    assert disconnect('sid') == 'done'
+    assert metrics.summary('vpn_socketio_event_seconds')['event=disconnect']['count'] == 1
@@ -0,0 +1,92 @@
+"""RetentionManager archival into per-day databases"""
+import datetime
+import sqlite3
+
+import pytest
+
+from vpn.db import AUTO_VACUUM_INCREMENTAL, Database
+from vpn.retention import RetentionManager
+
+NOW = datetime.datetime(2025, 3, 1, 12, 0)
+OLD = datetime.datetime(2025, 1, 10, 9, 30)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'vpn_logs.db'))
+    db.init_schema()
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO message_logs (client_id, ip_address, message, timestamp, direction) VALUES (?, ?, ?, ?, ?)",
+            [('client_1', '10.0.0.1', f'message {i}', OLD + datetime.timedelta(minutes=i), 'outgoing')
+             for i in range(5)] + [('client_1', '10.0.0.1', 'recent', NOW, 'outgoing')]
+        )
+        conn.executemany(
+            "INSERT INTO connection_logs (client_id, ip_address, connection_time, status) VALUES (?, ?, ?, ?)",
+            [('client_1', '10.0.0.1', OLD, 'disconnected'), ('client_2', '10.0.0.2', OLD, 'connected')]
+        )
+        conn.commit()
+    yield db
+    db.close()
+
+
+def _rows(path, table):
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute(f'SELECT id FROM {table} ORDER BY id')]
+
+
+def test_archive_moves_old_closed_rows(db, tmp_path):
+    retention = RetentionManager(db, archive_dir=str(tmp_path / 'archive'), max_age_days=30)
+    assert retention.archive(NOW) == ['2025-01-10']
+
+    archive = str(tmp_path / 'archive' / 'vpn_logs-2025-01-10.db')
+    assert _rows(archive, 'message_logs') == [1, 2, 3, 4, 5]
+    assert _rows(archive, 'connection_logs') == [1]
+    assert _rows(db.path, 'message_logs') == [6]
+    # The open session stays in the main database
+    assert _rows(db.path, 'connection_logs') == [2]
+    assert retention.stats()['archived_messages'] == 5
+    assert retention.archive(NOW) == []
+
+
+def test_archive_finishes_a_run_interrupted_after_the_copy(db, tmp_path):
+    retention = RetentionManager(db, archive_dir=str(tmp_path / 'archive'), max_age_days=30)
+    archive = str(tmp_path / 'archive' / 'vpn_logs-2025-01-10.db')
+
+    # Fail the delete phase, after the archive copy has been committed
+    with db.connection() as conn:
+        conn.execute(
+            "CREATE TRIGGER fail_delete BEFORE DELETE ON message_logs "
+            "BEGIN SELECT RAISE(ABORT, 'disk went away'); END")
+        conn.commit()
+    with pytest.raises(sqlite3.IntegrityError):
+        retention.archive(NOW)
+    assert _rows(archive, 'message_logs') == [1, 2, 3, 4, 5]
+    assert _rows(db.path, 'message_logs') == [1, 2, 3, 4, 5, 6]
+
+    with db.connection() as conn:
+        conn.execute('DROP TRIGGER fail_delete')
+        conn.commit()
+    assert retention.archive(NOW) == ['2025-01-10']
+    assert _rows(archive, 'message_logs') == [1, 2, 3, 4, 5]
+    assert _rows(db.path, 'message_logs') == [6]
+
+
+def test_new_databases_use_incremental_vacuum(db):
+    with db.connection() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    assert db.enable_incremental_vacuum() is False
+
+
+def test_enable_incremental_vacuum_on_an_existing_database(tmp_path):
+    path = str(tmp_path / 'old.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE legacy (id INTEGER PRIMARY KEY)')
+    db = Database(path)
+    db.init_schema()
+    with db.connection() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL
+    assert db.enable_incremental_vacuum() is True
+    with db.connection() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+    db.close()
@@ -0,0 +1,34 @@
+"""ClientSession history limits as sent by clients"""
+import pytest
+
+from vpn.server import ClientSession
+
+
+@pytest.fixture
+def session():
+    session = ClientSession('client', '10.0.0.1', history_depth=5)
+    for index in range(8):
+        session.record(f'message {index}')
+    return session
+
+
+def _contents(entries):
+    return [entry['content'] for entry in entries]
+
+
+def test_recent_without_limit_returns_whole_history(session):
+    assert _contents(session.recent()) == [f'message {index}' for index in range(3, 8)]
+
+
+@pytest.mark.parametrize('limit, expected', [(2, 2), ('2', 2), (0, 0), (-1, 0), (1000, 5)])
+def test_recent_coerces_and_clamps_limit(session, limit, expected):
+    entries = session.recent(limit)
+    assert len(entries) == expected
+    if expected:
+        assert entries[-1]['content'] == 'message 7'
+
+
+@pytest.mark.parametrize('limit', ['x', '2.5', [], {}])
+def test_recent_rejects_non_integer_limit(session, limit):
+    with pytest.raises(ValueError):
+        session.recent(limit)
@@ -0,0 +1,74 @@
+"""LogTail polling of the shared log tables (source='poll')"""
+import datetime
+
+import pytest
+
+from vpn.db import Database
+from vpn.logger import Logger
+from vpn.tail import LogTail
+
+
+class _Server:
+    def enter_room(self, sid, room, namespace=None):
+        pass
+
+    def leave_room(self, sid, room, namespace=None):
+        pass
+
+
+class _SocketIO:
+    """Records emits instead of sending them"""
+
+    def __init__(self):
+        self.server = _Server()
+        self.emits = []
+
+    def emit(self, event, data, to=None, ignore_queue=False):
+        self.emits.append((to, data))
+
+
+@pytest.fixture
+def tail(tmp_path):
+    db = Database(str(tmp_path / 'vpn_logs.db'))
+    db.init_schema()
+    tail = LogTail(_SocketIO(), Logger(db=db), source='poll', disconnection_overlap=30.0)
+    # Poll by hand instead of from the background loop
+    tail._started = True
+    tail.subscribe('viewer')
+    yield tail
+    db.close()
+
+
+def _close(tail, client_id, when):
+    with tail.logger.db.connection() as conn:
+        conn.execute(
+            "INSERT INTO connection_logs (client_id, ip_address, connection_time, disconnection_time, status) "
+            "VALUES (?, '10.0.0.1', ?, ?, 'disconnected')",
+            (client_id, when - datetime.timedelta(minutes=5), when))
+        conn.commit()
+
+
+def _polled(tail):
+    tail._buffer = []
+    tail._poll()
+    return [(event['type'], event['client_id']) for event in tail._buffer]
+
+
+def test_poll_picks_up_late_disconnections_once(tail):
+    now = datetime.datetime.now()
+    _close(tail, 'client_1', now + datetime.timedelta(seconds=5))
+    assert ('disconnection', 'client_1') in _polled(tail)
+
+    # Another worker's write-behind batch commits after, with an earlier close
+    _close(tail, 'client_2', now + datetime.timedelta(seconds=1))
+    polled = _polled(tail)
+    assert ('disconnection', 'client_2') in polled
+    assert ('disconnection', 'client_1') not in polled
+    assert _polled(tail) == []
+
+
+def test_poll_follows_new_messages_by_id(tail):
+    tail.logger.log_message('client_1', '10.0.0.1', 'ping', 'outgoing')
+    tail.logger.log_message('client_1', '10.0.0.1', 'pong', 'incoming')
+    assert _polled(tail) == [('message', 'client_1'), ('message', 'client_1')]
+    assert _polled(tail) == []
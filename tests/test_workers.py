@@ -0,0 +1,21 @@
+"""OrderedTaskRunner bookkeeping"""
+import pytest
+
+from vpn.workers import OrderedTaskRunner
+
+
+def test_failed_spawn_frees_the_key():
+    def broken_spawn(fn, *args):
+        raise RuntimeError('cannot start thread')
+
+    runner = OrderedTaskRunner(broken_spawn)
+    with pytest.raises(RuntimeError):
+        runner.submit('client', print)
+    assert runner.stats()['busy_keys'] == 0
+    assert runner.stats()['failed'] == 1
+
+    ran = []
+    runner.spawn = lambda fn, *args: fn(*args)
+    runner.submit('client', ran.append, 1)
+    assert ran == [1]
+    assert runner.stats()['completed'] == 1
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import Counter
+
+RATE_LIMITED_EVENT = 'rate_limited'
+
+# Reasons a message is shed, in the order they are checked
+OVERLOADED = 'overloaded'
+CLIENT_RATE = 'client_rate'
+IP_RATE = 'ip_rate'
+
+
+class TokenBucket:
+    """Refills at `rate` tokens per second up to `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        """Seconds until cost tokens can be taken (after refill)
+
+        A cost above the burst, such as a large batch, is let through once
+        the bucket is full and leaves it in debt, so it is delayed rather
+        than refused forever while the long-run rate still holds.
+        """
+        needed = min(cost, self.burst)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Per-socket and per-IP token buckets plus a global in-flight cap
+
+    Each ClientSession carries its own bucket; sockets from the same
+    address share an IP bucket that lives while any of them is connected.
+    A message is admitted only if both buckets have enough tokens and
+    fewer than max_in_flight messages are being processed, so one
+    flooding client is shed before it costs log writes, processing time
+    and broadcasts for everyone. A rate of 0 disables that bucket and a
+    max_in_flight of 0 disables the cap.
+
+    admit() returns None and takes an in-flight slot, to be given back
+    with release() once the message is processed, or the refusal to send
+    to the client as a rate_limited event.
+    """
+
+    def __init__(self, client_rate=10.0, client_burst=20, ip_rate=100.0, ip_burst=200, max_in_flight=256):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.max_in_flight = max_in_flight
+
+        # ip_address -> [TokenBucket, connected sessions]
+        self._ips = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+        self.admitted = 0
+        self.peak_in_flight = 0
+        self.shed = Counter()
+
+    def attach(self, session):
+        """Give a new client session its bucket and count it against its IP"""
+        with self._lock:
+            if self.client_rate > 0:
+                session.bucket = TokenBucket(self.client_rate, self.client_burst)
+            if self.ip_rate > 0:
+                entry = self._ips.get(session.ip_address)
+                if entry is None:
+                    entry = self._ips[session.ip_address] = [TokenBucket(self.ip_rate, self.ip_burst), 0]
+                entry[1] += 1
+
+    def detach(self, session):
+        """Drop the IP bucket when its last session disconnects"""
+        with self._lock:
+            entry = self._ips.get(session.ip_address)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._ips[session.ip_address]
+
+    def admit(self, session, cost=1):
+        """None if cost messages from session may be processed now, else the refusal"""
+        now = time.monotonic()
+        with self._lock:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                return self._refuse(OVERLOADED, None, cost)
+
+            buckets = []
+            client_bucket = session.bucket
+            if client_bucket is not None:
+                buckets.append((CLIENT_RATE, client_bucket))
+            ip_entry = self._ips.get(session.ip_address)
+            if ip_entry is not None:
+                buckets.append((IP_RATE, ip_entry[0]))
+            # Check every bucket before taking from any, so a refusal costs nothing
+            for reason, bucket in buckets:
+                bucket.refill(now)
+                wait = bucket.wait_time(cost)
+                if wait:
+                    return self._refuse(reason, wait, cost)
+            for _, bucket in buckets:
+                bucket.tokens -= cost
+
+            self.admitted += cost
+            self._in_flight += 1
+            if self._in_flight > self.peak_in_flight:
+                self.peak_in_flight = self._in_flight
+        return None
+
+    def _refuse(self, reason, wait, cost):
+        self.shed[reason] += cost
+        return {
+            'reason': reason,
+            # None when there is no bucket to wait for (overload)
+            'retry_after': round(wait, 3) if wait is not None else None
+        }
+
+    def release(self):
+        """Give back the in-flight slot of an admitted message"""
+        with self._lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        """Get limits, admitted/shed counters and in-flight messages"""
+        with self._lock:
+            return {
+                'client_rate': self.client_rate,
+                'client_burst': self.client_burst,
+                'ip_rate': self.ip_rate,
+                'ip_burst': self.ip_burst,
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'tracked_ips': len(self._ips),
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'shed_total': sum(self.shed.values())
+            }
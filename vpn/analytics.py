@@ -0,0 +1,194 @@
+import bisect
+import datetime
+import sqlite3
+import threading
+from collections import Counter
+
+from vpn.db import PoolTimeout
+from vpn.metrics import REGISTRY, SQL_SECONDS
+from vpn.workers import start_daemon_task
+
+MINUTE_FORMAT = '%Y-%m-%d %H:%M'
+
+# Upper bound in seconds and label of each session-duration bucket
+SESSION_BUCKETS = [
+    (10, '<10s'),
+    (60, '10s-1m'),
+    (300, '1m-5m'),
+    (1800, '5m-30m'),
+    (7200, '30m-2h'),
+    (None, '>2h'),
+]
+_BUCKET_BOUNDS = [bound for bound, _ in SESSION_BUCKETS[:-1]]
+
+UPSERT_COUNTER = '''
+    INSERT INTO analytics_counters (metric, key, value) VALUES (?, ?, ?)
+    ON CONFLICT(metric, key) DO UPDATE SET value = value + excluded.value
+'''
+
+
+def session_bucket(seconds):
+    """Label of the duration bucket a session of this length falls in"""
+    return SESSION_BUCKETS[bisect.bisect_right(_BUCKET_BOUNDS, seconds)][1]
+
+
+class Analytics:
+    """Dashboard aggregates maintained incrementally from Logger events
+
+    Committed log events bump in-memory deltas, which a background loop
+    adds to the analytics_counters table in one transaction per checkpoint.
+    Every worker process adds its own deltas, so the table stays correct
+    with several workers and across restarts. Reads are primary-key or
+    index lookups on that table and lag by at most one checkpoint interval.
+    """
+
+    def __init__(self, db, checkpoint_interval=2.0, minute_retention=1440):
+        self.db = db
+        self.checkpoint_interval = checkpoint_interval
+        # Per-minute message counts are kept for this many minutes
+        self.minute_retention = minute_retention
+
+        self._pending = Counter()
+        # client_id -> connection time of sessions still open
+        self._open = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self.checkpoints = 0
+        self.failed_checkpoints = 0
+
+    def load(self):
+        """Remember open sessions so their durations count after a restart"""
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='analytics_load'):
+            rows = conn.execute(
+                "SELECT client_id, connection_time FROM connection_logs WHERE status = 'connected'"
+            ).fetchall()
+        with self._lock:
+            for row in rows:
+                try:
+                    self._open[row['client_id']] = datetime.datetime.fromisoformat(row['connection_time'])
+                except (TypeError, ValueError):
+                    continue
+
+    def record(self, events):
+        """Logger listener: fold committed events into the pending deltas"""
+        with self._lock:
+            pending = self._pending
+            for event in events:
+                kind = event['type']
+                if kind == 'message':
+                    pending['totals', 'messages'] += 1
+                    pending['messages_by_direction', event['direction']] += 1
+                    pending['messages_by_ip', event['ip_address']] += 1
+                    pending['messages_per_minute', event['timestamp'].strftime(MINUTE_FORMAT)] += 1
+                elif kind == 'connection':
+                    pending['totals', 'connections'] += 1
+                    pending['connections_by_ip', event['ip_address']] += 1
+                    self._open[event['client_id']] = event['connection_time']
+                elif kind == 'disconnection':
+                    # The UPDATE only closes a row that is still open
+                    started = self._open.pop(event['client_id'], None)
+                    if started is not None:
+                        pending['totals', 'disconnections'] += 1
+                        seconds = (event['disconnection_time'] - started).total_seconds()
+                        pending['session_duration', session_bucket(seconds)] += 1
+
+    def checkpoint(self):
+        """Add the pending deltas to the counters table in one transaction"""
+        with self._lock:
+            deltas, self._pending = self._pending, Counter()
+        cutoff = datetime.datetime.now() - datetime.timedelta(minutes=self.minute_retention)
+        rows = [(metric, key, value) for (metric, key), value in deltas.items() if key is not None]
+        try:
+            with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='analytics_checkpoint'):
+                conn.executemany(UPSERT_COUNTER, rows)
+                conn.execute(
+                    "DELETE FROM analytics_counters WHERE metric = 'messages_per_minute' AND key < ?",
+                    (cutoff.strftime(MINUTE_FORMAT),)
+                )
+                conn.commit()
+        except (sqlite3.Error, PoolTimeout):
+            # Keep the deltas for the next attempt
+            with self._lock:
+                self._pending.update(deltas)
+                self.failed_checkpoints += 1
+            return 0
+        with self._lock:
+            self.checkpoints += 1
+        return len(rows)
+
+    def start(self, socketio):
+        """Start the background checkpoint loop"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_daemon_task(socketio, self._run, socketio)
+
+    def _run(self, socketio):
+        while True:
+            socketio.sleep(self.checkpoint_interval)
+            try:
+                self.checkpoint()
+            except Exception:
+                # Try again on the next tick
+                with self._lock:
+                    self.failed_checkpoints += 1
+
+    def _counters(self, conn, metric):
+        rows = conn.execute('SELECT key, value FROM analytics_counters WHERE metric = ?', (metric,))
+        return {row['key']: row['value'] for row in rows}
+
+    def _top(self, conn, metric, limit):
+        rows = conn.execute(
+            'SELECT key, value FROM analytics_counters WHERE metric = ? ORDER BY value DESC LIMIT ?',
+            (metric, limit)
+        )
+        return [{'ip_address': row['key'], 'count': row['value']} for row in rows]
+
+    def snapshot(self, minutes=60, top=10):
+        """Totals, top IPs, per-minute messages and session-duration histogram"""
+        now = datetime.datetime.now().replace(second=0, microsecond=0)
+        first = now - datetime.timedelta(minutes=minutes - 1)
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='analytics_snapshot'):
+            totals = self._counters(conn, 'totals')
+            directions = self._counters(conn, 'messages_by_direction')
+            sessions = self._counters(conn, 'session_duration')
+            top_messages = self._top(conn, 'messages_by_ip', top)
+            top_connections = self._top(conn, 'connections_by_ip', top)
+            per_minute = {
+                row['key']: row['value'] for row in conn.execute(
+                    "SELECT key, value FROM analytics_counters WHERE metric = 'messages_per_minute' AND key >= ?",
+                    (first.strftime(MINUTE_FORMAT),)
+                )
+            }
+
+        series = []
+        for offset in range(minutes):
+            minute = (first + datetime.timedelta(minutes=offset)).strftime(MINUTE_FORMAT)
+            series.append({'minute': minute, 'messages': per_minute.get(minute, 0)})
+        return {
+            'totals': {
+                'messages': totals.get('messages', 0),
+                'connections': totals.get('connections', 0),
+                'disconnections': totals.get('disconnections', 0)
+            },
+            'messages_by_direction': directions,
+            'top_ips': {
+                'messages': top_messages,
+                'connections': top_connections
+            },
+            'messages_per_minute': series,
+            'session_durations': [
+                {'bucket': label, 'sessions': sessions.get(label, 0)} for _, label in SESSION_BUCKETS
+            ]
+        }
+
+    def stats(self):
+        """Get checkpoint counters"""
+        with self._lock:
+            return {
+                'pending_deltas': len(self._pending),
+                'open_sessions': len(self._open),
+                'checkpoints': self.checkpoints,
+                'failed_checkpoints': self.failed_checkpoints
+            }
@@ -0,0 +1,370 @@
+"""Serve the app on asyncio: python-socketio's AsyncServer with the Flask routes alongside
+
+    python -m vpn.asgi --port 5001
+    uvicorn vpn.asgi:application --port 5001
+
+In the default threading mode every Socket.IO connection holds a thread.
+Here each one is a coroutine on a single event loop, so idle sockets cost
+memory rather than threads. The handlers below mirror the ones in app.py:
+
+* blocking work (SQLite queries, synchronous log writes, shared-state
+  writes) runs in a thread pool the size of the database connection pool;
+* the simulated processing delay is awaited, not slept;
+* messages from one client are still processed in the order they arrived.
+
+The Flask routes from app.py are served through uvicorn's WSGI middleware
+on their own threads. The background loops (stats broadcasts, log tail,
+checkpoints) keep running on daemon threads and emit through AsyncEmitter.
+
+Needs uvicorn. Run from the project root, like app.py. This is a single
+process deployment; VPN_MESSAGE_QUEUE may only be a redis:// URL here.
+"""
+import argparse
+import asyncio
+import datetime
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import socketio
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+import app as vpn_app
+from vpn import wire
+from vpn.admission import RATE_LIMITED_EVENT
+from vpn.metrics import REGISTRY as metrics
+from vpn.stats import StatsBroadcaster
+from vpn.tail import LogTail
+
+config = vpn_app.app.config
+logger = vpn_app.logger
+vpn_server = vpn_app.vpn_server
+shared_state = vpn_app.shared_state
+admission = vpn_app.admission
+
+
+class AsyncEmitter:
+    """The parts of flask_socketio.SocketIO used by vpn/ helpers, backed by an AsyncServer
+
+    The helpers call it from their own threads, so emits and room changes
+    are handed to the event loop rather than run in place.
+    """
+
+    # The helpers' background loops run on daemon threads (see start_daemon_task)
+    async_mode = 'threading'
+
+    def __init__(self, sio):
+        self.sio = sio
+        self.server = self
+        self.loop = None
+
+    def bind(self, loop):
+        self.loop = loop
+
+    def emit(self, event, data=None, to=None, ignore_queue=False, **kwargs):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(
+            self.sio.emit(event, data, to=to, ignore_queue=ignore_queue, **kwargs), self.loop)
+
+    def enter_room(self, sid, room, namespace=None):
+        self.loop.call_soon_threadsafe(self.sio.enter_room, sid, room, namespace)
+
+    def leave_room(self, sid, room, namespace=None):
+        self.loop.call_soon_threadsafe(self.sio.leave_room, sid, room, namespace)
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    @staticmethod
+    def start_background_task(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+
+class OrderedCoroutineRunner:
+    """Run coroutines one at a time per key, in submission order
+
+    The asyncio counterpart of OrderedTaskRunner: each submission waits
+    for the previous one under the same key (a client id) to finish.
+    """
+
+    def __init__(self):
+        self._tails = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args):
+        """Schedule fn(*args) after earlier work for key; must be called on the loop"""
+        self.submitted += 1
+        task = asyncio.ensure_future(self._run(self._tails.get(key), fn, args))
+        self._tails[key] = task
+        task.add_done_callback(lambda done: self._release(key, done))
+        return task
+
+    def _release(self, key, task):
+        # Only the last task for a key clears it
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _run(self, previous, fn, args):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await fn(*args)
+        except Exception:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def stats(self):
+        """Get task counters"""
+        return {
+            'busy_keys': len(self._tails),
+            'queued': self.submitted - self.completed - self.failed,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+
+def _client_manager(url):
+    if not url:
+        return wire.AsyncCodecManager()
+    if url.startswith('redis'):
+        return socketio.AsyncRedisManager(url)
+    raise ValueError(f'The asyncio server supports no message queue or a redis:// URL, not {url!r}')
+
+
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*', serializer=wire.JSONPacket,
+                           client_manager=_client_manager(config['MESSAGE_QUEUE']))
+emitter = AsyncEmitter(sio)
+# Blocking database work; one thread per pooled connection
+db_executor = ThreadPoolExecutor(max_workers=config['DB_POOL_SIZE'], thread_name_prefix='asgi-db')
+message_runner = OrderedCoroutineRunner()
+
+stats_broadcaster = StatsBroadcaster(emitter, vpn_app._stats_snapshot, interval=config['STATS_BROADCAST_INTERVAL'])
+log_tail = LogTail(
+    emitter,
+    logger,
+    interval=config['LOG_TAIL_INTERVAL'],
+    source='listener' if config['SHARED_STATE'] == 'local' else 'poll'
+)
+# /api/server/stats in app.py reports these module globals; point them at the live ones
+vpn_app.stats_broadcaster = stats_broadcaster
+vpn_app.log_tail = log_tail
+vpn_app.message_runner = message_runner
+
+
+async def run_blocking(fn, *args):
+    """Run fn(*args) on the database thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
+
+async def write_log(fn, *args):
+    # Write-behind logging only enqueues, so it can run on the loop
+    if logger.async_writes:
+        return fn(*args)
+    return await run_blocking(fn, *args)
+
+
+def _open_session(client_id, ip_address):
+    vpn_server.add_client(client_id, ip_address)
+    logger.log_connection(client_id, ip_address)
+
+
+def _close_session(client_id, ip_address):
+    logger.log_disconnection(client_id, ip_address)
+    vpn_server.remove_client(client_id)
+
+
+def _client_address(environ):
+    """Address of the peer behind a Socket.IO connection
+
+    engineio's ASGI driver always sets REMOTE_ADDR to 127.0.0.1, so the
+    peer comes from the ASGI scope. Behind the trusted proxy it is the
+    address the proxy appended to X-Forwarded-For, as ProxyFix(x_for=1)
+    reads it for the Flask routes.
+    """
+    if config['TRUSTED_PROXY']:
+        forwarded = environ.get('HTTP_X_FORWARDED_FOR')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    client = environ.get('asgi.scope', {}).get('client')
+    if client:
+        return client[0]
+    return environ.get('REMOTE_ADDR') or '127.0.0.1'
+
+
+@sio.event
+@metrics.timed('vpn_socketio_event_seconds', event='connect')
+async def connect(sid, environ, auth=None):
+    ip_address = _client_address(environ)
+    requested = auth.get('codec') if isinstance(auth, dict) else None
+    if not requested:
+        requested = parse_qs(environ.get('QUERY_STRING', '')).get('codec', [None])[0]
+    codec = wire.use_codec(sio, sid, requested, enabled=config['WIRE_MSGPACK'])
+    await run_blocking(_open_session, sid, ip_address)
+    await sio.emit('connection_status', {
+        'status': 'connected',
+        'client_id': sid,
+        'ip': ip_address,
+        'codec': codec,
+        'connected_at': datetime.datetime.now()
+    }, to=sid)
+    stats_broadcaster.mark_dirty()
+
+
+@sio.event
+@metrics.timed('vpn_socketio_event_seconds', event='disconnect')
+async def disconnect(sid):
+    log_tail.unsubscribe(sid)
+    client = vpn_server.get_client(sid)
+    if client:
+        await run_blocking(_close_session, sid, client.ip_address)
+        stats_broadcaster.mark_dirty()
+
+
+@sio.event
+@metrics.timed('vpn_socketio_event_seconds', event='send_message')
+async def send_message(sid, data):
+    client = vpn_server.get_client(sid)
+    if client and isinstance(data, dict) and 'message' in data:
+        refusal = admission.admit(client)
+        if refusal is not None:
+            await sio.emit(RATE_LIMITED_EVENT, dict(refusal, message=data['message']), to=sid)
+            return
+        message_runner.submit(sid, process_and_reply, sid, client.ip_address, data['message'])
+
+
+@sio.event
+@metrics.timed('vpn_socketio_event_seconds', event='send_message_batch')
+async def send_message_batch(sid, data):
+    # Same payload and acknowledgement as the handler in app.py
+    client = vpn_server.get_client(sid)
+    items = data.get('messages') if isinstance(data, dict) else None
+    if not client or not isinstance(items, list):
+        return {'error': 'Expected {"messages": [{"seq": ..., "message": ...}, ...]}'}
+    if len(items) > config['MESSAGE_BATCH_MAX']:
+        return {'error': f"At most {config['MESSAGE_BATCH_MAX']} messages per batch"}
+
+    batch = []
+    for position, item in enumerate(items):
+        if isinstance(item, dict) and isinstance(item.get('message'), str):
+            batch.append((item.get('seq', position), item['message']))
+    if not batch:
+        return {'accepted': 0}
+    seqs = [seq for seq, _ in batch]
+    messages = [message for _, message in batch]
+    refusal = admission.admit(client, len(messages))
+    if refusal is not None:
+        await sio.emit(RATE_LIMITED_EVENT, dict(refusal, seqs=seqs), to=sid)
+        return {'accepted': 0, 'rate_limited': refusal['reason']}
+    message_runner.submit(sid, process_batch_and_reply, sid, client.ip_address, seqs, messages)
+    return {'accepted': len(batch)}
+
+
+@sio.event
+async def get_history(sid, data=None):
+    limit = (data or {}).get('limit')
+    try:
+        return vpn_server.get_history(sid, limit)
+    except ValueError as e:
+        return {'error': str(e)}
+
+
+@sio.event
+async def subscribe_stats(sid):
+    # The initial snapshot may read the shared counters
+    await run_blocking(stats_broadcaster.subscribe, sid)
+
+
+@sio.event
+async def unsubscribe_stats(sid):
+    stats_broadcaster.unsubscribe(sid)
+
+
+@sio.event
+async def subscribe_log_tail(sid, data=None):
+    data = data or {}
+    after = data.get('after')
+    try:
+        room = await run_blocking(
+            log_tail.subscribe, sid, data.get('ip_address'), data.get('direction'),
+            after if isinstance(after, dict) else None
+        )
+    except ValueError as e:
+        return {'error': str(e)}
+    return {'room': room}
+
+
+@sio.event
+async def unsubscribe_log_tail(sid):
+    log_tail.unsubscribe(sid)
+
+
+async def process_and_reply(client_id, ip_address, message):
+    """Log a client message, process it and send the response"""
+    try:
+        await write_log(logger.log_message, client_id, ip_address, message, 'outgoing')
+        response, = await vpn_server.process_messages_async(client_id, [message])
+    finally:
+        admission.release()
+    await write_log(logger.log_message, client_id, ip_address, response, 'incoming')
+    await sio.emit('receive_message', {'message': response, 'timestamp': datetime.datetime.now()},
+                   to=client_id, ignore_queue=True)
+    shared_state.incr('total_messages', 2)
+    stats_broadcaster.mark_dirty()
+
+
+async def process_batch_and_reply(client_id, ip_address, seqs, messages):
+    """Log a message batch, process it and send one reply"""
+    try:
+        await write_log(logger.log_messages, client_id, ip_address, messages, 'outgoing')
+        responses = await vpn_server.process_messages_async(client_id, messages)
+    finally:
+        admission.release()
+    await write_log(logger.log_messages, client_id, ip_address, responses, 'incoming')
+    await sio.emit('receive_message_batch', {
+        'responses': [{'seq': seq, 'message': response} for seq, response in zip(seqs, responses)],
+        'timestamp': datetime.datetime.now()
+    }, to=client_id, ignore_queue=True)
+    shared_state.incr('total_messages', 2 * len(messages))
+    stats_broadcaster.mark_dirty()
+
+
+async def _startup():
+    emitter.bind(asyncio.get_running_loop())
+
+
+def _shutdown():
+    db_executor.shutdown(wait=True)
+
+
+application = socketio.ASGIApp(
+    sio,
+    other_asgi_app=WSGIMiddleware(vpn_app.app, workers=config['ASGI_WSGI_THREADS']),
+    on_startup=_startup,
+    on_shutdown=_shutdown
+)
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Serve the VPN app on asyncio')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args(argv)
+    # uvicorn trusts X-Forwarded-For from loopback peers by default; only honour it like app.py does
+    uvicorn.run(application, host=args.host, port=args.port, proxy_headers=config['TRUSTED_PROXY'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import collections
+import hashlib
+import threading
+import time
+
+
+class CachedResponse:
+    """Serialized body and headers of a response, tagged with its generation"""
+
+    __slots__ = ('body', 'headers', 'etag', 'generation', 'expires')
+
+    def __init__(self, body, headers, generation, expires=None):
+        self.body = body
+        self.headers = headers
+        self.generation = generation
+        self.expires = expires
+        # Content hash, so a rebuilt but unchanged response keeps its ETag
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+
+
+class ResponseCache:
+    """LRU cache of read API responses invalidated by generation counters
+
+    Each entry is stored with the generation of the data it was built
+    from (e.g. Logger.generation); a lookup with a different generation
+    is a miss and replaces it. Entries can also carry a max age, for
+    responses whose source has no counter or lives in another process.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation):
+        """The entry for key if it was built at this generation and hasn't expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or entry.generation != generation
+                    or (entry.expires is not None and entry.expires <= time.monotonic())):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, generation, body, headers, max_age=None):
+        expires = time.monotonic() + max_age if max_age else None
+        entry = CachedResponse(body, headers, generation, expires)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Get entry count and hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -1,24 +1,30 @@
-import datetime
 import socket
 import threading
 import time
 import random
+from collections import deque
+
+from vpn.server import DEFAULT_HISTORY_DEPTH
 
 class VPNClient:
-    def __init__(self, client_id, ip_address, server):
+    __slots__ = ('client_id', 'ip_address', 'server', 'connected',
+                 'connection_time', 'disconnection_time', 'messages')
+
+    def __init__(self, client_id, ip_address, server, history_depth=DEFAULT_HISTORY_DEPTH):
         self.client_id = client_id
         self.ip_address = ip_address
         self.server = server
         self.connected = False
         self.connection_time = None
         self.disconnection_time = None
-        self.messages = []
+        # Ring buffer of (epoch seconds, direction, content) tuples
+        self.messages = deque(maxlen=history_depth)
     
     def connect(self):
         """Simulate connecting to the VPN server"""
         if not self.connected:
             self.connected = True
-            self.connection_time = datetime.datetime.now()
+            self.connection_time = time.time()
             return True
         return False
     
@@ -26,18 +32,14 @@ class VPNClient:
         """Simulate disconnecting from the VPN server"""
         if self.connected:
             self.connected = False
-            self.disconnection_time = datetime.datetime.now()
+            self.disconnection_time = time.time()
             return True
         return False
     
     def send_message(self, message):
         """Send a message to the VPN server"""
         if self.connected:
-            self.messages.append({
-                'content': message,
-                'timestamp': datetime.datetime.now(),
-                'direction': 'outgoing'
-            })
+            self.messages.append((time.time(), 'outgoing', message))
             # Simulate network delay
             time.sleep(random.uniform(0.05, 0.2))
             return True
@@ -46,19 +48,26 @@ class VPNClient:
     def receive_message(self, message):
         """Receive a message from the VPN server"""
         if self.connected:
-            self.messages.append({
-                'content': message,
-                'timestamp': datetime.datetime.now(),
-                'direction': 'incoming'
-            })
+            self.messages.append((time.time(), 'incoming', message))
             return True
         return False
+    
+    def recent_messages(self, limit=None):
+        """Most recent messages, oldest first"""
+        entries = list(self.messages)
+        if limit is not None:
+            entries = entries[-limit:] if limit > 0 else []
+        return [
+            {'content': content, 'timestamp': timestamp, 'direction': direction}
+            for timestamp, direction, content in entries
+        ]
 
 class ClientHandler:
-    def __init__(self, server):
+    def __init__(self, server, history_depth=DEFAULT_HISTORY_DEPTH):
         self.server = server
         self.clients = {}
         self.next_client_id = 1
+        self.history_depth = history_depth
     
     def create_client(self, ip_address=None):
         """Create a new VPN client"""
@@ -70,7 +79,7 @@ class ClientHandler:
         client_id = f"client_{self.next_client_id}"
         self.next_client_id += 1
         
-        client = VPNClient(client_id, ip_address, self.server)
+        client = VPNClient(client_id, ip_address, self.server, self.history_depth)
         self.clients[client_id] = client
         
         return client
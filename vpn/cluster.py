@@ -0,0 +1,206 @@
+"""Run app.py as several worker processes behind a sticky TCP proxy
+
+Each worker serves the full app on 127.0.0.1:<base-port + n>. They share
+connected clients and counters through VPN_SHARED_STATE=sqlite and relay
+Socket.IO emits (stats broadcasts, room messages) through the
+VPN_MESSAGE_QUEUE manager, so a broadcast from any worker reaches clients
+on every worker. The proxy picks a worker from a hash of the client IP,
+which keeps a client's long-polling requests and WebSocket upgrade on the
+worker that holds its Socket.IO session, and passes the real address on
+in X-Forwarded-For.
+
+    python -m vpn.cluster --workers 4 --port 5001
+
+Run from the project root, like app.py.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import zlib
+
+from vpn.analytics import Analytics
+from vpn.db import Database
+from vpn.logger import Logger
+
+# Headers the proxy sets itself and never forwards from the client
+HOP_HEADERS = (b'x-forwarded-for', b'connection', b'keep-alive')
+
+
+def run_worker(port):
+    """Serve the app on one loopback port (the proxy is the public entry point)"""
+    from app import app, socketio
+    socketio.run(app, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True)
+
+
+def _rewrite_head(head, client_ip):
+    """Add X-Forwarded-For to a request head and close plain HTTP requests after one response
+
+    Only the first request on a connection passes through here, so
+    everything but WebSocket upgrades is sent with Connection: close and
+    the next request opens a new connection with its own header.
+    """
+    lines = head[:-4].split(b'\r\n')
+    upgrade = any(line.lower().startswith(b'upgrade:') for line in lines[1:])
+    kept = [lines[0]]
+    for line in lines[1:]:
+        name = line.split(b':', 1)[0].strip().lower()
+        if name in HOP_HEADERS and not (upgrade and name == b'connection'):
+            continue
+        kept.append(line)
+    kept.append(b'X-Forwarded-For: ' + client_ip.encode())
+    if not upgrade:
+        kept.append(b'Connection: close')
+    return b'\r\n'.join(kept) + b'\r\n\r\n'
+
+
+async def _pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        try:
+            writer.close()
+        except (ConnectionError, OSError):
+            pass
+
+
+class StickyProxy:
+    """TCP proxy that always sends a client IP to the same backend port"""
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    def backend_for(self, client_ip):
+        return self.backends[zlib.crc32(client_ip.encode()) % len(self.backends)]
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        client_ip = peer[0] if peer else ''
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection('127.0.0.1', self.backend_for(client_ip))
+        except OSError:
+            writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            writer.close()
+            return
+        upstream_writer.write(_rewrite_head(head, client_ip))
+        try:
+            await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+        except asyncio.CancelledError:
+            # Open connections are dropped when the proxy shuts down
+            upstream_writer.close()
+            writer.close()
+
+
+class Cluster:
+    """Start, supervise and stop the worker processes"""
+
+    def __init__(self, workers, base_port, message_queue='sqlite'):
+        self.ports = [base_port + n for n in range(workers)]
+        self.message_queue = message_queue
+        self.processes = {}
+
+    def _worker_env(self, index):
+        env = dict(os.environ)
+        env['VPN_SHARED_STATE'] = 'sqlite'
+        env['VPN_MESSAGE_QUEUE'] = self.message_queue
+        env['VPN_WORKER_ID'] = f'worker-{index}'
+        env['VPN_TRUSTED_PROXY'] = '1'
+        # Rollups and archiving only need to run in one process
+        if index > 0:
+            env['VPN_RETENTION'] = '0'
+        return env
+
+    def spawn(self, index):
+        command = [sys.executable, '-m', 'vpn.cluster', '--serve-worker', str(self.ports[index])]
+        self.processes[index] = subprocess.Popen(command, env=self._worker_env(index))
+
+    def start(self):
+        # Migrate and close sessions a crash left open once, before any worker serves
+        db = Database(os.environ.get('VPN_DATABASE', 'database/vpn_logs.db'))
+        db.init_schema()
+        # Count the sessions it closes, as a single process's Analytics would
+        analytics = Analytics(db)
+        analytics.load()
+        logger = Logger(db=db)
+        logger.add_listener(analytics.record)
+        logger.recover_sessions()
+        analytics.checkpoint()
+        db.close()
+        for index in range(len(self.ports)):
+            self.spawn(index)
+
+    async def supervise(self, interval=1.0):
+        """Restart workers that exit"""
+        while True:
+            await asyncio.sleep(interval)
+            for index, process in list(self.processes.items()):
+                if process.poll() is not None:
+                    print(f'worker-{index} exited with {process.returncode}, restarting', file=sys.stderr)
+                    self.spawn(index)
+
+    def stop(self):
+        # SIGINT lets workers run their atexit hooks and flush queued log events
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def _serve(cluster, host, port):
+    proxy = StickyProxy(cluster.ports)
+    server = await asyncio.start_server(proxy.handle, host, port)
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: stopped.done() or stopped.set_result(None))
+    supervisor = asyncio.ensure_future(cluster.supervise())
+    print(f'Proxying {host}:{port} to {len(cluster.ports)} workers on ports {cluster.ports}', file=sys.stderr)
+    async with server:
+        await stopped
+    supervisor.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the VPN app as several worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001, help='public port of the sticky proxy')
+    parser.add_argument('--base-port', type=int, default=5101, help='first loopback port used by the workers')
+    parser.add_argument('--message-queue', default=os.environ.get('VPN_MESSAGE_QUEUE') or 'sqlite',
+                        help="'sqlite', 'sqlite:///path' or a redis:// / amqp:// URL")
+    parser.add_argument('--serve-worker', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve_worker:
+        run_worker(args.serve_worker)
+        return 0
+
+    cluster = Cluster(args.workers, args.base_port, message_queue=args.message_queue)
+    cluster.start()
+    try:
+        asyncio.run(_serve(cluster, args.host, args.port))
+    finally:
+        cluster.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import time
+
+from vpn.metrics import REGISTRY
+
+COMMAND_SECONDS = 'vpn_command_seconds'
+REGISTRY.describe(COMMAND_SECONDS, 'Time spent in chat command handlers by command')
+
+# Label for messages that don't start with a registered command
+DEFAULT_COMMAND = 'default'
+
+
+class Command:
+    """A registered chat command"""
+
+    __slots__ = ('name', 'handler', 'fast', 'help', '_histogram')
+
+    def __init__(self, name, handler, fast=False, help=None):
+        self.name = name
+        self.handler = handler
+        # Fast commands skip the simulated latency and history recording
+        self.fast = fast
+        self.help = help
+        self._histogram = None
+
+    def run(self, server, client_id, message, args):
+        """Call the handler and record how long it took"""
+        started = time.perf_counter()
+        try:
+            return self.handler(server, client_id, message, args)
+        finally:
+            if self._histogram is None:
+                self._histogram = REGISTRY.histogram(COMMAND_SECONDS, command=self.name)
+            self._histogram.observe(time.perf_counter() - started)
+
+
+class PrefixTrie:
+    """Character trie answering "which single word starts with this prefix?\""""
+
+    def __init__(self):
+        # Each node is {char: child}; '' holds the values of every word below it
+        self._root = {'': set()}
+
+    def insert(self, word, value):
+        node = self._root
+        node[''].add(value)
+        for char in word:
+            node = node.setdefault(char, {'': set()})
+            node[''].add(value)
+
+    def unique(self, prefix):
+        """The value under prefix if exactly one word has it, else None"""
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        values = node['']
+        if len(values) != 1:
+            return None
+        return next(iter(values))
+
+
+class CommandRegistry:
+    """Chat commands dispatched on the first token of a message
+
+    Lookup is a dict hit on the lowercased first token, so the cost does not
+    grow with the number of commands. With prefix matching an unambiguous
+    abbreviation ("st" for "status") also resolves, via a trie walk over the
+    token's characters. Messages matching no command go to the default
+    handler.
+    """
+
+    def __init__(self):
+        self._commands = {}
+        self._trie = PrefixTrie()
+        self._default = None
+
+    def command(self, name, fast=False, aliases=(), help=None):
+        """Decorator registering handler(server, client_id, message, args) for name"""
+        def decorator(handler):
+            self.register(name, handler, fast=fast, aliases=aliases, help=help)
+            return handler
+        return decorator
+
+    def default(self, handler):
+        """Decorator registering the handler for messages that aren't commands"""
+        self._default = Command(DEFAULT_COMMAND, handler)
+        return handler
+
+    def register(self, name, handler, fast=False, aliases=(), help=None):
+        command = Command(name, handler, fast=fast, help=help)
+        for key in (name,) + tuple(aliases):
+            key = key.lower()
+            if key in self._commands:
+                raise ValueError(f'Command already registered: {key}')
+            self._commands[key] = command
+            self._trie.insert(key, command)
+        return command
+
+    def names(self):
+        """Registered command names in registration order, without aliases"""
+        seen = []
+        for command in self._commands.values():
+            if command.name not in seen:
+                seen.append(command.name)
+        return seen
+
+    def resolve(self, message, prefix=False):
+        """(command, args) for a message; command is the default handler if none matches"""
+        token, _, args = message.strip().partition(' ')
+        token = token.lower()
+        command = self._commands.get(token)
+        if command is None and prefix and token:
+            command = self._trie.unique(token)
+        if command is None:
+            return self._default, message
+        return command, args.strip()
+
+    def stats(self):
+        """Calls and latency per command"""
+        return REGISTRY.summary(COMMAND_SECONDS)
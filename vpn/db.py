@@ -0,0 +1,344 @@
+import sqlite3
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# PRAGMA auto_vacuum value of a database freed pages can be released from
+AUTO_VACUUM_INCREMENTAL = 2
+
+TABLES = [
+    '''
+CREATE TABLE IF NOT EXISTS connection_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT,
+    ip_address TEXT,
+    connection_time TIMESTAMP,
+    disconnection_time TIMESTAMP NULL,
+    status TEXT
+)
+''',
+    '''
+CREATE TABLE IF NOT EXISTS message_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT,
+    ip_address TEXT,
+    message TEXT,
+    timestamp TIMESTAMP,
+    direction TEXT
+)
+''',
+    # nodes table for "everyone is a server+client" presence tracking
+    '''
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT,
+    username TEXT,
+    ip TEXT,
+    user_agent TEXT,
+    is_server INTEGER DEFAULT 1,
+    is_client INTEGER DEFAULT 1,
+    last_seen TIMESTAMP
+)
+''',
+    'CREATE INDEX IF NOT EXISTS idx_nodes_last_seen ON nodes(last_seen)',
+]
+
+# Schema migrations, applied in order on startup. PRAGMA user_version records
+# how many have run, so existing databases pick up new indexes exactly once.
+SCHEMA_MIGRATIONS = [
+    # 1: indexes for keyset pages on the log tables; rowid is implicitly the
+    # trailing column, so "WHERE col = ? AND id < ? ORDER BY id DESC" is a
+    # single range walk
+    [
+        'CREATE INDEX IF NOT EXISTS idx_connection_logs_client ON connection_logs(client_id)',
+        'CREATE INDEX IF NOT EXISTS idx_connection_logs_status ON connection_logs(status)',
+        'CREATE INDEX IF NOT EXISTS idx_message_logs_client ON message_logs(client_id)',
+        'CREATE INDEX IF NOT EXISTS idx_message_logs_direction ON message_logs(direction)',
+    ],
+    # 2: indexes for time-range and exact/prefix IP filters
+    [
+        'CREATE INDEX IF NOT EXISTS idx_connection_logs_time ON connection_logs(connection_time)',
+        'CREATE INDEX IF NOT EXISTS idx_connection_logs_ip ON connection_logs(ip_address)',
+        'CREATE INDEX IF NOT EXISTS idx_message_logs_time ON message_logs(timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_message_logs_ip ON message_logs(ip_address)',
+    ],
+    # 3: FTS5 index over message content, kept in sync by triggers and
+    # backfilled from the existing rows
+    [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS message_logs_fts USING fts5(
+            message, content='message_logs', content_rowid='id'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS message_logs_fts_ai AFTER INSERT ON message_logs BEGIN
+            INSERT INTO message_logs_fts(rowid, message) VALUES (new.id, new.message);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS message_logs_fts_ad AFTER DELETE ON message_logs BEGIN
+            INSERT INTO message_logs_fts(message_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS message_logs_fts_au AFTER UPDATE OF message ON message_logs BEGIN
+            INSERT INTO message_logs_fts(message_logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO message_logs_fts(rowid, message) VALUES (new.id, new.message);
+        END''',
+        "INSERT INTO message_logs_fts(message_logs_fts) VALUES ('rebuild')",
+    ],
+    # 4: one row per node session; keep the latest row for duplicated sessions
+    [
+        'DELETE FROM nodes WHERE id NOT IN (SELECT MAX(id) FROM nodes GROUP BY session_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_nodes_session ON nodes(session_id)',
+    ],
+    # 5: hourly rollups maintained by the retention job. Switching an existing
+    # database to incremental auto-vacuum needs a full VACUUM, which rewrites
+    # the file under the write lock, so that is left to
+    # Database.enable_incremental_vacuum (flask enable-incremental-vacuum)
+    [
+        '''CREATE TABLE IF NOT EXISTS message_rollup_hourly (
+            hour TEXT,
+            client_id TEXT,
+            ip_address TEXT,
+            direction TEXT,
+            messages INTEGER DEFAULT 0,
+            PRIMARY KEY (hour, client_id, ip_address, direction)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS connection_rollup_hourly (
+            hour TEXT,
+            ip_address TEXT,
+            connections INTEGER DEFAULT 0,
+            disconnections INTEGER DEFAULT 0,
+            total_duration_seconds REAL DEFAULT 0,
+            PRIMARY KEY (hour, ip_address)
+        )''',
+        'CREATE TABLE IF NOT EXISTS rollup_state (name TEXT PRIMARY KEY, value TEXT)',
+        'CREATE INDEX IF NOT EXISTS idx_connection_logs_closed ON connection_logs(disconnection_time)',
+    ],
+    # 6: counters behind /api/analytics, seeded once from the rows still in
+    # the log tables and kept up to date by the Analytics checkpoints
+    [
+        '''CREATE TABLE IF NOT EXISTS analytics_counters (
+            metric TEXT,
+            key TEXT,
+            value INTEGER DEFAULT 0,
+            PRIMARY KEY (metric, key)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_analytics_counters_value ON analytics_counters(metric, value)',
+        '''INSERT INTO analytics_counters (metric, key, value)
+            SELECT 'totals', 'messages', count(*) FROM message_logs
+            UNION ALL SELECT 'totals', 'connections', count(*) FROM connection_logs
+            UNION ALL SELECT 'totals', 'disconnections', count(*) FROM connection_logs
+                WHERE disconnection_time IS NOT NULL''',
+        '''INSERT INTO analytics_counters (metric, key, value)
+            SELECT 'messages_by_direction', direction, count(*) FROM message_logs
+            WHERE direction IS NOT NULL GROUP BY direction''',
+        '''INSERT INTO analytics_counters (metric, key, value)
+            SELECT 'messages_by_ip', ip_address, count(*) FROM message_logs
+            WHERE ip_address IS NOT NULL GROUP BY ip_address''',
+        '''INSERT INTO analytics_counters (metric, key, value)
+            SELECT 'connections_by_ip', ip_address, count(*) FROM connection_logs
+            WHERE ip_address IS NOT NULL GROUP BY ip_address''',
+        '''INSERT INTO analytics_counters (metric, key, value)
+            SELECT 'messages_per_minute', strftime('%Y-%m-%d %H:%M', timestamp), count(*) FROM message_logs
+            WHERE timestamp >= datetime('now', 'localtime', '-1 day') GROUP BY 2''',
+        '''INSERT INTO analytics_counters (metric, key, value)
+            SELECT 'session_duration', bucket, count(*) FROM (
+                SELECT CASE
+                    WHEN seconds < 10 THEN '<10s'
+                    WHEN seconds < 60 THEN '10s-1m'
+                    WHEN seconds < 300 THEN '1m-5m'
+                    WHEN seconds < 1800 THEN '5m-30m'
+                    WHEN seconds < 7200 THEN '30m-2h'
+                    ELSE '>2h'
+                END AS bucket
+                FROM (
+                    SELECT (julianday(disconnection_time) - julianday(connection_time)) * 86400 AS seconds
+                    FROM connection_logs WHERE disconnection_time IS NOT NULL
+                )
+            ) GROUP BY bucket''',
+    ],
+    # 7: state shared by worker processes when VPN_SHARED_STATE=sqlite
+    [
+        '''CREATE TABLE IF NOT EXISTS shared_clients (
+            client_id TEXT PRIMARY KEY,
+            worker_id TEXT,
+            ip_address TEXT,
+            connected_at REAL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_shared_clients_worker ON shared_clients(worker_id)',
+        'CREATE TABLE IF NOT EXISTS shared_counters (name TEXT PRIMARY KEY, value INTEGER DEFAULT 0)',
+        'CREATE TABLE IF NOT EXISTS shared_workers (worker_id TEXT PRIMARY KEY, last_seen REAL)',
+    ],
+    # 8: partial index over open sessions only; disconnects that fall back to
+    # "client_id = ? AND status = 'connected'" search just the live rows
+    [
+        "CREATE INDEX IF NOT EXISTS idx_connection_logs_open ON connection_logs(client_id) WHERE status = 'connected'",
+    ],
+]
+
+
+def migrate_schema(conn):
+    """Apply any schema migrations the database has not seen yet"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            conn.execute(statement)
+        # PRAGMA does not take parameters
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+    if version < len(SCHEMA_MIGRATIONS):
+        conn.execute('PRAGMA optimize')
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the checkout timeout"""
+
+
+class Database:
+    """Bounded pool of SQLite connections shared by the app and the Logger
+
+    Connections run in WAL mode so dashboard readers don't block log writers,
+    and each keeps its own prepared-statement cache alive across checkouts.
+    """
+
+    def __init__(self, path='database/vpn_logs.db', pool_size=8, checkout_timeout=10.0,
+                 busy_timeout_ms=5000, synchronous='NORMAL', cache_size_kb=16384,
+                 mmap_size=256 * 1024 * 1024, cached_statements=256):
+        self.path = path
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        """Open a new connection with the pool's pragmas applied"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        return conn
+
+    def _checkout(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._open < self.pool_size:
+                    self._open += 1
+                    opening = True
+                else:
+                    opening = False
+            if opening:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.checkout_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f'No database connection available after {self.checkout_timeout}s')
+                waited = time.perf_counter() - started
+                with self._lock:
+                    self._waits += 1
+                    self._wait_time += waited
+                    self._max_wait = max(self._max_wait, waited)
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+        return conn
+
+    def _checkin(self, conn):
+        # Never hand the next caller a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check a connection out of the pool for the duration of a with block
+
+        Callers commit their own writes; anything left uncommitted is rolled
+        back when the connection returns to the pool.
+        """
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def init_schema(self):
+        """Create tables if they don't exist and run pending migrations"""
+        with self.connection() as conn:
+            # Switching auto_vacuum takes a VACUUM, which costs nothing while the file is empty
+            if not conn.execute('SELECT count(*) FROM sqlite_master').fetchone()[0]:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            for statement in TABLES:
+                conn.execute(statement)
+            conn.commit()
+            migrate_schema(conn)
+
+    def enable_incremental_vacuum(self):
+        """Switch an existing database to incremental auto-vacuum
+
+        Needs a full VACUUM, which rewrites the whole file and blocks writers
+        until it finishes, so run it during maintenance. Returns False if the
+        database already uses incremental auto-vacuum.
+        """
+        with self.connection() as conn:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+                return False
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        return True
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        """Get pool metrics"""
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'open_connections': self._open,
+                'in_use': self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_seconds': self._wait_time,
+                'max_wait_seconds': self._max_wait,
+                'timeouts': self._timeouts
+            }
@@ -0,0 +1,282 @@
+"""Headless load generator for the VPN Socket.IO server
+
+Spawns simulated clients from ClientHandler against a running app.py and
+drives its connect/send_message/disconnect events. Clients arrive as a
+Poisson process, send a configurable mix of commands with exponential
+think time between them, and wait for each receive_message before the
+next send. A JSON report with throughput, round-trip latency percentiles
+and error counts is printed (or written with --output); replies that
+arrive after their send timed out are counted as late_responses and kept
+out of the latencies. Messages shed by
+the server's admission control count as rate_limited:<reason> errors;
+without VPN_TRUSTED_PROXY every simulated client shares one IP bucket, so
+raise VPN_IP_MESSAGE_RATE (or set it to 0) for large runs.
+
+    python -m vpn.loadgen --url http://127.0.0.1:5001 --clients 1000 --rate 50
+
+Requires the python-socketio client extras (requests, websocket-client).
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+import socketio
+
+from vpn.client_handler import ClientHandler
+
+DEFAULT_MIX = 'ping=0.3,status=0.2,help=0.1,text=0.4'
+
+FREE_TEXT = [
+    'hello there',
+    'is the tunnel up?',
+    'sending some encrypted payload',
+    'what is my exit node',
+    'lorem ipsum dolor sit amet consectetur adipiscing elit',
+]
+
+
+def parse_mix(spec):
+    """Parse 'ping=0.3,status=0.2,...' into (kinds, weights)"""
+    kinds, weights = [], []
+    for part in spec.split(','):
+        kind, _, weight = part.partition('=')
+        kinds.append(kind.strip())
+        weights.append(float(weight or 1))
+    return kinds, weights
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, math.ceil(pct * len(sorted_values) / 100) - 1))
+    return sorted_values[rank]
+
+
+def summarize(values):
+    """Latency summary in milliseconds"""
+    values = sorted(v * 1000 for v in values)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': values[-1]
+    }
+
+
+class LoadGenerator:
+    def __init__(self, url, clients=100, rate=10.0, messages=10, think_time=0.5,
+                 mix=DEFAULT_MIX, response_timeout=10.0, transports=('websocket',), seed=None):
+        self.url = url
+        self.clients = clients
+        # Client arrivals per second
+        self.rate = rate
+        self.messages = messages
+        # Mean seconds between a response and the next send
+        self.think_time = think_time
+        self.kinds, self.weights = parse_mix(mix)
+        self.response_timeout = response_timeout
+        self.transports = list(transports)
+        self.random = random.Random(seed)
+
+        self.handler = ClientHandler(server=url)
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.connect_latencies = []
+        self.errors = Counter()
+        self.sent = 0
+        self.received = 0
+        # Replies that arrived after their send had timed out
+        self.late_responses = 0
+        self.by_kind = Counter()
+
+    def _message(self, rng):
+        kind = rng.choices(self.kinds, self.weights)[0]
+        if kind == 'text':
+            return kind, rng.choice(FREE_TEXT)
+        return kind, kind
+
+    def _error(self, kind):
+        with self._lock:
+            self.errors[kind] += 1
+
+    def _create_client(self):
+        # ClientHandler is not thread-safe and every simulated client shares it
+        with self._lock:
+            return self.handler.create_client()
+
+    def _remove_client(self, client_id):
+        with self._lock:
+            self.handler.remove_client(client_id)
+
+    def _run_client(self, seed):
+        rng = random.Random(seed)
+        client = self._create_client()
+        sio = socketio.Client(reconnection=False)
+        pending = deque()
+        answered = threading.Event()
+        # Replies still owed to sends that timed out; they are dropped on arrival
+        stale = [0]
+        pending_lock = threading.Lock()
+
+        def take_pending():
+            """Start time of the send a reply answers, or None for a late reply"""
+            with pending_lock:
+                if stale[0]:
+                    stale[0] -= 1
+                    return None
+                return pending.popleft() if pending else None
+
+        @sio.on('receive_message')
+        def on_receive(data):
+            now = time.perf_counter()
+            started = take_pending()
+            if started is None:
+                with self._lock:
+                    self.late_responses += 1
+                return
+            with self._lock:
+                self.latencies.append(now - started)
+                self.received += 1
+            client.receive_message(data.get('message', ''))
+            answered.set()
+
+        @sio.on('rate_limited')
+        def on_rate_limited(data):
+            # Shed by the server's admission control; no response will follow
+            if take_pending() is None:
+                return
+            self._error(f"rate_limited:{data.get('reason')}")
+            answered.set()
+
+        started = time.perf_counter()
+        try:
+            sio.connect(self.url, transports=self.transports,
+                        headers={'X-Forwarded-For': client.ip_address},
+                        wait_timeout=self.response_timeout)
+        except Exception:
+            self._error('connect')
+            self._remove_client(client.client_id)
+            return
+        client.connect()
+        with self._lock:
+            self.connect_latencies.append(time.perf_counter() - started)
+
+        try:
+            for _ in range(self.messages):
+                kind, text = self._message(rng)
+                answered.clear()
+                with pending_lock:
+                    pending.append(time.perf_counter())
+                try:
+                    sio.emit('send_message', {'message': text})
+                except Exception:
+                    with pending_lock:
+                        pending.pop()
+                    self._error('send')
+                    break
+                with self._lock:
+                    self.sent += 1
+                    self.by_kind[kind] += 1
+                if not answered.wait(self.response_timeout):
+                    with pending_lock:
+                        # The reply may have landed since the wait gave up
+                        timed_out = bool(pending)
+                        if timed_out:
+                            pending.clear()
+                            stale[0] += 1
+                    if timed_out:
+                        self._error('timeout')
+                if not sio.connected:
+                    self._error('disconnected')
+                    break
+                if self.think_time > 0:
+                    time.sleep(rng.expovariate(1 / self.think_time))
+        finally:
+            try:
+                sio.disconnect()
+            except Exception:
+                self._error('disconnect')
+            self._remove_client(client.client_id)
+
+    def run(self):
+        """Run the whole load test and return the report dict"""
+        threads = []
+        started = time.perf_counter()
+        for _ in range(self.clients):
+            thread = threading.Thread(target=self._run_client, args=(self.random.random(),), daemon=True)
+            thread.start()
+            threads.append(thread)
+            if self.rate > 0:
+                time.sleep(self.random.expovariate(self.rate))
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        with self._lock:
+            return {
+                'url': self.url,
+                'clients': self.clients,
+                'arrival_rate': self.rate,
+                'messages_per_client': self.messages,
+                'think_time': self.think_time,
+                'duration_seconds': elapsed,
+                'messages_sent': self.sent,
+                'responses': self.received,
+                'late_responses': self.late_responses,
+                'throughput_per_second': self.received / elapsed if elapsed else 0,
+                'message_mix': dict(self.by_kind),
+                'round_trip_ms': summarize(self.latencies),
+                'connect_ms': summarize(self.connect_latencies),
+                'errors': dict(self.errors),
+                'error_count': sum(self.errors.values())
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the VPN Socket.IO server')
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--clients', type=int, default=100, help='total simulated clients')
+    parser.add_argument('--rate', type=float, default=10.0, help='client arrivals per second (0 = all at once)')
+    parser.add_argument('--messages', type=int, default=10, help='messages sent per client')
+    parser.add_argument('--think-time', type=float, default=0.5, help='mean seconds between messages')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='message weights, e.g. ' + DEFAULT_MIX)
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for each response')
+    parser.add_argument('--polling', action='store_true', help='use HTTP long-polling instead of WebSocket')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args(argv)
+
+    generator = LoadGenerator(
+        args.url,
+        clients=args.clients,
+        rate=args.rate,
+        messages=args.messages,
+        think_time=args.think_time,
+        mix=args.mix,
+        response_timeout=args.timeout,
+        transports=('polling',) if args.polling else ('websocket',),
+        seed=args.seed
+    )
+    report = generator.run()
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0 if report['error_count'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,124 +1,738 @@
 import sqlite3
 import datetime
+import ipaddress
+import logging
+import queue
+import threading
+import time
+
+from vpn.db import Database, PoolTimeout
+from vpn.metrics import REGISTRY, SQL_SECONDS
+
+# Distinct addresses in an ip prefix/CIDR filter worth an index walk each
+MAX_ADDRESS_WALKS = 64
+
+# Statements used by both the synchronous and the write-behind paths
+INSERT_CONNECTION = "INSERT INTO connection_logs (client_id, ip_address, connection_time, status) VALUES (?, ?, ?, ?)"
+UPDATE_DISCONNECTION = "UPDATE connection_logs SET disconnection_time = ?, status = ? WHERE client_id = ? AND status = 'connected'"
+INSERT_MESSAGE = "INSERT INTO message_logs (client_id, ip_address, message, timestamp, direction) VALUES (?, ?, ?, ?, ?)"
+# Same update by primary key, for sessions whose connection row id is known
+CLOSE_SESSION = "UPDATE connection_logs SET disconnection_time = ?, status = ? WHERE id = ? AND status = 'connected'"
+# Close sessions a previous process left open, ending them at their last logged message
+CLOSE_STALE_SESSIONS = """
+    UPDATE connection_logs SET status = 'disconnected', disconnection_time = coalesce(
+        (SELECT max(timestamp) FROM message_logs WHERE message_logs.client_id = connection_logs.client_id),
+        connection_time
+    )
+    WHERE status = 'connected'
+    RETURNING id, client_id, disconnection_time
+"""
+
+
+def _timestamp_bound(value, end=False):
+    """Normalise a date or ISO timestamp to the text form sqlite3 stores datetimes in"""
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    if isinstance(value, str):
+        date_only = len(value) == 10
+        value = datetime.datetime.fromisoformat(value)
+        if date_only and end:
+            value = value.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return value.isoformat(' ')
+
+
+def _next_prefix(prefix):
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def time_range_conditions(column, filters):
+    """Sargable BETWEEN/range predicates for the date/from/to filters"""
+    conditions = []
+    params = []
+    if 'date' in filters:
+        conditions.append(f"{column} BETWEEN ? AND ?")
+        params += [_timestamp_bound(filters['date']), _timestamp_bound(filters['date'], end=True)]
+    if 'from' in filters and 'to' in filters:
+        conditions.append(f"{column} BETWEEN ? AND ?")
+        params += [_timestamp_bound(filters['from']), _timestamp_bound(filters['to'], end=True)]
+    elif 'from' in filters:
+        conditions.append(f"{column} >= ?")
+        params.append(_timestamp_bound(filters['from']))
+    elif 'to' in filters:
+        conditions.append(f"{column} <= ?")
+        params.append(_timestamp_bound(filters['to'], end=True))
+    return conditions, params
+
+
+def ip_conditions(value, column='ip_address'):
+    """Index-friendly predicate for an exact address, a dotted prefix or an IPv4 CIDR block
+
+    "10.0.0.7" matches exactly, "10.0." or "10.0" match every address under that
+    prefix, and "10.0.16.0/20" expands to the prefixes the block covers. Every
+    form becomes equality or a range on the column so its index can be used.
+    """
+    value = value.strip()
+    if '/' in value:
+        network = ipaddress.ip_network(value, strict=False)
+        if network.version != 4:
+            raise ValueError('Only IPv4 CIDR blocks are supported')
+        octets = str(network.network_address).split('.')
+        full, rest = divmod(network.prefixlen, 8)
+        if full == 4:
+            return f"{column} = ?", [str(network.network_address)]
+        head = '.'.join(octets[:full])
+        head = head + '.' if head else ''
+        if rest == 0:
+            if not head:
+                return "1=1", []
+            prefixes = [head]
+        else:
+            first = int(octets[full])
+            values = range(first, first + 2 ** (8 - rest))
+            if full == 3:
+                addresses = [f"{head}{v}" for v in values]
+                return f"{column} IN ({', '.join('?' * len(addresses))})", addresses
+            prefixes = [f"{head}{v}." for v in values]
+        clauses = []
+        params = []
+        for prefix in prefixes:
+            clauses.append(f"({column} >= ? AND {column} < ?)")
+            params += [prefix, _next_prefix(prefix)]
+        return "(" + " OR ".join(clauses) + ")", params
+
+    try:
+        ipaddress.ip_address(value)
+        return f"{column} = ?", [value]
+    except ValueError:
+        pass
+    # Partial address: complete the last octet so "10.1" doesn't match "10.10.x.x"
+    if not value.endswith('.') and not value.endswith(':'):
+        value += '.' if '.' in value or value.isdigit() else ':'
+    return f"{column} >= ? AND {column} < ?", [value, _next_prefix(value)]
+
+
+def ip_matcher(value):
+    """In-memory predicate with the same exact/prefix/CIDR rules as ip_conditions"""
+    value = value.strip()
+    if '/' in value:
+        network = ipaddress.ip_network(value, strict=False)
+
+        def in_network(address):
+            try:
+                return ipaddress.ip_address(address) in network
+            except ValueError:
+                return False
+        return in_network
+    try:
+        ipaddress.ip_address(value)
+        return lambda address: address == value
+    except ValueError:
+        pass
+    if not value.endswith('.') and not value.endswith(':'):
+        value += '.' if '.' in value or value.isdigit() else ':'
+    return lambda address: address is not None and address.startswith(value)
+
+
+def _is_address(value):
+    try:
+        ipaddress.ip_address(value.strip())
+        return True
+    except ValueError:
+        return False
+
+
+def _planned_filters(filters):
+    """Split off the ip_address and message filters, which Logger._fetch_page plans itself"""
+    filters = dict(filters or {})
+    ip_filter = filters.pop('ip_address', None)
+    match = filters.pop('message', None)
+    return filters, ip_filter, fts_query(match) if match is not None else None
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that ANDs every term
+
+    Terms are quoted so FTS5 operators in user input are matched literally;
+    a trailing ``*`` on a term is kept as a prefix search.
+    """
+    terms = []
+    for term in text.split():
+        prefix = term.endswith('*')
+        term = term.rstrip('*')
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    if not terms:
+        raise ValueError('Search query is empty')
+    return ' '.join(terms)
+
+
+# Label for each write statement in the SQL timing histogram
+STATEMENT_NAMES = {
+    INSERT_CONNECTION: 'log_connection',
+    UPDATE_DISCONNECTION: 'log_disconnection',
+    INSERT_MESSAGE: 'log_message',
+}
+
+# Event type and column names for the records handed to listeners
+EVENT_FIELDS = {
+    INSERT_CONNECTION: ('connection', ('client_id', 'ip_address', 'connection_time', 'status')),
+    UPDATE_DISCONNECTION: ('disconnection', ('disconnection_time', 'status', 'client_id')),
+    INSERT_MESSAGE: ('message', ('client_id', 'ip_address', 'message', 'timestamp', 'direction')),
+}
+
+log = logging.getLogger(__name__)
+
+# Sentinel placed on the queue to wake the writer thread up for a flush
+_FLUSH = object()
+
 
 class Logger:
-    def __init__(self, db_path='database/vpn_logs.db'):
+    def __init__(self, db_path='database/vpn_logs.db', async_writes=False,
+                 batch_size=500, flush_interval=0.5, queue_size=10000,
+                 block_when_full=False, db=None):
         self.db_path = db_path
-    
-    def _get_connection(self):
-        """Get a database connection"""
-        conn = sqlite3.connect(self.db_path)
-        return conn
-    
+        # Share the app's connection pool when given one
+        self.db = db or Database(db_path)
+        self.async_writes = async_writes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_when_full = block_when_full
+
+        # Write-behind counters, see stats()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.listener_errors = 0
+        self.write_errors = 0
+        self._warned_at = float('-inf')
+        # Bumped after every committed write; read API caches compare against it
+        self.generation = 0
+
+        self._listeners = []
+        # client_id -> connection_logs row id of sessions still open
+        self._open_sessions = {}
+        self._queue = None
+        self._writer = None
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        if async_writes:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._writer = threading.Thread(target=self._writer_loop, name='logger-writer', daemon=True)
+            self._writer.start()
+
+    def add_listener(self, listener):
+        """Call listener(events) with every batch of events once it is committed
+
+        Each event is a dict of the written columns plus 'type' ('connection',
+        'disconnection' or 'message') and the new row 'id' for inserts.
+        Listeners run on the writing thread, so they should only do cheap
+        in-memory work.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, events):
+        for listener in self._listeners:
+            try:
+                listener(events)
+            except Exception:
+                with self._stats_lock:
+                    self.listener_errors += 1
+
+    @staticmethod
+    def _event(sql, params, row_id=None):
+        kind, fields = EVENT_FIELDS[sql]
+        event = dict(zip(fields, params))
+        event['type'] = kind
+        event['id'] = row_id
+        return event
+
+    def _write(self, sql, params):
+        """Write one event, either directly or through the write-behind queue"""
+        return self._write_rows(sql, (params,))
+
+    def _write_rows(self, sql, rows):
+        """Write events sharing a statement in one transaction, or queue them as one item
+
+        A queued item is never split across writer batches, so its rows
+        are committed together.
+        """
+        if not self.async_writes:
+            sessions = {}
+            with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement=STATEMENT_NAMES[sql]):
+                events = self._execute(conn.cursor(), sql, rows, sessions)
+                conn.commit()
+            self._apply_sessions(sessions)
+            with self._stats_lock:
+                self.generation += 1
+            if self._listeners:
+                self._notify(events)
+            return True
+
+        if self._closed:
+            raise RuntimeError('Logger is closed')
+        try:
+            self._queue.put((sql, rows), block=self.block_when_full)
+        except queue.Full:
+            self._drop(len(rows), 'the write-behind queue is full')
+            return False
+        with self._stats_lock:
+            self.enqueued += len(rows)
+        return True
+
+    def _drop(self, count, reason, exc_info=False):
+        """Count log rows that will never be written and say so in the log"""
+        now = time.monotonic()
+        with self._stats_lock:
+            self.dropped += count
+            total = self.dropped
+            # At most one warning a second while the queue stays full
+            warn = exc_info or now - self._warned_at >= 1.0
+            if warn:
+                self._warned_at = now
+        if warn:
+            log.warning('Dropped %d log row(s): %s (%d dropped so far)', count, reason, total, exc_info=exc_info)
+
+    def _writer_loop(self):
+        """Drain the queue, grouping events into one transaction per batch"""
+        while True:
+            batch = []
+            flushes = 0
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if item is _FLUSH:
+                    flushes += 1
+                    break
+                batch.append(item)
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    # Never let one bad batch end the writer; flush() and close() wait on it
+                    with self._stats_lock:
+                        self.write_errors += 1
+                    self._drop(sum(len(rows) for _, rows in batch), 'writing the batch failed', exc_info=True)
+            # Mark items done only after they are committed so flush() can wait on them
+            for _ in range(len(batch) + flushes + (1 if stop else 0)):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        """Write a batch of queued (sql, rows) items in a single transaction"""
+        count = sum(len(rows) for _, rows in batch)
+        try:
+            with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='log_batch'):
+                cursor = conn.cursor()
+                events = []
+                sessions = {}
+                # Consecutive events sharing a statement go through one executemany;
+                # keeping runs in queue order preserves connect/disconnect ordering.
+                start = 0
+                while start < len(batch):
+                    sql = batch[start][0]
+                    end = start
+                    while end < len(batch) and batch[end][0] == sql:
+                        end += 1
+                    run = [params for _, rows in batch[start:end] for params in rows]
+                    run_events = self._execute(cursor, sql, run, sessions)
+                    if run_events:
+                        events += run_events
+                    start = end
+                conn.commit()
+            self._apply_sessions(sessions)
+        except (sqlite3.Error, PoolTimeout):
+            # The pool rolls back whatever was left uncommitted on checkin
+            with self._stats_lock:
+                self.write_errors += 1
+            self._drop(count, 'writing the batch failed', exc_info=True)
+            return
+        with self._stats_lock:
+            self.written += count
+            self.batches += 1
+            self.generation += 1
+        if events:
+            self._notify(events)
+
+    def _execute(self, cursor, sql, rows, sessions):
+        """Run one statement over rows; returns listener events (None without listeners)
+
+        Connection inserts remember their row id per client, so the
+        matching disconnection updates its row by primary key. Those
+        changes go into `sessions` (client_id -> row id, or None once
+        closed) and only reach the open-session index through
+        _apply_sessions after the transaction commits.
+        """
+        if sql == UPDATE_DISCONNECTION:
+            by_id = []
+            by_client = []
+            row_ids = []
+            for params in rows:
+                client_id = params[2]
+                if client_id in sessions:
+                    row_id = sessions[client_id]
+                else:
+                    row_id = self._open_sessions.get(client_id)
+                sessions[client_id] = None
+                row_ids.append(row_id)
+                if row_id is None:
+                    by_client.append(params)
+                else:
+                    by_id.append((params[0], params[1], row_id))
+            if by_id:
+                cursor.executemany(CLOSE_SESSION, by_id)
+            # Sessions opened by another process or before a restart; uses the partial index
+            if by_client:
+                cursor.executemany(UPDATE_DISCONNECTION, by_client)
+            if not self._listeners:
+                return None
+            return [self._event(sql, params, row_id) for params, row_id in zip(rows, row_ids)]
+
+        if len(rows) == 1:
+            cursor.execute(sql, rows[0])
+        else:
+            cursor.executemany(sql, rows)
+        if sql != INSERT_CONNECTION and not self._listeners:
+            return None
+        # The writer holds the write lock for the whole transaction, so the
+        # rows of one executemany get consecutive ids ending at last_insert_rowid
+        last = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+        first = last - len(rows) + 1
+        if sql == INSERT_CONNECTION:
+            for offset, params in enumerate(rows):
+                sessions[params[0]] = first + offset
+        if not self._listeners:
+            return None
+        return [self._event(sql, params, first + offset) for offset, params in enumerate(rows)]
+
+    def _apply_sessions(self, sessions):
+        """Fold the session changes of a committed transaction into the open-session index"""
+        for client_id, row_id in sessions.items():
+            if row_id is None:
+                self._open_sessions.pop(client_id, None)
+            else:
+                self._open_sessions[client_id] = row_id
+
+    def recover_sessions(self, close_stale=True):
+        """Deal with connection rows still marked connected at startup
+
+        With close_stale (a single process, so no socket can still be open)
+        they are closed at their last logged message, listeners get a
+        'disconnection' event for each, and the count is returned. Otherwise
+        their ids are loaded so disconnects can update them by primary key.
+        """
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='recover_sessions'):
+            if close_stale:
+                closed = conn.execute(CLOSE_STALE_SESSIONS).fetchall()
+                conn.commit()
+            else:
+                rows = conn.execute("SELECT id, client_id FROM connection_logs WHERE status = 'connected'").fetchall()
+        if close_stale:
+            if self._listeners:
+                self._notify([
+                    self._event(UPDATE_DISCONNECTION, (
+                        datetime.datetime.fromisoformat(row['disconnection_time']), 'disconnected', row['client_id']
+                    ), row['id'])
+                    for row in closed if row['disconnection_time']
+                ])
+            return len(closed)
+        for row in rows:
+            self._open_sessions.setdefault(row['client_id'], row['id'])
+        return 0
+
+    def _join_queue(self):
+        """Wait for queued items like queue.join(), but stop if the writer thread has died"""
+        done = self._queue.all_tasks_done
+        with done:
+            while self._queue.unfinished_tasks:
+                if not self._writer.is_alive():
+                    return False
+                done.wait(0.5)
+        return True
+
+    def flush(self):
+        """Block until every queued event has been written"""
+        if not self.async_writes or self._closed or not self._writer.is_alive():
+            return
+        self._queue.put(_FLUSH)
+        self._join_queue()
+
+    def close(self):
+        """Flush pending events and stop the background writer"""
+        if not self.async_writes or self._closed:
+            return
+        self._closed = True
+        if not self._writer.is_alive():
+            return
+        self._queue.put(None)
+        if self._join_queue():
+            self._writer.join()
+
+    def stats(self):
+        """Get write-behind queue counters"""
+        with self._stats_lock:
+            return {
+                'async_writes': self.async_writes,
+                'queued': self._queue.qsize() if self._queue else 0,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'open_sessions': len(self._open_sessions),
+                'write_errors': self.write_errors,
+                'writer_alive': self._writer.is_alive() if self._writer else None,
+                'listener_errors': self.listener_errors
+            }
+
     def log_connection(self, client_id, ip_address):
         """Log a client connection"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO connection_logs (client_id, ip_address, connection_time, status) VALUES (?, ?, ?, ?)",
-            (client_id, ip_address, datetime.datetime.now(), 'connected')
-        )
-        
-        conn.commit()
-        conn.close()
-    
+        return self._write(INSERT_CONNECTION, (client_id, ip_address, datetime.datetime.now(), 'connected'))
+
     def log_disconnection(self, client_id, ip_address):
         """Log a client disconnection"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
         # Update the connection log with disconnection time
-        cursor.execute(
-            "UPDATE connection_logs SET disconnection_time = ?, status = ? WHERE client_id = ? AND status = 'connected'",
-            (datetime.datetime.now(), 'disconnected', client_id)
-        )
-        
-        conn.commit()
-        conn.close()
-    
+        return self._write(UPDATE_DISCONNECTION, (datetime.datetime.now(), 'disconnected', client_id))
+
     def log_message(self, client_id, ip_address, message, direction):
         """Log a message (outgoing from client or incoming from server)"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO message_logs (client_id, ip_address, message, timestamp, direction) VALUES (?, ?, ?, ?, ?)",
-            (client_id, ip_address, message, datetime.datetime.now(), direction)
-        )
-        
-        conn.commit()
-        conn.close()
-    
-    def get_connection_logs(self, filters=None):
-        """Get connection logs with optional filters"""
-        conn = self._get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        query = "SELECT * FROM connection_logs"
+        return self._write(INSERT_MESSAGE, (client_id, ip_address, message, datetime.datetime.now(), direction))
+
+    def log_messages(self, client_id, ip_address, messages, direction):
+        """Log several messages from one client in a single transaction"""
+        if not messages:
+            return True
+        now = datetime.datetime.now()
+        return self._write_rows(INSERT_MESSAGE, [(client_id, ip_address, message, now, direction) for message in messages])
+
+    def _fetch_page(self, conn, table, conditions, params, limit=None, before_id=None,
+                    after_id=None, ip_filter=None, match=None):
+        """Read one keyset page as (columns, rows), in the order its ids were walked
+
+        Every plan walks ids in order so LIMIT ends the scan after one page.
+        A full-text `match` is driven from the FTS index, which hands out
+        matching rowids in order. An exact `ip_filter` is an equality on the
+        ip index, whose entries for one address are in id order; a prefix or
+        CIDR range is not, so each distinct address in it is walked on its
+        own and the pages are merged. Ranges spanning more addresses than
+        MAX_ADDRESS_WALKS keep the ip index out of the plan and walk the
+        primary key instead.
+        """
+        conditions = list(conditions)
+        params = list(params)
+        key = 'id'
+        source = table
+        if match is not None:
+            key = f"{table}_fts.rowid"
+            source = f"{table}_fts JOIN {table} ON {table}.id = {key}"
+            conditions.append(f"{table}_fts MATCH ?")
+            params.append(match)
+
+        walks = [[]]
+        if ip_filter is not None:
+            condition, values = ip_conditions(ip_filter)
+            if match is None and limit is not None and not _is_address(ip_filter):
+                addresses = [row[0] for row in conn.execute(
+                    f"SELECT DISTINCT ip_address FROM {table} WHERE {condition} LIMIT ?",
+                    values + [MAX_ADDRESS_WALKS + 1]
+                )]
+                if len(addresses) > MAX_ADDRESS_WALKS:
+                    # A unary + stops the planner from using the ip index for the range
+                    condition, values = ip_conditions(ip_filter, '+ip_address')
+                else:
+                    condition, values = "ip_address = ?", []
+                    walks = [[address] for address in addresses]
+            conditions.append(condition)
+            params += values
+
+        tail = []
+        if before_id is not None:
+            conditions.append(f"{key} < ?")
+            tail.append(before_id)
+        if after_id is not None:
+            conditions.append(f"{key} > ?")
+            tail.append(after_id)
+
+        query = f"SELECT {table}.* FROM {source}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {key} ASC" if after_id is not None else f" ORDER BY {key} DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            tail.append(limit)
+
+        columns = None
+        rows = []
+        for walk in walks:
+            cursor = conn.execute(query, params + walk + tail)
+            columns = [column[0] for column in cursor.description]
+            rows += cursor.fetchall()
+        if len(walks) > 1:
+            rows.sort(key=lambda row: row['id'], reverse=after_id is None)
+            del rows[limit:]
+        return columns, rows
+
+    def _page(self, table, conditions, params, limit=None, before_id=None, after_id=None,
+              ip_filter=None, match=None):
+        """Run a keyset-paginated query over a log table, newest first"""
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement=f'select_{table}'):
+            _, rows = self._fetch_page(conn, table, conditions, params, limit, before_id,
+                                       after_id, ip_filter, match)
+        logs = [dict(row) for row in rows]
+        # id is the rowid and grows with insertion time. Pages after a cursor
+        # are read oldest-first and flipped so the output is always newest first.
+        if after_id is not None:
+            logs.reverse()
+        return logs
+
+    def _connection_conditions(self, filters):
+        """WHERE conditions for the connection log filters"""
+        conditions = []
         params = []
-        
+
         if filters:
-            conditions = []
             if 'client_id' in filters:
                 conditions.append("client_id = ?")
                 params.append(filters['client_id'])
             if 'ip_address' in filters:
-                conditions.append("ip_address LIKE ?")
-                params.append(f"%{filters['ip_address']}%")
-            if 'date' in filters:
-                conditions.append("date(connection_time) = ?")
-                params.append(filters['date'])
+                condition, values = ip_conditions(filters['ip_address'])
+                conditions.append(condition)
+                params += values
+            time_conditions, time_params = time_range_conditions('connection_time', filters)
+            conditions += time_conditions
+            params += time_params
             if 'status' in filters:
                 conditions.append("status = ?")
                 params.append(filters['status'])
-            
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-        
-        query += " ORDER BY connection_time DESC"
-        
-        cursor.execute(query, params)
-        logs = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        return logs
-    
-    def get_message_logs(self, filters=None):
-        """Get message logs with optional filters"""
-        conn = self._get_connection()
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        query = "SELECT * FROM message_logs"
+
+        return conditions, params
+
+    def get_connection_logs(self, filters=None, limit=None, before_id=None, after_id=None):
+        """Get connection logs with optional filters, newest first
+
+        Supported filters: client_id, status, ip_address (exact, prefix or
+        CIDR, see ip_conditions), date, and from/to timestamps.
+        """
+        filters, ip_filter, _ = _planned_filters(filters)
+        conditions, params = self._connection_conditions(filters)
+        return self._page('connection_logs', conditions, params, limit, before_id, after_id,
+                          ip_filter=ip_filter)
+
+    def _iterate(self, table, conditions, params, after_id=None, batch_size=1000,
+                 ip_filter=None, match=None):
+        """Yield (columns, rows) chunks oldest first, one keyset page of batch_size rows each
+
+        Only one chunk is held in memory at a time, and a pooled connection
+        is checked out only while a page is read, so a slow or stalled
+        download never pins a connection or its WAL snapshot between chunks.
+        """
+        last_id = after_id if after_id is not None else 0
+        while True:
+            with self.db.connection() as conn:
+                columns, rows = self._fetch_page(conn, table, conditions, params, batch_size,
+                                                 after_id=last_id, ip_filter=ip_filter, match=match)
+            if not rows:
+                return
+            yield columns, rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    def iter_connection_logs(self, filters=None, after_id=None, batch_size=1000):
+        """Stream connection logs oldest first in chunks, for exports"""
+        filters, ip_filter, _ = _planned_filters(filters)
+        conditions, params = self._connection_conditions(filters)
+        return self._iterate('connection_logs', conditions, params, after_id, batch_size,
+                             ip_filter=ip_filter)
+
+    def iter_message_logs(self, filters=None, after_id=None, batch_size=1000):
+        """Stream message logs oldest first in chunks, for exports"""
+        filters, ip_filter, match = _planned_filters(filters)
+        conditions, params = self._message_conditions(filters)
+        return self._iterate('message_logs', conditions, params, after_id, batch_size,
+                             ip_filter=ip_filter, match=match)
+
+    def _message_conditions(self, filters, column_prefix=''):
+        """WHERE conditions for the message log filters"""
+        conditions = []
         params = []
-        
+        p = column_prefix
+
         if filters:
-            conditions = []
             if 'client_id' in filters:
-                conditions.append("client_id = ?")
+                conditions.append(f"{p}client_id = ?")
                 params.append(filters['client_id'])
             if 'ip_address' in filters:
-                conditions.append("ip_address LIKE ?")
-                params.append(f"%{filters['ip_address']}%")
-            if 'date' in filters:
-                conditions.append("date(timestamp) = ?")
-                params.append(filters['date'])
+                condition, values = ip_conditions(filters['ip_address'], f"{p}ip_address")
+                conditions.append(condition)
+                params += values
+            time_conditions, time_params = time_range_conditions(f"{p}timestamp", filters)
+            conditions += time_conditions
+            params += time_params
             if 'message' in filters:
-                conditions.append("message LIKE ?")
-                params.append(f"%{filters['message']}%")
+                conditions.append(f"{p}id IN (SELECT rowid FROM message_logs_fts WHERE message_logs_fts MATCH ?)")
+                params.append(fts_query(filters['message']))
             if 'direction' in filters:
-                conditions.append("direction = ?")
+                conditions.append(f"{p}direction = ?")
                 params.append(filters['direction'])
-            
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
-        
-        query += " ORDER BY timestamp DESC"
-        
-        cursor.execute(query, params)
-        logs = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        return logs
+
+        return conditions, params
+
+    def get_message_logs(self, filters=None, limit=None, before_id=None, after_id=None):
+        """Get message logs with optional filters, newest first
+
+        Supported filters: client_id, direction, message (full-text terms),
+        ip_address (exact, prefix or CIDR, see ip_conditions), date, and
+        from/to timestamps.
+        """
+        filters, ip_filter, match = _planned_filters(filters)
+        conditions, params = self._message_conditions(filters)
+        return self._page('message_logs', conditions, params, limit, before_id, after_id,
+                          ip_filter=ip_filter, match=match)
+
+    def search_messages(self, text, filters=None, limit=20, offset=0,
+                        highlight=('<mark>', '</mark>')):
+        """Full-text search over message logs, best match first
+
+        Each result is a message log row plus a highlighted ``snippet`` and
+        its bm25 ``rank`` (lower is better).
+        """
+        conditions, params = self._message_conditions(filters, column_prefix='m.')
+        conditions.insert(0, "message_logs_fts MATCH ?")
+        params.insert(0, fts_query(text))
+
+        query = f"""
+            SELECT m.*,
+                   snippet(message_logs_fts, 0, ?, ?, '…', 12) AS snippet,
+                   bm25(message_logs_fts) AS rank
+            FROM message_logs_fts
+            JOIN message_logs m ON m.id = message_logs_fts.rowid
+            WHERE {" AND ".join(conditions)}
+            ORDER BY rank, m.id DESC
+            LIMIT ? OFFSET ?
+        """
+        params = list(highlight) + params + [limit, offset]
+
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='search_messages'):
+            results = [dict(row) for row in conn.execute(query, params)]
+        return results
+
+    def rebuild_search_index(self):
+        """Repopulate the full-text index from message_logs"""
+        with self.db.connection() as conn:
+            conn.execute("INSERT INTO message_logs_fts(message_logs_fts) VALUES ('rebuild')")
+            conn.commit()
+            count = conn.execute("SELECT count(*) FROM message_logs").fetchone()[0]
+        return count
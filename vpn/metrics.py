@@ -0,0 +1,185 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, 0.5ms to 10s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; observe() is a bisect and three additions"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', '_lock')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One extra slot for observations above the last bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return None
+        target = q * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= target and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (target - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Latency histograms and callback gauges, rendered as Prometheus text"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._help = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        """Set the HELP text for a histogram family"""
+        self._help[name] = help_text
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """Time a with block into the named histogram"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator timing each call of the function
+
+        Extra positional arguments the function doesn't accept are dropped,
+        so it can wrap Socket.IO handlers that ignore their payload. Coroutine
+        functions get a coroutine wrapper that times until they complete.
+        """
+        def decorator(f):
+            try:
+                params = inspect.signature(f).parameters.values()
+                varargs = any(p.kind == p.VAR_POSITIONAL for p in params)
+                accepted = None if varargs else sum(
+                    p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) for p in params)
+            except (TypeError, ValueError):
+                accepted = None
+
+            if inspect.iscoroutinefunction(f):
+                @functools.wraps(f)
+                async def async_wrapper(*args, **kwargs):
+                    if accepted is not None:
+                        args = args[:accepted]
+                    with self.time(name, **labels):
+                        return await f(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                if accepted is not None:
+                    args = args[:accepted]
+                with self.time(name, **labels):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def gauge(self, name, help_text, fn):
+        """Register a gauge whose value is read from fn() at scrape time"""
+        with self._lock:
+            self._gauges.append((name, help_text, fn))
+
+    def summary(self, name=None):
+        """count/mean/p50/p95/p99 in milliseconds per histogram, for JSON APIs"""
+        result = {}
+        for (metric, labels), histogram in sorted(self._histograms.items()):
+            if name is not None and metric != name:
+                continue
+            if not histogram.count:
+                continue
+            key = ','.join(f'{k}={v}' for k, v in labels) or metric
+            if name is None:
+                key = f'{metric}{{{key}}}' if labels else metric
+            result[key] = {
+                'count': histogram.count,
+                'mean_ms': histogram.sum / histogram.count * 1000,
+                'p50_ms': histogram.quantile(0.50) * 1000,
+                'p95_ms': histogram.quantile(0.95) * 1000,
+                'p99_ms': histogram.quantile(0.99) * 1000
+            }
+        return result
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        by_name = {}
+        for (metric, labels), histogram in sorted(self._histograms.items()):
+            by_name.setdefault(metric, []).append((labels, histogram))
+        for metric, series in by_name.items():
+            if self._help.get(metric):
+                lines.append(f'# HELP {metric} {self._help[metric]}')
+            lines.append(f'# TYPE {metric} histogram')
+            for labels, histogram in series:
+                with histogram._lock:
+                    counts = list(histogram.counts)
+                    total = histogram.count
+                    total_sum = histogram.sum
+                cumulative = 0
+                for bound, bucket_count in zip(list(histogram.buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric}_bucket{_labels(labels, le=bound)} {cumulative}')
+                lines.append(f'{metric}_sum{_labels(labels)} {total_sum}')
+                lines.append(f'{metric}_count{_labels(labels)} {total}')
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+# Process-wide registry shared by app.py, Logger and the presence registry
+REGISTRY = MetricsRegistry()
+SQL_SECONDS = 'vpn_sqlite_statement_seconds'
+REGISTRY.describe(SQL_SECONDS, 'Time spent in SQLite statements issued by the app')
@@ -0,0 +1,190 @@
+import datetime
+import heapq
+import threading
+import time
+
+from vpn.metrics import REGISTRY, SQL_SECONDS
+from vpn.workers import start_daemon_task
+
+UPSERT_NODE = '''
+    INSERT INTO nodes (session_id, username, ip, user_agent, is_server, is_client, last_seen)
+    VALUES (?, ?, ?, ?, 1, 1, ?)
+    ON CONFLICT(session_id) DO UPDATE SET
+        username = excluded.username,
+        ip = excluded.ip,
+        user_agent = excluded.user_agent,
+        last_seen = excluded.last_seen
+'''
+
+
+class PresenceRegistry:
+    """In-memory registry of active nodes, checkpointed to the nodes table
+
+    Heartbeats only touch a dict and push onto an expiry heap, so listing
+    or sweeping costs O(active nodes) rather than a scan of every row ever
+    written. Dirty entries are upserted in batches by a background reaper,
+    which also expires stale nodes and prunes old rows from the table.
+
+    With shared set (several workers, see vpn.cluster) each worker only sees
+    its own heartbeats in memory, so active() reads the table every worker
+    checkpoints to instead; other workers' nodes show up one checkpoint late.
+    """
+
+    def __init__(self, db, ttl=60, checkpoint_interval=5.0, retention=86400, shared=False):
+        self.db = db
+        self.shared = shared
+        self.ttl = ttl
+        self.checkpoint_interval = checkpoint_interval
+        # Rows not seen for this many seconds are deleted from the table
+        self.retention = retention
+
+        self._nodes = {}
+        # (expiry epoch, session_id); stale entries are skipped when popped
+        self._expiry = []
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._started = False
+        # Bumped whenever the active set or a heartbeat changes
+        self.generation = 0
+        self.errors = 0
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.utcnow()
+
+    def load(self):
+        """Seed the registry with nodes the table saw within the TTL"""
+        cutoff = self._now() - datetime.timedelta(seconds=self.ttl)
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='nodes_load'):
+            rows = conn.execute(
+                'SELECT session_id, username, ip, user_agent, last_seen FROM nodes WHERE last_seen >= ?',
+                (cutoff,)
+            ).fetchall()
+        with self._lock:
+            for row in rows:
+                last_seen = datetime.datetime.fromisoformat(row['last_seen'])
+                self._put(row['session_id'], row['username'], row['ip'], row['user_agent'], last_seen)
+
+    def _put(self, session_id, username, ip, user_agent, last_seen):
+        self._nodes[session_id] = {
+            'username': username,
+            'ip': ip,
+            'user_agent': user_agent,
+            'last_seen': last_seen
+        }
+        expires = last_seen.replace(tzinfo=datetime.timezone.utc).timestamp() + self.ttl
+        heapq.heappush(self._expiry, (expires, session_id))
+
+    def touch(self, session_id, username, ip, user_agent):
+        """Register a node or refresh its heartbeat"""
+        with self._lock:
+            self._put(session_id, username, ip, user_agent, self._now())
+            self._dirty.add(session_id)
+            self.generation += 1
+
+    def sweep(self):
+        """Drop nodes whose heartbeat is older than the TTL"""
+        now = time.time()
+        expired = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expires, session_id = heapq.heappop(self._expiry)
+                node = self._nodes.get(session_id)
+                if node is None:
+                    continue
+                current = node['last_seen'].replace(tzinfo=datetime.timezone.utc).timestamp() + self.ttl
+                # A newer heartbeat pushed a later entry for this node
+                if current > expires:
+                    continue
+                del self._nodes[session_id]
+                expired += 1
+            if expired:
+                self.generation += 1
+        return expired
+
+    def active(self):
+        """Active nodes, most recently seen first"""
+        if self.shared:
+            return self._active_from_table()
+        self.sweep()
+        with self._lock:
+            nodes = list(self._nodes.values())
+        nodes.sort(key=lambda node: node['last_seen'], reverse=True)
+        return [dict(node, last_seen=node['last_seen'].isoformat(' ')) for node in nodes]
+
+    def _active_from_table(self):
+        """Active nodes of every worker, from the checkpointed nodes table"""
+        try:
+            # Make this worker's latest heartbeats visible to the query below
+            self.checkpoint()
+        except Exception:
+            self.errors += 1
+        cutoff = self._now() - datetime.timedelta(seconds=self.ttl)
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='nodes_active'):
+            rows = conn.execute(
+                'SELECT username, ip, user_agent, last_seen FROM nodes WHERE last_seen >= ? ORDER BY last_seen DESC',
+                (cutoff,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def checkpoint(self):
+        """Upsert heartbeats seen since the last checkpoint in one transaction"""
+        with self._lock:
+            rows = []
+            for session_id in self._dirty:
+                node = self._nodes.get(session_id)
+                if node is not None:
+                    rows.append((session_id, node['username'], node['ip'], node['user_agent'], node['last_seen']))
+            self._dirty.clear()
+        if rows:
+            try:
+                with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='nodes_checkpoint'):
+                    conn.executemany(UPSERT_NODE, rows)
+                    conn.commit()
+            except Exception:
+                # Keep the heartbeats for the next checkpoint
+                with self._lock:
+                    self._dirty.update(row[0] for row in rows)
+                raise
+        return len(rows)
+
+    def prune(self):
+        """Delete rows for nodes not seen within the retention window"""
+        cutoff = self._now() - datetime.timedelta(seconds=self.retention)
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='nodes_prune'):
+            deleted = conn.execute('DELETE FROM nodes WHERE last_seen < ?', (cutoff,)).rowcount
+            conn.commit()
+        return deleted
+
+    def start(self, socketio):
+        """Start the background checkpoint/reaper loop"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_daemon_task(socketio, self._run, socketio)
+
+    def _run(self, socketio):
+        prune_every = max(1, int(3600 / self.checkpoint_interval))
+        ticks = 0
+        while True:
+            socketio.sleep(self.checkpoint_interval)
+            ticks += 1
+            try:
+                self.checkpoint()
+                self.sweep()
+                if ticks % prune_every == 0:
+                    self.prune()
+            except Exception:
+                # Try again on the next tick; unwritten heartbeats stay dirty
+                self.errors += 1
+
+    def stats(self):
+        """Get registry sizes"""
+        with self._lock:
+            return {
+                'active': len(self._nodes),
+                'dirty': len(self._dirty),
+                'expiry_heap': len(self._expiry),
+                'errors': self.errors
+            }
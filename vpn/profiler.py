@@ -0,0 +1,89 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Low-overhead statistical profiler that can be switched on at runtime
+
+    A daemon thread wakes every `interval` seconds and records the stack of
+    every other thread. Stacks are kept in collapsed "a;b;c" form, which
+    flamegraph tools read directly.
+    """
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, reset=True):
+        """Start sampling; returns False if already running"""
+        with self._lock:
+            if self.running:
+                return False
+            if reset:
+                self.stacks = Counter()
+                self.samples = 0
+            self._stop.clear()
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling; returns False if it wasn't running"""
+        with self._lock:
+            if not self.running:
+                return False
+            self._stop.set()
+            thread = self._thread
+        thread.join()
+        self.stopped_at = time.time()
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename}:{code.co_name}:{frame.f_lineno}')
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+
+    def report(self, limit=25):
+        """Hottest stacks and the functions most often on top of the stack"""
+        stacks = self.stacks.copy()
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'samples': self.samples,
+            'started_at': self.started_at,
+            'stopped_at': self.stopped_at,
+            'top_functions': leaves.most_common(limit),
+            'top_stacks': stacks.most_common(limit)
+        }
+
+    def collapsed(self):
+        """All stacks in collapsed format, one "stack count" per line"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.copy().items())
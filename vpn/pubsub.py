@@ -0,0 +1,134 @@
+import pickle
+import sqlite3
+import threading
+import time
+
+import socketio
+
+from vpn.wire import CodecManager
+from vpn.workers import start_daemon_task
+
+DEFAULT_QUEUE_PATH = 'database/socketio_queue.db'
+
+QUEUE_TABLE = '''
+CREATE TABLE IF NOT EXISTS socketio_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT,
+    payload BLOB,
+    created REAL
+)
+'''
+
+
+class SQLiteManager(socketio.PubSubManager, CodecManager):
+    """Socket.IO client manager that relays emits between processes through SQLite
+
+    A stand-in for the Redis/Kombu managers when every worker runs on one
+    host: publishing appends a row to a WAL-mode queue table and each
+    worker's listener polls for rows newer than the last one it saw.
+    Rows older than `retention` seconds are pruned by the publishers.
+    Relayed emits reach each local client in its negotiated wire codec.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, channel='flask-socketio', write_only=False,
+                 poll_interval=0.02, retention=60, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+        self._publish_lock = threading.Lock()
+        self._last_prune = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(QUEUE_TABLE)
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def initialize(self):
+        # PubSubManager.initialize() runs the listener with start_background_task,
+        # which is a non-daemon thread in threading mode and would block shutdown
+        socketio.BaseManager.initialize(self)
+        self._connection()
+        if not self.write_only:
+            self.thread = start_daemon_task(self.server, self._thread)
+        self._get_logger().info(self.name + ' backend initialized.')
+
+    def _publish(self, data):
+        now = time.time()
+        conn = self._connection()
+        with self._publish_lock:
+            conn.execute(
+                'INSERT INTO socketio_queue (channel, payload, created) VALUES (?, ?, ?)',
+                (self.channel, pickle.dumps(data), now)
+            )
+            if now - self._last_prune > self.retention:
+                self._last_prune = now
+                conn.execute('DELETE FROM socketio_queue WHERE created < ?', (now - self.retention,))
+            conn.commit()
+
+    def _reset_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _listen(self):
+        last_id = None
+        retry_sleep = 1
+        while True:
+            try:
+                conn = self._connection()
+                if last_id is None:
+                    # Only messages published after this worker started are delivered
+                    last_id = conn.execute('SELECT coalesce(max(id), 0) FROM socketio_queue').fetchone()[0]
+                rows = conn.execute(
+                    'SELECT id, payload FROM socketio_queue WHERE id > ? AND channel = ? ORDER BY id',
+                    (last_id, self.channel)
+                ).fetchall()
+                # End the read transaction so the next poll sees new commits
+                conn.commit()
+            except sqlite3.OperationalError:
+                # e.g. "database is locked" while another worker writes or prunes;
+                # last_id is kept, so nothing published meanwhile is missed
+                self._get_logger().error(
+                    'Cannot receive from the SQLite queue... retrying in {} secs'.format(retry_sleep))
+                self._reset_connection()
+                self.server.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 10)
+                continue
+            retry_sleep = 1
+            if not rows:
+                self.server.sleep(self.poll_interval)
+                continue
+            for row_id, payload in rows:
+                last_id = row_id
+                yield pickle.loads(payload)
+
+
+def socketio_queue_options(url):
+    """SocketIO() keyword arguments for the VPN_MESSAGE_QUEUE setting
+
+    Empty means a single process with a CodecManager. 'sqlite' or
+    'sqlite:///path' uses SQLiteManager; any other URL (redis://, amqp://,
+    ...) is passed to Flask-SocketIO as its message_queue, and its clients
+    stay on JSON.
+    """
+    if not url:
+        return {'client_manager': CodecManager()}
+    if url == 'sqlite':
+        return {'client_manager': SQLiteManager()}
+    if url.startswith('sqlite:///'):
+        return {'client_manager': SQLiteManager(url[len('sqlite:///'):])}
+    return {'message_queue': url}
@@ -0,0 +1,282 @@
+import datetime
+import logging
+import os
+import threading
+
+from vpn.db import AUTO_VACUUM_INCREMENTAL
+from vpn.metrics import REGISTRY, SQL_SECONDS
+from vpn.workers import start_daemon_task
+
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+
+ARCHIVE_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS archive.connection_logs (
+        id INTEGER PRIMARY KEY,
+        client_id TEXT,
+        ip_address TEXT,
+        connection_time TIMESTAMP,
+        disconnection_time TIMESTAMP NULL,
+        status TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS archive.message_logs (
+        id INTEGER PRIMARY KEY,
+        client_id TEXT,
+        ip_address TEXT,
+        message TEXT,
+        timestamp TIMESTAMP,
+        direction TEXT
+    )''',
+]
+
+# Recompute message counts for every hour from the watermark on
+MESSAGE_ROLLUP = f'''
+    INSERT INTO message_rollup_hourly (hour, client_id, ip_address, direction, messages)
+    SELECT strftime('{HOUR_FORMAT}', timestamp), client_id, ip_address, direction, count(*)
+    FROM message_logs
+    WHERE timestamp >= ?
+    GROUP BY 1, 2, 3, 4
+'''
+# Connections count towards the hour they opened in...
+CONNECTION_OPEN_ROLLUP = f'''
+    INSERT INTO connection_rollup_hourly (hour, ip_address, connections)
+    SELECT strftime('{HOUR_FORMAT}', connection_time), ip_address, count(*)
+    FROM connection_logs
+    WHERE connection_time >= ?
+    GROUP BY 1, 2
+'''
+# ...and their duration towards the hour they closed in
+CONNECTION_CLOSE_ROLLUP = f'''
+    INSERT INTO connection_rollup_hourly (hour, ip_address, disconnections, total_duration_seconds)
+    SELECT strftime('{HOUR_FORMAT}', disconnection_time), ip_address, count(*),
+           sum((julianday(disconnection_time) - julianday(connection_time)) * 86400)
+    FROM connection_logs
+    WHERE disconnection_time >= ?
+    GROUP BY 1, 2
+    ON CONFLICT(hour, ip_address) DO UPDATE SET
+        disconnections = excluded.disconnections,
+        total_duration_seconds = excluded.total_duration_seconds
+'''
+
+
+log = logging.getLogger(__name__)
+
+
+def _hour_start(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+class RetentionManager:
+    """Hourly rollups, archival of old rows and incremental vacuum
+
+    Each run refreshes the hourly rollup tables from the last watermark
+    (only recent hours are recomputed), then moves rows older than
+    `max_age_days` into one SQLite file per day under `archive_dir`, and
+    finally returns freed pages to the filesystem with incremental vacuum.
+
+    A day is copied to its archive and committed before the same rows are
+    deleted from the main database, since a commit spanning attached WAL
+    databases is not atomic. A run interrupted in between leaves rows in
+    both; the next run skips the copies (INSERT OR IGNORE) and deletes them.
+    """
+
+    def __init__(self, db, archive_dir='database/archive', max_age_days=30,
+                 interval=300, vacuum_pages=2000):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+
+        self.runs = 0
+        self.archived_messages = 0
+        self.archived_connections = 0
+        self.last_run = None
+        self._lock = threading.Lock()
+        self._started = False
+        self._vacuum_warned = False
+
+    # Rollups
+
+    def _watermark(self, conn):
+        row = conn.execute("SELECT value FROM rollup_state WHERE name = 'hourly'").fetchone()
+        if row is not None:
+            return row['value']
+        # First run: backfill from the oldest row
+        oldest = [
+            conn.execute('SELECT min(connection_time) FROM connection_logs').fetchone()[0],
+            conn.execute('SELECT min(timestamp) FROM message_logs').fetchone()[0],
+        ]
+        oldest = [value for value in oldest if value]
+        if not oldest:
+            return None
+        return _hour_start(datetime.datetime.fromisoformat(min(oldest))).strftime(HOUR_FORMAT)
+
+    def update_rollups(self, now=None):
+        """Recompute hourly rollups from the watermark hour up to now"""
+        now = now or datetime.datetime.now()
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='rollup_hourly'):
+            start = self._watermark(conn)
+            if start is None:
+                return None
+            conn.execute('DELETE FROM message_rollup_hourly WHERE hour >= ?', (start,))
+            conn.execute('DELETE FROM connection_rollup_hourly WHERE hour >= ?', (start,))
+            conn.execute(MESSAGE_ROLLUP, (start,))
+            conn.execute(CONNECTION_OPEN_ROLLUP, (start,))
+            conn.execute(CONNECTION_CLOSE_ROLLUP, (start,))
+            # The current hour is still filling up, so the next run starts there
+            conn.execute(
+                "INSERT INTO rollup_state (name, value) VALUES ('hourly', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (_hour_start(now).strftime(HOUR_FORMAT),)
+            )
+            conn.commit()
+        return start
+
+    # Archival
+
+    def _archive_path(self, day):
+        return os.path.join(self.archive_dir, f'vpn_logs-{day}.db')
+
+    def _oldest_day(self, conn, cutoff):
+        candidates = [
+            conn.execute('SELECT min(timestamp) FROM message_logs').fetchone()[0],
+            conn.execute("SELECT min(connection_time) FROM connection_logs WHERE status != 'connected'").fetchone()[0],
+        ]
+        candidates = [value for value in candidates if value and value < cutoff]
+        return min(candidates)[:10] if candidates else None
+
+    def archive(self, now=None):
+        """Move rows older than max_age_days into per-day archive databases"""
+        now = now or datetime.datetime.now()
+        cutoff_day = (now - datetime.timedelta(days=self.max_age_days)).date()
+        cutoff = cutoff_day.isoformat()
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archived_days = []
+        with self.db.connection() as conn:
+            while True:
+                day = self._oldest_day(conn, cutoff)
+                if day is None:
+                    break
+                start = day
+                end = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+                conn.commit()
+                conn.execute('ATTACH DATABASE ? AS archive', (self._archive_path(day),))
+                try:
+                    with REGISTRY.time(SQL_SECONDS, statement='archive_day'):
+                        for statement in ARCHIVE_TABLES:
+                            conn.execute(statement)
+                        conn.execute(
+                            'INSERT OR IGNORE INTO archive.message_logs SELECT * FROM main.message_logs '
+                            'WHERE timestamp >= ? AND timestamp < ?', (start, end))
+                        # Open sessions stay until they are closed
+                        conn.execute(
+                            'INSERT OR IGNORE INTO archive.connection_logs SELECT * FROM main.connection_logs '
+                            "WHERE connection_time >= ? AND connection_time < ? AND status != 'connected'",
+                            (start, end))
+                        conn.commit()
+                        # Only delete what the committed archive holds
+                        messages = conn.execute(
+                            'DELETE FROM main.message_logs WHERE timestamp >= ? AND timestamp < ? '
+                            'AND id IN (SELECT id FROM archive.message_logs)', (start, end)).rowcount
+                        connections = conn.execute(
+                            'DELETE FROM main.connection_logs WHERE connection_time >= ? AND connection_time < ? '
+                            'AND id IN (SELECT id FROM archive.connection_logs)', (start, end)).rowcount
+                        conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.execute('DETACH DATABASE archive')
+                with self._lock:
+                    self.archived_messages += messages
+                    self.archived_connections += connections
+                if not messages and not connections:
+                    # Nothing left to move for this day; don't pick it again
+                    break
+                archived_days.append(day)
+        return archived_days
+
+    def vacuum(self):
+        """Release up to vacuum_pages free pages back to the filesystem"""
+        with self.db.connection() as conn:
+            freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                if freelist and not self._vacuum_warned:
+                    self._vacuum_warned = True
+                    log.warning('%d free pages are kept because the database is not in incremental '
+                                'auto-vacuum mode; run "flask enable-incremental-vacuum" to switch', freelist)
+            elif freelist:
+                conn.execute(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})').fetchall()
+        return freelist
+
+    def run_once(self, now=None):
+        """Rollups first, so archived rows are already counted, then archive and vacuum"""
+        self.update_rollups(now)
+        days = self.archive(now)
+        self.vacuum()
+        with self._lock:
+            self.runs += 1
+            self.last_run = datetime.datetime.now().isoformat(' ')
+        return days
+
+    def start(self, socketio):
+        """Run the retention job every `interval` seconds in the background"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_daemon_task(socketio, self._run, socketio)
+
+    def _run(self, socketio):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception:
+                # Try again on the next tick; a failed run leaves rows in place
+                pass
+
+    # Dashboard aggregates
+
+    def summary(self, hours=24, top=10, now=None):
+        """Hourly totals and top IPs for the last `hours`, read from the rollups only"""
+        now = now or datetime.datetime.now()
+        since = _hour_start(now - datetime.timedelta(hours=hours - 1)).strftime(HOUR_FORMAT)
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='rollup_summary'):
+            messages = conn.execute(
+                "SELECT hour, sum(CASE WHEN direction = 'outgoing' THEN messages ELSE 0 END) AS outgoing, "
+                "sum(CASE WHEN direction = 'incoming' THEN messages ELSE 0 END) AS incoming "
+                "FROM message_rollup_hourly WHERE hour >= ? GROUP BY hour ORDER BY hour", (since,)).fetchall()
+            connections = conn.execute(
+                'SELECT hour, sum(connections) AS connections, sum(disconnections) AS disconnections, '
+                'sum(total_duration_seconds) AS total_duration_seconds '
+                'FROM connection_rollup_hourly WHERE hour >= ? GROUP BY hour ORDER BY hour', (since,)).fetchall()
+            top_ips = conn.execute(
+                'SELECT ip_address, sum(messages) AS messages FROM message_rollup_hourly WHERE hour >= ? '
+                'GROUP BY ip_address ORDER BY messages DESC LIMIT ?', (since, top)).fetchall()
+
+        hourly = {}
+        for row in messages:
+            hourly.setdefault(row['hour'], {'hour': row['hour']}).update(
+                outgoing=row['outgoing'], incoming=row['incoming'])
+        for row in connections:
+            closed = row['disconnections'] or 0
+            hourly.setdefault(row['hour'], {'hour': row['hour']}).update(
+                connections=row['connections'] or 0,
+                disconnections=closed,
+                avg_session_seconds=(row['total_duration_seconds'] or 0) / closed if closed else None)
+        return {
+            'since': since,
+            'hourly': [hourly[hour] for hour in sorted(hourly)],
+            'top_ips': [dict(row) for row in top_ips]
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_age_days': self.max_age_days,
+                'runs': self.runs,
+                'last_run': self.last_run,
+                'archived_messages': self.archived_messages,
+                'archived_connections': self.archived_connections
+            }
@@ -1,25 +1,87 @@
+import asyncio
 import datetime
 import random
 import time
+from collections import deque
+
+from vpn.commands import CommandRegistry
+from vpn.shared import LocalState
+
+DEFAULT_HISTORY_DEPTH = 50
+
+
+class ClientSession:
+    """A connected client and a bounded history of its recent messages"""
+
+    __slots__ = ('client_id', 'ip_address', 'connection_time', 'history', 'bucket')
+
+    def __init__(self, client_id, ip_address, history_depth=DEFAULT_HISTORY_DEPTH):
+        self.client_id = client_id
+        self.ip_address = ip_address
+        self.connection_time = time.time()
+        # Ring buffer of (epoch seconds, direction, content) tuples
+        self.history = deque(maxlen=history_depth)
+        # Message token bucket, set by AdmissionController.attach
+        self.bucket = None
+
+    def record(self, content, direction='outgoing'):
+        """Append a message to the history, evicting the oldest when full"""
+        self.history.append((time.time(), direction, content))
+
+    def recent(self, limit=None):
+        """Most recent messages, oldest first
+
+        limit comes from clients, so it is coerced to an int (ValueError if
+        it isn't one) and clamped to the history depth.
+        """
+        entries = list(self.history)
+        if limit is not None:
+            try:
+                limit = min(int(limit), self.history.maxlen)
+            except (TypeError, ValueError):
+                raise ValueError('limit must be an integer') from None
+            entries = entries[-limit:] if limit > 0 else []
+        return [
+            {'content': content, 'timestamp': timestamp, 'direction': direction}
+            for timestamp, direction, content in entries
+        ]
+
 
 class VPNServer:
-    def __init__(self, logger):
+    def __init__(self, logger, latency=(0.1, 0.5), history_depth=DEFAULT_HISTORY_DEPTH, shared=None,
+                 commands=None, prefix_matching=False, admission=None):
+        # Sessions of the sockets connected to this process
         self.clients = {}
+        # Registry of clients across every worker process
+        self.shared = shared or LocalState()
         self.logger = logger
+        # (min, max) seconds of simulated processing delay; (0, 0) disables it
+        self.latency = latency
+        # Messages kept per client; older ones are dropped
+        self.history_depth = history_depth
+        # Chat commands, dispatched on the first word of a message
+        self.commands = commands or COMMANDS
+        # Also accept unambiguous abbreviations such as "st" for "status"
+        self.prefix_matching = prefix_matching
+        # Optional AdmissionController rate limiting each client's messages
+        self.admission = admission
     
     def add_client(self, client_id, ip_address):
         """Add a new client to the VPN server"""
-        self.clients[client_id] = {
-            'ip_address': ip_address,
-            'connection_time': datetime.datetime.now(),
-            'messages': []
-        }
+        session = ClientSession(client_id, ip_address, self.history_depth)
+        if self.admission is not None:
+            self.admission.attach(session)
+        self.clients[client_id] = session
+        self.shared.add_client(client_id, ip_address)
         return True
     
     def remove_client(self, client_id):
         """Remove a client from the VPN server"""
-        if client_id in self.clients:
-            del self.clients[client_id]
+        session = self.clients.pop(client_id, None)
+        if session is not None:
+            if self.admission is not None:
+                self.admission.detach(session)
+            self.shared.remove_client(client_id)
             return True
         return False
     
@@ -27,30 +89,97 @@ class VPNServer:
         """Get client information"""
         return self.clients.get(client_id)
     
+    def get_history(self, client_id, limit=None):
+        """Get a client's recent messages, oldest first"""
+        client = self.clients.get(client_id)
+        if client is None:
+            return []
+        return client.recent(limit)
+    
     def get_active_clients_count(self):
-        """Get the number of active clients"""
-        return len(self.clients)
+        """Get the number of active clients on every worker"""
+        return self.shared.client_count()
     
+    def latency_delay(self):
+        """Seconds of simulated processing delay for one message or batch"""
+        low, high = self.latency
+        return random.uniform(low, high) if high > 0 else 0
+
+    def simulate_latency(self):
+        """Sleep for the configured simulated processing delay"""
+        delay = self.latency_delay()
+        if delay:
+            time.sleep(delay)
+
     def process_message(self, client_id, message):
         """Process a message from a client and return a response"""
-        # Simulate processing delay
-        time.sleep(random.uniform(0.1, 0.5))
-        
-        # Store message in client history
-        if client_id in self.clients:
-            self.clients[client_id]['messages'].append({
-                'content': message,
-                'timestamp': datetime.datetime.now()
-            })
-        
-        # Generate response based on message content
-        if "ping" in message.lower():
-            return f"PONG! Server received your ping at {datetime.datetime.now().strftime('%H:%M:%S')}"
-        elif "status" in message.lower():
-            return f"VPN Server Status: ONLINE | Active Clients: {self.get_active_clients_count()}"
-        elif "help" in message.lower():
-            return "Available commands: ping, status, help, disconnect"
-        elif "disconnect" in message.lower():
-            return "Preparing to disconnect. Please confirm by closing the connection."
-        else:
-            return f"Message received and encrypted. Length: {len(message)} characters."
+        command, args = self.commands.resolve(message, prefix=self.prefix_matching)
+
+        # Cheap commands answer at once; everything else is simulated work
+        if not command.fast:
+            # Simulate processing delay
+            self.simulate_latency()
+
+            # Store message in client history
+            client = self.clients.get(client_id)
+            if client is not None:
+                client.record(message)
+
+        return command.run(self, client_id, message, args)
+
+    def _resolve_batch(self, messages):
+        """(command, args) per message and the messages needing simulated work"""
+        resolved = [self.commands.resolve(message, prefix=self.prefix_matching) for message in messages]
+        slow = [message for message, (command, _) in zip(messages, resolved) if not command.fast]
+        return resolved, slow
+
+    def _finish_batch(self, client_id, messages, resolved, slow):
+        client = self.clients.get(client_id)
+        if client is not None:
+            for message in slow:
+                client.record(message)
+        return [command.run(self, client_id, message, args) for message, (command, args) in zip(messages, resolved)]
+
+    def process_messages(self, client_id, messages):
+        """Process a batch of messages in one pass and return the responses in order"""
+        resolved, slow = self._resolve_batch(messages)
+        if slow:
+            # One simulated processing delay covers the whole batch
+            self.simulate_latency()
+        return self._finish_batch(client_id, messages, resolved, slow)
+
+    async def process_messages_async(self, client_id, messages):
+        """process_messages for the asyncio server: the delay is awaited instead of slept"""
+        resolved, slow = self._resolve_batch(messages)
+        if slow:
+            await asyncio.sleep(self.latency_delay())
+        return self._finish_batch(client_id, messages, resolved, slow)
+
+
+# Built-in chat commands; register more with @COMMANDS.command('name')
+COMMANDS = CommandRegistry()
+
+
+@COMMANDS.command('ping', fast=True)
+def ping_command(server, client_id, message, args):
+    return f"PONG! Server received your ping at {datetime.datetime.now().strftime('%H:%M:%S')}"
+
+
+@COMMANDS.command('status', fast=True)
+def status_command(server, client_id, message, args):
+    return f"VPN Server Status: ONLINE | Active Clients: {server.get_active_clients_count()}"
+
+
+@COMMANDS.command('help', fast=True)
+def help_command(server, client_id, message, args):
+    return f"Available commands: {', '.join(server.commands.names())}"
+
+
+@COMMANDS.command('disconnect')
+def disconnect_command(server, client_id, message, args):
+    return "Preparing to disconnect. Please confirm by closing the connection."
+
+
+@COMMANDS.default
+def default_command(server, client_id, message, args):
+    return f"Message received and encrypted. Length: {len(message)} characters."
@@ -0,0 +1,215 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from vpn.db import PoolTimeout
+from vpn.metrics import REGISTRY, SQL_SECONDS
+from vpn.workers import start_daemon_task
+
+UPSERT_COUNTER = '''
+    INSERT INTO shared_counters (name, value) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+'''
+
+
+def default_worker_id():
+    """Identity of this process in the shared tables"""
+    return os.environ.get('VPN_WORKER_ID') or f'{socket.gethostname()}:{os.getpid()}'
+
+
+class LocalState:
+    """Connected-client registry and counters for a single process"""
+
+    name = 'local'
+
+    def __init__(self):
+        self._clients = {}
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def add_client(self, client_id, ip_address):
+        with self._lock:
+            self._clients[client_id] = ip_address
+
+    def remove_client(self, client_id):
+        with self._lock:
+            self._clients.pop(client_id, None)
+
+    def client_count(self):
+        return len(self._clients)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def counter(self, name):
+        return self._counters[name]
+
+    def start(self, socketio):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {'backend': self.name, 'clients': len(self._clients)}
+
+
+class SQLiteState:
+    """Connected-client registry and counters shared by every worker process
+
+    Clients are written through to shared_clients tagged with this worker's
+    id, so any worker can count them. Counter increments are buffered and
+    added to shared_counters every `flush_interval`. Workers heartbeat into
+    shared_workers; clients of a worker that stopped heartbeating for
+    `worker_ttl` seconds are removed, so a crashed worker's sockets don't
+    count forever.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db, worker_id=None, flush_interval=0.5, worker_ttl=15):
+        self.db = db
+        self.worker_id = worker_id or default_worker_id()
+        self.flush_interval = flush_interval
+        self.worker_ttl = worker_ttl
+
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._started = False
+        # Cached totals, refreshed at most once per flush interval
+        self._cached_at = 0.0
+        self._cached_clients = 0
+        self._cached_counters = {}
+        self.reaped = 0
+        self.errors = 0
+
+    def add_client(self, client_id, ip_address):
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='shared_add_client'):
+            conn.execute(
+                'INSERT OR REPLACE INTO shared_clients (client_id, worker_id, ip_address, connected_at) VALUES (?, ?, ?, ?)',
+                (client_id, self.worker_id, ip_address, time.time())
+            )
+            conn.commit()
+        self._cached_at = 0.0
+
+    def remove_client(self, client_id):
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='shared_remove_client'):
+            conn.execute('DELETE FROM shared_clients WHERE client_id = ?', (client_id,))
+            conn.commit()
+        self._cached_at = 0.0
+
+    def _refresh(self):
+        if time.monotonic() - self._cached_at < self.flush_interval:
+            return
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='shared_read'):
+            self._cached_clients = conn.execute('SELECT count(*) FROM shared_clients').fetchone()[0]
+            self._cached_counters = {
+                row['name']: row['value'] for row in conn.execute('SELECT name, value FROM shared_counters')
+            }
+        self._cached_at = time.monotonic()
+
+    def client_count(self):
+        self._refresh()
+        return self._cached_clients
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._pending[name] += amount
+
+    def counter(self, name):
+        """Shared total plus this worker's increments not flushed yet"""
+        self._refresh()
+        with self._lock:
+            return self._cached_counters.get(name, 0) + self._pending[name]
+
+    def flush(self):
+        """Add buffered increments to the shared counters and heartbeat"""
+        with self._lock:
+            deltas, self._pending = self._pending, Counter()
+        now = time.time()
+        try:
+            with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='shared_flush'):
+                conn.executemany(UPSERT_COUNTER, [(name, value) for name, value in deltas.items() if value])
+                conn.execute(
+                    'INSERT OR REPLACE INTO shared_workers (worker_id, last_seen) VALUES (?, ?)',
+                    (self.worker_id, now)
+                )
+                conn.commit()
+        except (sqlite3.Error, PoolTimeout):
+            with self._lock:
+                self._pending.update(deltas)
+            raise
+        self._cached_at = 0.0
+
+    def reap(self):
+        """Drop the clients of workers that stopped heartbeating"""
+        cutoff = time.time() - self.worker_ttl
+        with self.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='shared_reap'):
+            stale = [row[0] for row in conn.execute('SELECT worker_id FROM shared_workers WHERE last_seen < ?', (cutoff,))]
+            for worker_id in stale:
+                self.reaped += conn.execute('DELETE FROM shared_clients WHERE worker_id = ?', (worker_id,)).rowcount
+                conn.execute('DELETE FROM shared_workers WHERE worker_id = ?', (worker_id,))
+            conn.commit()
+        return len(stale)
+
+    def _forget_self(self):
+        with self.db.connection() as conn:
+            conn.execute('DELETE FROM shared_clients WHERE worker_id = ?', (self.worker_id,))
+            conn.execute('DELETE FROM shared_workers WHERE worker_id = ?', (self.worker_id,))
+            conn.commit()
+
+    def start(self, socketio):
+        """Clear what a previous run of this worker left and start heartbeating"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._forget_self()
+        self.flush()
+        self.reap()
+        start_daemon_task(socketio, self._run, socketio)
+
+    def _run(self, socketio):
+        reap_every = max(1, int(self.worker_ttl / self.flush_interval))
+        ticks = 0
+        while True:
+            socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+                ticks += 1
+                if ticks % reap_every == 0:
+                    self.reap()
+            except Exception:
+                # A missed heartbeat is retried next tick, well inside worker_ttl;
+                # ending the loop would get this worker's live clients reaped
+                self.errors += 1
+
+    def close(self):
+        """Flush counters and unregister this worker's clients"""
+        self.flush()
+        self._forget_self()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'backend': self.name,
+            'worker_id': self.worker_id,
+            'clients': self.client_count(),
+            'pending_counters': pending,
+            'reaped_clients': self.reaped,
+            'errors': self.errors
+        }
+
+
+def create_shared_state(backend, db, worker_id=None):
+    """Build the shared-state backend named by VPN_SHARED_STATE"""
+    if backend == 'local':
+        return LocalState()
+    if backend == 'sqlite':
+        return SQLiteState(db, worker_id=worker_id)
+    raise ValueError(f'Unknown shared state backend: {backend}')
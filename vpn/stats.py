@@ -0,0 +1,82 @@
+import threading
+
+from vpn.workers import start_daemon_task
+
+
+class StatsBroadcaster:
+    """Coalesce server_stats_update broadcasts to subscribed dashboards
+
+    Events only mark the stats dirty; a background loop sends at most one
+    update per interval to the subscribers' room, carrying just the fields
+    that changed since the previous broadcast.
+    """
+
+    def __init__(self, socketio, snapshot, interval=1.0, room='stats', event='server_stats_update'):
+        self.socketio = socketio
+        # snapshot() returns the current stats as a flat dict
+        self.snapshot = snapshot
+        self.interval = interval
+        self.room = room
+        self.event = event
+
+        self.broadcasts = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._dirty = False
+        self._last = {}
+        self._started = False
+        self._lock = threading.Lock()
+
+    def mark_dirty(self):
+        """Note that the stats changed; the next tick will broadcast them"""
+        if self._dirty:
+            self.coalesced += 1
+        self._dirty = True
+
+    def subscribe(self, sid):
+        """Add a client to the stats room and send it the full current stats"""
+        self.socketio.server.enter_room(sid, self.room, namespace='/')
+        self.socketio.emit(self.event, self.snapshot(), to=sid)
+        self._ensure_started()
+
+    def unsubscribe(self, sid):
+        """Remove a client from the stats room"""
+        self.socketio.server.leave_room(sid, self.room, namespace='/')
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_daemon_task(self.socketio, self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # e.g. a shared-state read timing out; keep the update for the next tick
+                self._dirty = True
+                self.errors += 1
+
+    def flush(self):
+        """Broadcast changed fields now if the stats are dirty"""
+        if not self._dirty:
+            return
+        self._dirty = False
+        current = self.snapshot()
+        changed = {key: value for key, value in current.items() if self._last.get(key) != value}
+        self._last = current
+        if changed:
+            self.socketio.emit(self.event, changed, to=self.room)
+            self.broadcasts += 1
+
+    def stats(self):
+        """Get broadcaster counters"""
+        return {
+            'interval': self.interval,
+            'broadcasts': self.broadcasts,
+            'coalesced': self.coalesced,
+            'errors': self.errors
+        }
@@ -0,0 +1,267 @@
+import datetime
+import threading
+
+from vpn.logger import ip_matcher
+from vpn.metrics import REGISTRY, SQL_SECONDS
+from vpn.workers import start_daemon_task
+
+TAIL_EVENT = 'log_tail'
+DIRECTIONS = ('incoming', 'outgoing')
+
+
+def _serialize(event):
+    """JSON-ready copy of a log event, with datetimes in the stored text form"""
+    return {
+        key: value.isoformat(' ') if isinstance(value, datetime.datetime) else value
+        for key, value in event.items()
+    }
+
+
+class TailFilter:
+    """Server-side filter of one live-tail room
+
+    ip_address takes the same exact/prefix/CIDR forms as the log APIs. A
+    direction limits the tail to messages in that direction; without one
+    connection events are included too.
+    """
+
+    __slots__ = ('ip_address', 'direction', 'room', '_match_ip')
+
+    def __init__(self, ip_address=None, direction=None):
+        if direction and direction not in DIRECTIONS:
+            raise ValueError(f'direction must be one of {", ".join(DIRECTIONS)}')
+        self.ip_address = ip_address or None
+        self.direction = direction or None
+        self._match_ip = ip_matcher(ip_address) if ip_address else None
+        self.room = f"log_tail:{self.ip_address or '*'}:{self.direction or '*'}"
+
+    def matches(self, event):
+        if self.direction and (event['type'] != 'message' or event['direction'] != self.direction):
+            return False
+        if self._match_ip is not None and not self._match_ip(event.get('ip_address')):
+            return False
+        return True
+
+    def log_filters(self):
+        """Filters for Logger.get_*_logs matching this tail"""
+        return {'ip_address': self.ip_address} if self.ip_address else {}
+
+
+class LogTail:
+    """Push newly logged connection and message events to dashboard rooms
+
+    Subscribers with the same filter share a Socket.IO room. New events
+    are buffered as they are written and flushed once per `interval`, so
+    a burst goes out as a few batched emits per room, and the cost scales
+    with new events and distinct filters rather than with viewers.
+
+    Events come from a Logger listener in a single process. With several
+    workers (source='poll') each worker reads rows newer than the last it
+    saw from the shared database instead and emits to its own viewers.
+    Inserts are followed by id, which grows in commit order. Disconnections
+    are updates with no such column, so each poll re-reads the last
+    `disconnection_overlap` seconds of closes and skips the row ids it has
+    already sent. That way a write-behind batch from another worker that
+    commits late is still picked up.
+
+    A subscriber that reconnects passes the last connection and message
+    ids it saw and first receives what it missed.
+    """
+
+    def __init__(self, socketio, logger, interval=0.25, max_batch=200,
+                 backlog_limit=500, recent=10, source='listener', disconnection_overlap=30.0):
+        self.socketio = socketio
+        self.logger = logger
+        self.interval = interval
+        self.max_batch = max_batch
+        # Most rows replayed to a resuming subscriber, per table
+        self.backlog_limit = backlog_limit
+        # Rows sent to a new subscriber that has nothing to resume from
+        self.recent = recent
+        self.source = source
+        self.disconnection_overlap = disconnection_overlap
+
+        self._buffer = []
+        # client_id -> ip_address, to attach the address to disconnections
+        self._client_ips = {}
+        # room -> [TailFilter, subscriber count]
+        self._rooms = {}
+        self._members = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._last_ids = None
+        self._last_disconnection = None
+        # connection_logs id -> disconnection_time of closes sent within the overlap
+        self._sent_disconnections = {}
+
+        self.flushes = 0
+        self.emitted = 0
+
+        if source == 'listener':
+            logger.add_listener(self.record)
+
+    def record(self, events):
+        """Logger listener: buffer committed events for the next flush"""
+        with self._lock:
+            for event in events:
+                kind = event['type']
+                if kind == 'connection':
+                    self._client_ips[event['client_id']] = event['ip_address']
+                elif kind == 'disconnection':
+                    event = dict(event, ip_address=self._client_ips.pop(event['client_id'], None))
+                if self._rooms:
+                    self._buffer.append(event)
+
+    def subscribe(self, sid, ip_address=None, direction=None, after=None):
+        """Join the room for a filter and send the backlog
+
+        after is {'connection': id, 'message': id} from a previous session;
+        without it the most recent rows are sent. Raises ValueError for a
+        bad filter.
+        """
+        tail_filter = TailFilter(ip_address, direction)
+        if self.source == 'poll' and self._last_ids is None:
+            # Mark the end before reading the backlog so nothing falls in between
+            self._reset_position()
+        self.unsubscribe(sid)
+        self.socketio.server.enter_room(sid, tail_filter.room, namespace='/')
+        with self._lock:
+            entry = self._rooms.setdefault(tail_filter.room, [tail_filter, 0])
+            entry[1] += 1
+            self._members[sid] = tail_filter.room
+        self._ensure_started()
+
+        events, truncated = self._backlog(tail_filter, after)
+        self.socketio.emit(TAIL_EVENT, {
+            'events': events,
+            'resumed': after is not None,
+            'truncated': truncated
+        }, to=sid, ignore_queue=True)
+        return tail_filter.room
+
+    def unsubscribe(self, sid):
+        """Leave the live tail; also called when a socket disconnects"""
+        with self._lock:
+            room = self._members.pop(sid, None)
+            if room is None:
+                return
+            entry = self._rooms.get(room)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._rooms[room]
+        self.socketio.server.leave_room(sid, room, namespace='/')
+
+    def _backlog(self, tail_filter, after):
+        """Rows a new or resuming subscriber should see, oldest first, and whether any were cut off"""
+        limit = self.recent if after is None else self.backlog_limit
+        filters = tail_filter.log_filters()
+        message_filters = dict(filters)
+        pages = [('message', self.logger.get_message_logs, message_filters)]
+        if tail_filter.direction:
+            message_filters['direction'] = tail_filter.direction
+        else:
+            pages.append(('connection', self.logger.get_connection_logs, filters))
+
+        events = []
+        truncated = False
+        for kind, get_logs, page_filters in pages:
+            after_id = int(after.get(kind) or 0) if after is not None else None
+            rows = get_logs(page_filters, limit=limit, after_id=after_id)
+            truncated |= after is not None and len(rows) == limit
+            events += [dict(row, type=kind) for row in rows]
+        # Rows of one batched write share a timestamp; id keeps them in insert order
+        events.sort(key=lambda event: (event.get('timestamp') or event.get('connection_time') or '', event['id']))
+        return events, truncated
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_daemon_task(self.socketio, self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                if self.source == 'poll':
+                    self._poll()
+                self.flush()
+            except Exception:
+                continue
+
+    def _reset_position(self):
+        """Start polling from the current end of the log tables"""
+        with self.logger.db.connection() as conn:
+            self._last_ids = {
+                'connection': conn.execute('SELECT coalesce(max(id), 0) FROM connection_logs').fetchone()[0],
+                'message': conn.execute('SELECT coalesce(max(id), 0) FROM message_logs').fetchone()[0]
+            }
+        self._last_disconnection = datetime.datetime.now().isoformat(' ')
+        self._sent_disconnections = {}
+
+    def _poll(self):
+        """Buffer rows any worker wrote since the last poll (source='poll')"""
+        if not self._rooms:
+            # Nobody is watching; start from the current end when someone subscribes
+            self._last_ids = None
+            return
+        if self._last_ids is None:
+            self._reset_position()
+            return
+        events = []
+        with self.logger.db.connection() as conn, REGISTRY.time(SQL_SECONDS, statement='tail_poll'):
+            for row in conn.execute('SELECT * FROM connection_logs WHERE id > ? ORDER BY id',
+                                    (self._last_ids['connection'],)):
+                self._last_ids['connection'] = row['id']
+                events.append(dict(row, type='connection', status='connected', disconnection_time=None))
+            for row in conn.execute('SELECT * FROM message_logs WHERE id > ? ORDER BY id',
+                                    (self._last_ids['message'],)):
+                self._last_ids['message'] = row['id']
+                events.append(dict(row, type='message'))
+            since = (datetime.datetime.fromisoformat(self._last_disconnection)
+                     - datetime.timedelta(seconds=self.disconnection_overlap)).isoformat(' ')
+            sent = self._sent_disconnections
+            for row_id in [row_id for row_id, closed in sent.items() if closed <= since]:
+                del sent[row_id]
+            for row in conn.execute(
+                    'SELECT id, client_id, ip_address, disconnection_time, status FROM connection_logs '
+                    'WHERE disconnection_time > ? ORDER BY disconnection_time',
+                    (since,)):
+                if row['id'] in sent:
+                    continue
+                sent[row['id']] = row['disconnection_time']
+                self._last_disconnection = max(self._last_disconnection, row['disconnection_time'])
+                events.append(dict(row, type='disconnection'))
+        with self._lock:
+            self._buffer += events
+
+    def flush(self):
+        """Emit buffered events to every room whose filter they match"""
+        with self._lock:
+            events, self._buffer = self._buffer, []
+            rooms = [entry[0] for entry in self._rooms.values()]
+        if not events or not rooms:
+            return
+        serialized = [(event, _serialize(event)) for event in events]
+        for tail_filter in rooms:
+            matched = [data for event, data in serialized if tail_filter.matches(event)]
+            for start in range(0, len(matched), self.max_batch):
+                # Each worker pushes to its own viewers; see the class docstring
+                self.socketio.emit(TAIL_EVENT, {'events': matched[start:start + self.max_batch]},
+                                   to=tail_filter.room, ignore_queue=True)
+                self.emitted += 1
+        self.flushes += 1
+
+    def stats(self):
+        """Get room and emit counters"""
+        with self._lock:
+            return {
+                'source': self.source,
+                'rooms': len(self._rooms),
+                'subscribers': len(self._members),
+                'buffered': len(self._buffer),
+                'flushes': self.flushes,
+                'emits': self.emitted
+            }
@@ -0,0 +1,177 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+HASH_SCHEME = 'pbkdf2_sha256'
+
+
+class UserStoreBusy(Exception):
+    """Raised when too many password hashes are already queued"""
+
+
+class UserStore:
+    """User accounts kept in memory and persisted to a JSON file
+
+    The file is read once and re-read only when its mtime or size changes.
+    Writes go to a temporary file that is renamed over the original under a
+    lock, so concurrent signups can't lose accounts. Passwords are stored as
+    salted PBKDF2 hashes; hashing runs on a small bounded executor so a burst
+    of logins queues there instead of tying up every request worker.
+    """
+
+    def __init__(self, path, iterations=200000, hash_workers=2, max_pending=32, wait_timeout=5.0):
+        self.path = path
+        self.iterations = iterations
+        self.wait_timeout = wait_timeout
+        self._executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.RLock()
+        self._users = {}
+        self._signature = None
+        # Compared against when the username is unknown so timing doesn't reveal it
+        self._dummy_hash = self._hash_password(secrets.token_hex(8))
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """Reload the index if the file changed on disk"""
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return
+            users = {}
+            if signature is not None:
+                with open(self.path, 'r') as f:
+                    users = json.load(f)
+            self._users = users
+            self._signature = signature
+
+    def _save(self, users):
+        """Atomically replace the file with users; caller holds the write lock"""
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.users-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(users, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._users = users
+        self._signature = self._stat_signature()
+
+    def _write_lock(self):
+        """Lock file guarding read-modify-write across processes"""
+        return _FileLock(self.path + '.lock') if fcntl else _NullLock()
+
+    # Password hashing
+
+    def _hash_password(self, password, salt=None, iterations=None):
+        salt = salt or secrets.token_hex(16)
+        iterations = iterations or self.iterations
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+        return f"{HASH_SCHEME}${iterations}${salt}${digest.hex()}"
+
+    def _check_password(self, stored, password):
+        """Check password against a stored hash (or a legacy plaintext entry)"""
+        if not stored.startswith(HASH_SCHEME + '$'):
+            return hmac.compare_digest(stored.encode(), password.encode())
+        _, iterations, salt, _ = stored.split('$')
+        candidate = self._hash_password(password, salt, int(iterations))
+        return hmac.compare_digest(candidate, stored)
+
+    def _needs_rehash(self, stored):
+        if not stored.startswith(HASH_SCHEME + '$'):
+            return True
+        return int(stored.split('$')[1]) != self.iterations
+
+    def _run_hashing(self, fn, *args):
+        """Run a hashing function on the bounded executor and wait for it"""
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise UserStoreBusy('Too many pending password checks')
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    # Public API
+
+    def exists(self, username):
+        """Check whether an account exists"""
+        self._refresh()
+        return username in self._users
+
+    def authenticate(self, username, password):
+        """Check a username/password pair; upgrades legacy or outdated hashes"""
+        self._refresh()
+        stored = self._users.get(username)
+        if stored is None:
+            self._run_hashing(self._check_password, self._dummy_hash, password)
+            return False
+        if not self._run_hashing(self._check_password, stored, password):
+            return False
+        if self._needs_rehash(stored):
+            hashed = self._run_hashing(self._hash_password, password)
+            with self._lock, self._write_lock():
+                self._signature = None
+                self._refresh()
+                if self._users.get(username) == stored:
+                    self._save(dict(self._users, **{username: hashed}))
+        return True
+
+    def create(self, username, password):
+        """Create an account; returns False if the username is taken"""
+        if self.exists(username):
+            return False
+        hashed = self._run_hashing(self._hash_password, password)
+        with self._lock, self._write_lock():
+            # Re-read under the lock so a concurrent signup isn't overwritten
+            self._signature = None
+            self._refresh()
+            if username in self._users:
+                return False
+            self._save(dict(self._users, **{username: hashed}))
+        return True
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
@@ -0,0 +1,182 @@
+"""Per-connection wire codecs for Socket.IO emits
+
+Clients get the default JSON text packets unless they ask for MessagePack
+when connecting (auth {'codec': 'msgpack'} or ?codec=msgpack). Emits to
+them then go out as a single binary frame in the packet layout of
+socketio.msgpack_packet and socket.io-msgpack-parser, while JSON clients
+on the same server keep getting text packets. Only the server-to-client
+direction changes: clients keep sending JSON, so the server's parser is
+the stock one.
+
+Top-level datetime values of an emitted dict are sent as
+'%Y-%m-%d %H:%M:%S' strings to JSON clients and as integer epoch seconds
+to MessagePack clients.
+
+MessagePack is not smaller for every event. Its frame is a map with
+'type', 'data' and 'nsp' keys, the layout socket.io-msgpack-parser
+reads, and that envelope costs about 16 bytes more than the '42[...]'
+framing of a JSON text packet. Payloads only come out smaller once
+dropping JSON's quotes, separators and decimal digits saves more than
+that. Small deltas such as server_stats_update are a few bytes larger;
+message, batch and connection events are 7-15% smaller. The steady win
+is encode cost (see benchmarks/wire_codecs.py).
+
+MessagePack needs the msgpack package; without it every connection stays
+on JSON.
+"""
+import asyncio
+import datetime
+
+import socketio
+from socketio import packet
+
+try:
+    import msgpack
+except ImportError:  # optional: every connection negotiates JSON
+    msgpack = None
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def available_codecs():
+    return (JSON, MSGPACK) if msgpack is not None else (JSON,)
+
+
+def _wire_value(value, codec):
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp()) if codec == MSGPACK else value.strftime(TIMESTAMP_FORMAT)
+    return value
+
+
+def payload_for(data, codec):
+    """data with top-level datetime values in the form clients of codec expect"""
+    if isinstance(data, dict) and any(isinstance(value, datetime.datetime) for value in data.values()):
+        return {key: _wire_value(value, codec) for key, value in data.items()}
+    return data
+
+
+def _event_args(event, data):
+    # Same expansion as Server._emit_internal: a tuple is several arguments
+    if isinstance(data, tuple):
+        args = list(data)
+    elif data is not None:
+        args = [data]
+    else:
+        args = []
+    return [event] + args
+
+
+class JSONPacket(packet.Packet):
+    """The default JSON packet, with datetimes in emitted dicts as text timestamps
+
+    Used as the server's serializer, so JSON clients see the same payloads
+    whichever client manager sends them. The encoding is kept, so one
+    packet sent to many clients is serialized once.
+    """
+
+    _encoded = None
+
+    def encode(self):
+        if self._encoded is None:
+            if self.data and isinstance(self.data, list):
+                self.data = [payload_for(arg, JSON) for arg in self.data]
+            self._encoded = super().encode()
+        return self._encoded
+
+
+class MsgPackEventPacket(packet.Packet):
+    """EVENT packet encoded as one MessagePack frame, as socketio.msgpack_packet does"""
+
+    uses_binary_events = False
+    _encoded = None
+
+    def encode(self):
+        if self._encoded is None:
+            self.data = [payload_for(arg, MSGPACK) for arg in self.data]
+            self._encoded = msgpack.packb(self._to_dict())
+        return self._encoded
+
+
+def event_packet(codec, event, data, namespace='/', json_packet_class=JSONPacket):
+    """EVENT packet carrying an emit in one codec"""
+    packet_class = MsgPackEventPacket if codec == MSGPACK else json_packet_class
+    return packet_class(packet.EVENT, namespace=namespace, data=_event_args(event, data))
+
+
+def use_codec(server, sid, requested, enabled=True):
+    """Record the codec a new connection asked for; returns the one it will get
+
+    Falls back to JSON when MessagePack is disabled or unavailable, or the
+    server's client manager can't send per-connection codecs (a Redis or
+    AMQP message queue).
+    """
+    manager = server.manager
+    if not enabled or requested != MSGPACK or msgpack is None or not hasattr(manager, 'codecs'):
+        return JSON
+    manager.codecs[sid] = MSGPACK
+    return MSGPACK
+
+
+class CodecManager(socketio.BaseManager):
+    """Client manager that sends every client its negotiated codec
+
+    An emit is encoded once per codec among its recipients rather than
+    once per recipient, and still goes out through Server._send_packet.
+    Emits with a callback need a packet id per recipient, so they take the
+    stock JSON path.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # sid -> codec, for connections that negotiated something other than JSON
+        self.codecs = {}
+
+    def _recipients(self, namespace, room, skip_sid):
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        for sid, eio_sid in self.get_participants(namespace, room):
+            if sid not in skip_sid:
+                yield sid, eio_sid
+
+    def _packets(self, event, data, namespace, room, skip_sid):
+        """(eio_sid, packet) per recipient; recipients on the same codec share a packet"""
+        packets = {}
+        for sid, eio_sid in self._recipients(namespace, room, skip_sid):
+            codec = self.codecs.get(sid, JSON)
+            pkt = packets.get(codec)
+            if pkt is None:
+                pkt = packets[codec] = event_packet(codec, event, data, namespace, self.server.packet_class)
+            yield eio_sid, pkt
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        if callback is not None:
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        if namespace not in self.rooms:
+            return
+        for eio_sid, pkt in self._packets(event, data, namespace, room, skip_sid):
+            self.server._send_packet(eio_sid, pkt)
+
+    def disconnect(self, sid, namespace, **kwargs):
+        self.codecs.pop(sid, None)
+        return super().disconnect(sid, namespace, **kwargs)
+
+
+class AsyncCodecManager(CodecManager, socketio.AsyncManager):
+    """CodecManager for socketio.AsyncServer (vpn/asgi.py)"""
+
+    async def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        if callback is not None:
+            return await socketio.AsyncManager.emit(
+                self, event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        if namespace not in self.rooms:
+            return
+        sends = [self.server._send_packet(eio_sid, pkt)
+                 for eio_sid, pkt in self._packets(event, data, namespace, room, skip_sid)]
+        if sends:
+            await asyncio.gather(*sends)
+
+    async def disconnect(self, sid, namespace, **kwargs):
+        self.codecs.pop(sid, None)
+        return await socketio.AsyncManager.disconnect(self, sid, namespace, **kwargs)
@@ -0,0 +1,82 @@
+import threading
+from collections import deque
+
+
+class OrderedTaskRunner:
+    """Run tasks in the background, one at a time per key
+
+    Tasks submitted under the same key (a client id) run in submission order;
+    different keys run concurrently. A key only holds a background task while
+    it has work queued, so idle clients cost nothing.
+    """
+
+    def __init__(self, spawn):
+        # spawn(fn) starts fn in the background, e.g. socketio.start_background_task
+        self.spawn = spawn
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, fn, *args):
+        """Queue fn(*args) to run after earlier tasks for the same key"""
+        with self._lock:
+            self.submitted += 1
+            tasks = self._pending.get(key)
+            if tasks is not None:
+                tasks.append((fn, args))
+                return
+            self._pending[key] = deque([(fn, args)])
+        try:
+            self.spawn(self._drain, key)
+        except Exception:
+            # No drain is running for key, so nothing queued under it would
+            # ever run; drop it so the next submit can spawn again
+            with self._lock:
+                tasks = self._pending.pop(key, ())
+                self.failed += len(tasks)
+            raise
+
+    def _drain(self, key):
+        """Run queued tasks for key until none are left"""
+        while True:
+            with self._lock:
+                tasks = self._pending[key]
+                if not tasks:
+                    del self._pending[key]
+                    return
+                fn, args = tasks.popleft()
+            try:
+                fn(*args)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+            else:
+                with self._lock:
+                    self.completed += 1
+
+    def stats(self):
+        """Get task counters"""
+        with self._lock:
+            return {
+                'busy_keys': len(self._pending),
+                'queued': sum(len(tasks) for tasks in self._pending.values()),
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+
+def start_daemon_task(socketio, target, *args):
+    """Start a long-running background loop that must not block shutdown
+
+    Under the threading async mode socketio.start_background_task creates
+    non-daemon threads, which would keep the process alive after Ctrl+C, so
+    loops get a daemon thread there; other async modes use their green task.
+    """
+    if socketio.async_mode == 'threading':
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+    return socketio.start_background_task(target, *args)